@@ -1,5 +1,6 @@
 # vim: tabstop=4 shiftwidth=4 softtabstop=4
 
+import uuid
 
 from keystone.common import kvs
 
@@ -9,31 +10,37 @@ class Catalog(kvs.Base):
     def get_catalog(self, user_id, tenant_id, metadata=None):
         return self.db.get('catalog-%s-%s' % (tenant_id, user_id))
 
+    def get_catalog_version(self):
+        return self.db.get('catalog_version', '')
+
     def get_service(self, service_id):
         return self.db.get('service-%s' % service_id)
 
     def list_services(self):
-        return self.db.get('service_list', [])
+        return list(self.db.smembers('service_list'))
 
     def create_service(self, service_id, service):
         self.db.set('service-%s' % service_id, service)
-        service_list = set(self.db.get('service_list', []))
-        service_list.add(service_id)
-        self.db.set('service_list', list(service_list))
+        self.db.sadd('service_list', service_id)
+        self._bump_catalog_version()
         return service
 
     def update_service(self, service_id, service):
         self.db.set('service-%s' % service_id, service)
+        self._bump_catalog_version()
         return service
 
     def delete_service(self, service_id):
         self.db.delete('service-%s' % service_id)
-        service_list = set(self.db.get('service_list', []))
-        service_list.remove(service_id)
-        self.db.set('service_list', list(service_list))
+        self.db.srem('service_list', service_id)
+        self._bump_catalog_version()
         return None
 
     # Private interface
     def _create_catalog(self, user_id, tenant_id, data):
         self.db.set('catalog-%s-%s' % (tenant_id, user_id), data)
+        self._bump_catalog_version()
         return data
+
+    def _bump_catalog_version(self):
+        self.db.set('catalog_version', uuid.uuid4().hex)
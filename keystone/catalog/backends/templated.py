@@ -1,6 +1,10 @@
 # vim: tabstop=4 shiftwidth=4 softtabstop=4
 
+import os
+import re
+
 from keystone import config
+from keystone.common import cache
 from keystone.common import logging
 from keystone.catalog.backends import kvs
 
@@ -9,6 +13,13 @@ CONF = config.CONF
 config.register_str('template_file', group='catalog')
 
 
+# substitution slots in a template value, after $( has become %(
+SLOT_RE = re.compile(r'%\((\w+)\)')
+
+# slots filled in per request rather than from the config
+REQUEST_KEYS = ('tenant_id', 'user_id')
+
+
 class TemplatedCatalog(kvs.Catalog):
     """A backend that generates endpoints for the Catalog based on templates.
 
@@ -26,6 +37,12 @@ class TemplatedCatalog(kvs.Catalog):
     When expanding the template it will pass in a dict made up of the conf
     instance plus a few additional key-values, notably tenant_id and user_id.
 
+    Templates are compiled once when loaded, values without any substitutions
+    are kept as they are and the rest only look up the keys they use. Rendered
+    catalogs are kept in an LRU of ``[catalog] cache_size`` entries keyed by
+    the tenant, the user and the config values the templates use. The
+    template file is loaded again if it is modified.
+
     It does not care what the keys and values are but it is worth noting that
     keystone_compat will expect certain keys to be there so that it can munge
     them into the output format keystone expects. These keys are:
@@ -42,13 +59,28 @@ class TemplatedCatalog(kvs.Catalog):
     """
 
     def __init__(self, templates=None):
+        self.template_file = None
+        self.template_mtime = None
         if templates:
             self.templates = templates
         else:
-            self._load_templates(CONF.catalog.template_file)
+            self.template_file = CONF.catalog.template_file
+            self._load_templates(self.template_file)
+        self._compile_templates()
+        self.catalog_cache = cache.LRUCache(maxsize=CONF.catalog.cache_size)
         super(TemplatedCatalog, self).__init__()
 
+    def _check_templates(self):
+        """Reload the template file if it changed since it was loaded."""
+        if self.template_file is None:
+            return
+        if os.stat(self.template_file).st_mtime != self.template_mtime:
+            self._load_templates(self.template_file)
+            self._compile_templates()
+            self.catalog_cache.clear()
+
     def _load_templates(self, template_file):
+        self.template_mtime = os.stat(template_file).st_mtime
         o = {}
         for line in open(template_file):
             if ' = ' not in line:
@@ -74,18 +106,60 @@ class TemplatedCatalog(kvs.Catalog):
 
         self.templates = o
 
-    def get_catalog(self, user_id, tenant_id, metadata=None):
-        d = dict(CONF.iteritems())
-        d.update({'tenant_id': tenant_id,
-                  'user_id': user_id})
+    def _compile_templates(self):
+        """Split the templates into fixed values and substitution slots.
 
-        o = {}
+        Sets `compiled` to a list of (region, service, key, value, needs_subst)
+        and `conf_keys` to the config options the templates refer to.
+
+        """
+        compiled = []
+        conf_keys = set()
         for region, region_ref in self.templates.iteritems():
-            o[region] = {}
             for service, service_ref in region_ref.iteritems():
-                o[region][service] = {}
                 for k, v in service_ref.iteritems():
                     v = v.replace('$(', '%(')
-                    o[region][service][k] = v % d
+                    needs_subst = '%' in v
+                    if needs_subst:
+                        conf_keys.update(SLOT_RE.findall(v))
+                    compiled.append((region, service, k, v, needs_subst))
+        conf_keys.difference_update(REQUEST_KEYS)
+
+        self.compiled = compiled
+        self.conf_keys = sorted(conf_keys)
 
+    def _render(self, d):
+        o = {}
+        for region, service, k, v, needs_subst in self.compiled:
+            region_ref = o.setdefault(region, {})
+            service_ref = region_ref.setdefault(service, {})
+            if needs_subst:
+                v = v % d
+            service_ref[k] = v
         return o
+
+    def _conf_values(self):
+        return tuple(getattr(CONF, k) for k in self.conf_keys)
+
+    def get_catalog_version(self):
+        self._check_templates()
+        return (self.template_mtime, self._conf_values())
+
+    def get_catalog(self, user_id, tenant_id, metadata=None):
+        self._check_templates()
+        # config values are part of the key as they may change at runtime
+        conf_values = self._conf_values()
+        cache_key = (tenant_id, user_id, conf_values)
+        o = self.catalog_cache.get(cache_key)
+        if o is None:
+            d = dict(zip(self.conf_keys, conf_values))
+            d.update({'tenant_id': tenant_id,
+                      'user_id': user_id})
+            o = self._render(d)
+            self.catalog_cache.set(cache_key, o)
+
+        # callers are free to modify what they are given
+        return dict((region, dict((service, service_ref.copy())
+                                  for service, service_ref
+                                  in region_ref.iteritems()))
+                    for region, region_ref in o.iteritems())
@@ -7,11 +7,60 @@ import uuid
 import webob.exc
 
 from keystone import config
+from keystone.common import cache
 from keystone.common import manager
 from keystone.common import wsgi
 
 
 CONF = config.CONF
+config.register_int('cache_size', group='catalog', default=1000)
+
+
+def format_catalog(catalog_ref):
+    """Munge catalogs from internal to output format
+    Internal catalogs look like:
+
+    {$REGION: {
+        {$SERVICE: {
+            $key1: $value1,
+            ...
+            }
+        }
+    }
+
+    The legacy api wants them to look like
+
+    [{'name': $SERVICE[name],
+      'type': $SERVICE,
+      'endpoints': [{
+          'tenantId': $tenant_id,
+          ...
+          'region': $REGION,
+          }],
+      'endpoints_links': [],
+     }]
+
+    The catalog passed in is left untouched.
+
+    """
+    if not catalog_ref:
+        return {}
+
+    services = {}
+    for region, region_ref in catalog_ref.iteritems():
+        for service, service_ref in region_ref.iteritems():
+            endpoint_ref = service_ref.copy()
+            new_service_ref = services.get(service)
+            if new_service_ref is None:
+                new_service_ref = services[service] = {
+                    'type': service,
+                    'endpoints': [],
+                    'endpoints_links': []}
+            new_service_ref['name'] = endpoint_ref.pop('name')
+            endpoint_ref['region'] = region
+            new_service_ref['endpoints'].append(endpoint_ref)
+
+    return services.values()
 
 
 class Manager(manager.Manager):
@@ -24,6 +73,25 @@ class Manager(manager.Manager):
 
     def __init__(self):
         super(Manager, self).__init__(CONF.catalog.driver)
+        self.formatted_cache = cache.LRUCache(maxsize=CONF.catalog.cache_size)
+
+    def get_formatted_catalog(self, context, user_id, tenant_id,
+                              metadata=None):
+        """Return the catalog in the legacy output format.
+
+        Formatted catalogs are cached against the backend's catalog version,
+        so they are rebuilt whenever the backend reports a change. The result
+        is shared between callers and must not be modified.
+
+        """
+        cache_key = (self.driver.get_catalog_version(), user_id, tenant_id)
+        formatted = self.formatted_cache.get(cache_key)
+        if formatted is None:
+            catalog_ref = self.driver.get_catalog(user_id, tenant_id,
+                                                  metadata=metadata)
+            formatted = format_catalog(catalog_ref)
+            self.formatted_cache.set(cache_key, formatted)
+        return formatted
 
 
 class ServiceController(wsgi.Application):
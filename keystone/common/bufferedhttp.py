@@ -29,11 +29,14 @@ BufferedHTTPResponse.
 """
 
 from urllib import quote
+import collections
 import logging
+import select
+import socket
 import time
 
-from eventlet.green.httplib import CONTINUE, HTTPConnection, HTTPMessage, \
-    HTTPResponse, HTTPSConnection, _UNKNOWN
+from eventlet.green.httplib import CONTINUE, HTTPConnection, HTTPException, \
+    HTTPMessage, HTTPResponse, HTTPSConnection, _UNKNOWN
 
 
 class BufferedHTTPResponse(HTTPResponse):
@@ -84,6 +87,7 @@ class BufferedHTTPConnection(HTTPConnection):
     def putrequest(self, method, url, skip_host=0, skip_accept_encoding=0):
         self._method = method
         self._path = url
+        self._request_time = time.time()
         return HTTPConnection.putrequest(self, method, url, skip_host,
                                          skip_accept_encoding)
 
@@ -97,7 +101,7 @@ class BufferedHTTPConnection(HTTPConnection):
         response = HTTPConnection.getresponse(self)
         logging.debug(("HTTP PERF: %(time).5f seconds to %(method)s "
                         "%(host)s:%(port)s %(path)s)"),
-           {'time': time.time() - self._connected_time, 'method': self._method,
+           {'time': time.time() - self._request_time, 'method': self._method,
             'host': self.host, 'port': self.port, 'path': self._path})
         return response
 
@@ -165,3 +169,113 @@ def http_connect_raw(ipaddr, port, method, path, headers=None,
             conn.putheader(header, value)
     conn.endheaders()
     return conn
+
+
+class HTTPConnectionPool(object):
+    """A pool of persistent HTTP/1.1 connections to a single host.
+
+    Connections are handed back to the pool once their response has been
+    read in full and reused for later requests, saving a TCP (and possibly
+    TLS) handshake per request. At most `size` idle connections are kept,
+    connections that have been idle for longer than `idle_timeout` seconds
+    or that the server has closed are discarded when checked out.
+
+    The pool never blocks, when no idle connection is available a new one is
+    opened, so it is safe to share between green threads.
+
+    """
+
+    def __init__(self, host, port, ssl=False, size=10, idle_timeout=60):
+        self.host = host
+        self.port = port
+        self.ssl = ssl
+        self.size = size
+        self.idle_timeout = idle_timeout
+        self.created = 0
+        self.reused = 0
+        self._idle = collections.deque()
+
+    def get(self):
+        """Check out a connection, reusing an idle one if it is healthy."""
+        while self._idle:
+            conn, last_used = self._idle.pop()
+            if (time.time() - last_used > self.idle_timeout
+                    or not self._is_healthy(conn)):
+                conn.close()
+                continue
+            self.reused += 1
+            return conn
+
+        self.created += 1
+        if self.ssl:
+            return HTTPSConnection('%s:%s' % (self.host, self.port))
+        return BufferedHTTPConnection('%s:%s' % (self.host, self.port))
+
+    def put(self, conn):
+        """Return a connection whose response has been read to the pool."""
+        if conn.sock is None or len(self._idle) >= self.size:
+            conn.close()
+            return
+        self._idle.append((conn, time.time()))
+
+    def request(self, method, path, headers=None, body=None,
+                query_string=None):
+        """Make a request using a pooled connection.
+
+        The response body is read in full so the connection can be reused.
+        If a reused connection turns out to have been dropped by the server
+        the request is retried once on a fresh connection.
+
+        :returns: tuple of (HTTPResponse, response body)
+        """
+        if query_string:
+            path += '?' + query_string
+
+        while True:
+            conn = self.get()
+            reused = conn.sock is not None
+            try:
+                conn.path = path
+                conn.putrequest(method, path)
+                if headers:
+                    for header, value in headers.iteritems():
+                        conn.putheader(header, value)
+                conn.endheaders()
+                if body:
+                    conn.send(body)
+                resp = conn.getresponse()
+                data = resp.read()
+            except (socket.error, HTTPException):
+                conn.close()
+                if reused:
+                    continue
+                raise
+
+            if resp.will_close:
+                conn.close()
+            else:
+                self.put(conn)
+            return resp, data
+
+    def close(self):
+        """Close all idle connections."""
+        while self._idle:
+            conn, _last_used = self._idle.pop()
+            conn.close()
+
+    @staticmethod
+    def _is_healthy(conn):
+        """Check that an idle connection has not been closed by the server.
+
+        An idle keep-alive socket should have nothing to read, if it is
+        readable the server has either closed it or sent something we did
+        not ask for, either way it can't be reused.
+
+        """
+        if conn.sock is None:
+            return False
+        try:
+            readable, _w, _x = select.select([conn.sock], [], [], 0)
+        except (socket.error, select.error, ValueError):
+            return False
+        return not readable
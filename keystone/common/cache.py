@@ -0,0 +1,103 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+"""Small in-process caches."""
+
+import time
+
+
+# indexes into the linked list entries
+_PREV, _NEXT, _KEY, _VALUE, _EXPIRES = 0, 1, 2, 3, 4
+
+
+class LRUCache(object):
+    """A bounded mapping with least-recently-used eviction and a TTL.
+
+    Entries older than `ttl` seconds are treated as missing, an individual
+    entry may be given a shorter life by passing `expires` (a unix timestamp)
+    to `set`. A `maxsize` of 0 disables the cache entirely.
+
+    Lookups are counted in `hits` and `misses`, entries pushed out to make
+    room are counted in `evictions`.
+
+    This does not lock, all operations complete without yielding so it is
+    safe to share between green threads.
+
+    """
+
+    def __init__(self, maxsize=1000, ttl=None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._map = {}
+        # circular doubly linked list, root[_NEXT] is the least recently used
+        # entry and root[_PREV] the most recent
+        self._root = root = []
+        root[:] = [root, root, None, None, None]
+
+    def __len__(self):
+        return len(self._map)
+
+    def get(self, key, default=None):
+        link = self._map.get(key)
+        if link is None:
+            self.misses += 1
+            return default
+        if link[_EXPIRES] is not None and link[_EXPIRES] <= time.time():
+            self._unlink(link)
+            self.misses += 1
+            return default
+
+        # move to the most recently used end
+        self._unlink(link)
+        self._append(link)
+        self.hits += 1
+        return link[_VALUE]
+
+    def set(self, key, value, expires=None):
+        if self.maxsize <= 0:
+            return
+        if self.ttl is not None:
+            ttl_expires = time.time() + self.ttl
+            if expires is None or ttl_expires < expires:
+                expires = ttl_expires
+
+        old = self._map.get(key)
+        if old is not None:
+            self._unlink(old)
+        self._append([None, None, key, value, expires])
+
+        while len(self._map) > self.maxsize:
+            self._unlink(self._root[_NEXT])
+            self.evictions += 1
+
+    def delete(self, key):
+        link = self._map.get(key)
+        if link is not None:
+            self._unlink(link)
+
+    def clear(self):
+        self._map.clear()
+        root = self._root
+        root[:] = [root, root, None, None, None]
+
+    def stats(self):
+        return {'size': len(self._map),
+                'maxsize': self.maxsize,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions}
+
+    def _append(self, link):
+        root = self._root
+        last = root[_PREV]
+        link[_PREV] = last
+        link[_NEXT] = root
+        last[_NEXT] = root[_PREV] = link
+        self._map[link[_KEY]] = link
+
+    def _unlink(self, link):
+        link[_PREV][_NEXT] = link[_NEXT]
+        link[_NEXT][_PREV] = link[_PREV]
+        del self._map[link[_KEY]]
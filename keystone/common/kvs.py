@@ -1,24 +1,559 @@
 # vim: tabstop=4 shiftwidth=4 softtabstop=4
 
+import bisect
+import contextlib
+import cPickle as pickle
+import fcntl
+import hashlib
+import mmap
+import os
+import struct
+import time
+
+from keystone import config
+from keystone.common import utils
+
+
+CONF = config.CONF
+config.register_str('shared_file', group='kvs')
+config.register_int('shared_slots', group='kvs', default=8192)
+config.register_int('shared_slot_size', group='kvs', default=8192)
+
+
+class FullError(Exception):
+    """There is no free slot left to store a value in."""
+
 
 class DictKvs(dict):
-    def set(self, key, value):
+    def set(self, key, value, expires=None):
         if type(value) is type({}):
             self[key] = value.copy()
-        else:
+        elif type(value) is type([]):
             self[key] = value[:]
+        else:
+            # strings, numbers, tuples and frozensets can't change under us
+            self[key] = value
 
     def delete(self, key):
         del self[key]
 
+    def sadd(self, key, *members):
+        """Add `members` to the set stored at `key`, creating it if needed."""
+        self.setdefault(key, set()).update(members)
+
+    def srem(self, key, *members):
+        """Remove `members` from the set stored at `key` if they are in it.
+
+        Sets that end up empty are deleted.
+
+        """
+        value = self.get(key)
+        if value is not None:
+            value.difference_update(members)
+            if not value:
+                del self[key]
+
+    def smembers(self, key):
+        return frozenset(self.get(key, ()))
+
+    @contextlib.contextmanager
+    def transaction(self):
+        # nothing in here yields to other greenthreads, so a run of writes
+        # can't be interleaved with others in this process anyway
+        yield self
+
 
 INMEMDB = DictKvs()
 
 
+# magic, slot count, slot size
+_FILE_HEADER = struct.Struct('<8sII')
+_MAGIC = 'KSKVS001'
+# sequence, state, key hash, expires, key length, value length
+_SLOT_HEADER = struct.Struct('<IB3xQdHI')
+_SEQ = struct.Struct('<I')
+
+_EMPTY = 0
+_USED = 1
+_DELETED = 2
+# a value too big for one slot is split over _CHUNK slots, its own slot is
+# _CHAINED and holds the generation and count of the chunks
+_CHAINED = 3
+_CHUNK = 4
+_CHAIN = struct.Struct('<II')
+_HEADS = (_USED, _CHAINED)
+
+
+class SharedKvs(object):
+    """A fixed-slot hash table in a memory-mapped file.
+
+    Every process that opens the same file sees the same data, so it can be
+    shared by the workers on a node. Writers take a lock on the file, readers
+    don't: each slot carries a sequence number that writers make odd while
+    they change the slot, and readers retry if it moved under them.
+
+    Keys hash to a slot and collisions probe the following slots. Values are
+    pickled, those that don't fit in a slot are split over as many as they
+    need, so the number of slots bounds the total size of the data rather
+    than that of each value. Values stored with an expiry stop being
+    visible once it passes and their slots are reused by later writes.
+
+    """
+
+    # how often a reader retries a slot that is being written
+    read_retries = 1000
+
+    def __init__(self, path, slots=8192, slot_size=8192):
+        self.path = path
+        self._lock_depth = 0
+        self.fd = os.open(path, os.O_RDWR | os.O_CREAT, 0600)
+        self._lock()
+        try:
+            if os.fstat(self.fd).st_size == 0:
+                os.ftruncate(self.fd, _FILE_HEADER.size + slots * slot_size)
+                os.write(self.fd, _FILE_HEADER.pack(_MAGIC, slots, slot_size))
+            else:
+                header = os.read(self.fd, _FILE_HEADER.size)
+                magic, slots, slot_size = _FILE_HEADER.unpack(header)
+                if magic != _MAGIC:
+                    raise Exception('%s is not a shared kvs file' % path)
+        finally:
+            self._unlock()
+        self.slots = slots
+        self.slot_size = slot_size
+        self.map = mmap.mmap(self.fd, _FILE_HEADER.size + slots * slot_size)
+
+    def close(self):
+        self.map.close()
+        os.close(self.fd)
+
+    def _lock(self):
+        # lockf rather than flock: processes forked after the file was opened
+        # share the open file, flock would let them all in at once
+        if not self._lock_depth:
+            fcntl.lockf(self.fd, fcntl.LOCK_EX)
+        self._lock_depth += 1
+
+    def _unlock(self):
+        self._lock_depth -= 1
+        if not self._lock_depth:
+            fcntl.lockf(self.fd, fcntl.LOCK_UN)
+
+    @contextlib.contextmanager
+    def transaction(self):
+        """Hold the lock across several writes.
+
+        Writers in other processes wait until all of them are made, readers
+        don't: they see each write as soon as it lands, so an index may point
+        at a record that isn't written yet or is already gone. Nothing in
+        here may yield to another greenthread, this process only takes the
+        lock once.
+
+        """
+        self._lock()
+        try:
+            yield self
+        finally:
+            self._unlock()
+
+    def _key(self, key):
+        if isinstance(key, unicode):
+            key = key.encode('utf-8')
+        key_hash = struct.unpack('<Q', hashlib.md5(key).digest()[:8])[0]
+        return key, key_hash
+
+    def _offset(self, index):
+        return _FILE_HEADER.size + index * self.slot_size
+
+    def _probe(self, key_hash):
+        start = key_hash % self.slots
+        for i in xrange(self.slots):
+            yield (start + i) % self.slots
+
+    def _read(self, index, with_value=True):
+        """Return a consistent (state, hash, expires, key, value) of a slot."""
+        offset = self._offset(index)
+        for i in xrange(self.read_retries):
+            seq = _SEQ.unpack_from(self.map, offset)[0]
+            if seq & 1:
+                if self._lock_depth:
+                    break
+                time.sleep(0)
+                continue
+            (seq, state, key_hash, expires,
+             key_len, value_len) = _SLOT_HEADER.unpack_from(self.map, offset)
+            start = offset + _SLOT_HEADER.size
+            end = min(start + key_len + value_len,
+                      offset + self.slot_size)
+            if with_value:
+                data = self.map[start:end]
+            else:
+                data = self.map[start:min(start + key_len, end)]
+            if _SEQ.unpack_from(self.map, offset)[0] == seq:
+                return (state, key_hash, expires,
+                        data[:key_len], data[key_len:])
+        return self._repair(index)
+
+    def _repair(self, index):
+        # a writer died half way through this slot, forget what it held
+        self._lock()
+        try:
+            offset = self._offset(index)
+            seq = _SEQ.unpack_from(self.map, offset)[0]
+            if seq & 1:
+                _SLOT_HEADER.pack_into(self.map, offset,
+                                       seq + 1, _DELETED, 0, 0, 0, 0)
+        finally:
+            self._unlock()
+        return self._read(index)
+
+    def _write(self, index, state, key_hash=0, expires=0, key='', value=''):
+        offset = self._offset(index)
+        seq = _SEQ.unpack_from(self.map, offset)[0]
+        if seq & 1:
+            seq += 1
+        _SEQ.pack_into(self.map, offset, seq + 1)
+        start = offset + _SLOT_HEADER.size
+        self.map[start:start + len(key) + len(value)] = key + value
+        _SLOT_HEADER.pack_into(self.map, offset, seq + 1, state, key_hash,
+                               expires, len(key), len(value))
+        _SEQ.pack_into(self.map, offset, (seq + 2) & 0xffffffff)
+
+    def _chunk_key(self, key, generation, number):
+        return self._key('%s\0%d\0%d' % (key, generation, number))
+
+    def _find(self, key, key_hash, with_value=True, states=_HEADS):
+        """Return the (index, state, value) of the slot holding `key`."""
+        now = time.time()
+        for index in self._probe(key_hash):
+            state, slot_hash, expires, slot_key, value = self._read(
+                    index, with_value)
+            if state == _EMPTY:
+                break
+            if (state in states and slot_hash == key_hash
+                    and slot_key == key):
+                if expires and expires <= now:
+                    break
+                return index, state, value
+        return None, None, None
+
+    def _load(self, key, key_hash):
+        """Return the pickled value of `key`, joining its chunks if any."""
+        for i in xrange(self.read_retries):
+            index, state, value = self._find(key, key_hash)
+            if state != _CHAINED:
+                return value
+            chunks = []
+            generation, count = _CHAIN.unpack(value)
+            for number in xrange(count):
+                chunk_key, chunk_hash = self._chunk_key(key, generation,
+                                                        number)
+                chunk = self._find(chunk_key, chunk_hash, states=(_CHUNK,))
+                if chunk[0] is None:
+                    break
+                chunks.append(chunk[2])
+            else:
+                return ''.join(chunks)
+            # the value was replaced while we read it, start again
+            time.sleep(0)
+        raise Exception('%s kept changing while being read' % key)
+
+    def get(self, key, default=None):
+        key, key_hash = self._key(key)
+        value = self._load(key, key_hash)
+        if value is None:
+            return default
+        return pickle.loads(value)
+
+    def __getitem__(self, key):
+        key, key_hash = self._key(key)
+        value = self._load(key, key_hash)
+        if value is None:
+            raise KeyError(key)
+        return pickle.loads(value)
+
+    def __contains__(self, key):
+        key, key_hash = self._key(key)
+        return self._find(key, key_hash, with_value=False)[0] is not None
+
+    def set(self, key, value, expires=None):
+        """Store `value`, `expires` is an optional naive utc datetime."""
+        key, key_hash = self._key(key)
+        if expires:
+            # slots keep fractions of a second, don't expire values early
+            expires = (utils.unixtime(expires)
+                       + expires.microsecond / 1000000.0)
+            if expires <= time.time():
+                self.delete(key, ignore_missing=True)
+                return
+
+        self._lock()
+        try:
+            self._store(key, key_hash, value, expires or 0)
+        finally:
+            self._unlock()
+
+    def _store(self, key, key_hash, value, expires=0):
+        """Write `value` to the slots for `key`, the caller holds the lock.
+
+        A value split over chunks gets a new generation of them, written
+        before the slot of `key` points readers at it, and the chunks it
+        replaces are freed after.
+
+        """
+        value = pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+        old = self._find(key, key_hash)
+        if _SLOT_HEADER.size + len(key) + len(value) <= self.slot_size:
+            self._put(key, key_hash, _USED, expires, value)
+        else:
+            generation = 1
+            if old[1] == _CHAINED:
+                generation = _CHAIN.unpack(old[2])[0] + 1
+            count = 0
+            start = 0
+            while start < len(value):
+                chunk_key, chunk_hash = self._chunk_key(key, generation, count)
+                room = self.slot_size - _SLOT_HEADER.size - len(chunk_key)
+                if room <= 0:
+                    raise Exception('key %s does not fit in a %s byte slot'
+                                    % (key, self.slot_size))
+                self._put(chunk_key, chunk_hash, _CHUNK, expires,
+                          value[start:start + room])
+                count += 1
+                start += room
+            self._put(key, key_hash, _CHAINED, expires,
+                      _CHAIN.pack(generation, count))
+        if old[1] == _CHAINED:
+            self._delete_chunks(key, old[2])
+
+    def _put(self, key, key_hash, state, expires, value):
+        if _SLOT_HEADER.size + len(key) + len(value) > self.slot_size:
+            raise Exception('key %s does not fit in a %s byte slot'
+                            % (key, self.slot_size))
+        states = _HEADS if state in _HEADS else (state,)
+        index = self._free_slot(key, key_hash, states)
+        if index is None:
+            self.evict_expired()
+            index = self._free_slot(key, key_hash, states)
+        if index is None:
+            raise FullError('%s is full' % self.path)
+        self._write(index, state, key_hash, expires, key, value)
+
+    def _free_slot(self, key, key_hash, states=_HEADS):
+        """Find the slot holding `key`, or the first one it can go in."""
+        now = time.time()
+        free = None
+        for index in self._probe(key_hash):
+            state, slot_hash, expires, slot_key, value = self._read(
+                    index, with_value=False)
+            if state == _EMPTY:
+                return free if free is not None else index
+            if (state in states and slot_hash == key_hash
+                    and slot_key == key):
+                return index
+            if free is None and (state == _DELETED or expires
+                                 and expires <= now):
+                free = index
+        return free
+
+    def _delete_chunks(self, key, chain):
+        generation, count = _CHAIN.unpack(chain)
+        for number in xrange(count):
+            chunk_key, chunk_hash = self._chunk_key(key, generation, number)
+            index = self._find(chunk_key, chunk_hash, with_value=False,
+                               states=(_CHUNK,))[0]
+            if index is not None:
+                self._write(index, _DELETED)
+
+    def _delete(self, key, key_hash):
+        """Free the slots of `key`, the caller holds the lock."""
+        index, state, value = self._find(key, key_hash)
+        if index is None:
+            return False
+        self._write(index, _DELETED)
+        if state == _CHAINED:
+            self._delete_chunks(key, value)
+        return True
+
+    def delete(self, key, ignore_missing=False):
+        key, key_hash = self._key(key)
+        self._lock()
+        try:
+            if not self._delete(key, key_hash) and not ignore_missing:
+                raise KeyError(key)
+        finally:
+            self._unlock()
+
+    def _update_set(self, key, update):
+        key, key_hash = self._key(key)
+        self._lock()
+        try:
+            value = self._load(key, key_hash)
+            members = set()
+            if value is not None:
+                members = pickle.loads(value)
+            update(members)
+            if members:
+                self._store(key, key_hash, members)
+            else:
+                self._delete(key, key_hash)
+        finally:
+            self._unlock()
+
+    def sadd(self, key, *members):
+        """Add `members` to the set stored at `key`, creating it if needed.
+
+        The set is updated under the lock, so concurrent writers in other
+        processes don't lose each other's changes.
+
+        """
+        self._update_set(key, lambda s: s.update(members))
+
+    def srem(self, key, *members):
+        """Remove `members` from the set stored at `key` if they are in it.
+
+        Sets that end up empty are deleted.
+
+        """
+        self._update_set(key, lambda s: s.difference_update(members))
+
+    def smembers(self, key):
+        return frozenset(self.get(key, ()))
+
+    def items(self):
+        now = time.time()
+        rv = []
+        for index in xrange(self.slots):
+            state, key_hash, expires, key, value = self._read(index)
+            if expires and expires <= now:
+                continue
+            if state == _CHAINED:
+                value = self._load(key, key_hash)
+                if value is None:
+                    continue
+            elif state != _USED:
+                continue
+            rv.append((key, pickle.loads(value)))
+        return rv
+
+    def keys(self):
+        return [key for key, value in self.items()]
+
+    def __len__(self):
+        return len(self.items())
+
+    def evict_expired(self):
+        """Free the slots of expired values, returns how many there were."""
+        self._lock()
+        try:
+            now = time.time()
+            count = 0
+            for index in xrange(self.slots):
+                state, key_hash, expires, key, value = self._read(
+                        index, with_value=False)
+                if (state not in (_EMPTY, _DELETED) and expires
+                        and expires <= now):
+                    self._write(index, _DELETED)
+                    count += 1
+            return count
+        finally:
+            self._unlock()
+
+    def clear(self):
+        self._lock()
+        try:
+            for index in xrange(self.slots):
+                self._write(index, _EMPTY)
+        finally:
+            self._unlock()
+
+
+class Index(object):
+    """A secondary index from the values of an attribute to record ids.
+
+    The ids of the records having each value are kept as a set under a key
+    of their own, so finding them costs as much as the records found rather
+    than a scan of every record. If the attribute is a list each item in it
+    is indexed.
+
+    Readers of a :class:`SharedKvs` can see an index before or after the
+    records it points at change, so check the records found with `matches`.
+
+    """
+
+    def __init__(self, name, attribute):
+        self.name = name
+        self.attribute = attribute
+
+    def key(self, value):
+        return 'index-%s-%s' % (self.name, value)
+
+    def values(self, ref):
+        value = (ref or {}).get(self.attribute)
+        if value is None:
+            return set()
+        if isinstance(value, (list, tuple, set, frozenset)):
+            return set(value)
+        return set([value])
+
+    def lookup(self, db, value):
+        """Return the ids of the records whose attribute has `value`."""
+        return db.smembers(self.key(value))
+
+    def matches(self, ref, value):
+        """Whether a record found by `lookup` still has `value`."""
+        return value in self.values(ref)
+
+    def update(self, db, record_id, old_ref=None, new_ref=None):
+        """Reindex a record after it changed.
+
+        `old_ref` is None for new records and `new_ref` is None for deleted
+        ones. Call it in the db transaction making the change, so writers
+        can't leave the index out of step with the records.
+
+        """
+        old_values = self.values(old_ref)
+        new_values = self.values(new_ref)
+        for value in old_values - new_values:
+            db.srem(self.key(value), record_id)
+        for value in new_values - old_values:
+            db.sadd(self.key(value), record_id)
+
+
+def paginate(ids, limit=None, marker=None):
+    """Return the sorted `ids` after `marker`, at most `limit` of them."""
+    ids = sorted(ids)
+    if marker is not None:
+        ids = ids[bisect.bisect_right(ids, marker):]
+    if limit is not None:
+        ids = ids[:limit]
+    return ids
+
+
+_SHARED_DBS = {}
+
+
+def get_db():
+    """The db kvs drivers use when they aren't given one.
+
+    If `[kvs] shared_file` is set it is a :class:`SharedKvs` seen by all the
+    processes using that file, otherwise a dict private to this process.
+
+    """
+    path = CONF.kvs.shared_file
+    if not path:
+        return INMEMDB
+    if path not in _SHARED_DBS:
+        _SHARED_DBS[path] = SharedKvs(path,
+                                      slots=CONF.kvs.shared_slots,
+                                      slot_size=CONF.kvs.shared_slot_size)
+    return _SHARED_DBS[path]
+
+
 class Base(object):
     def __init__(self, db=None):
         if db is None:
-            db = INMEMDB
+            db = get_db()
         elif type(db) is type({}):
             db = DictKvs(db)
         self.db = db
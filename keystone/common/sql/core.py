@@ -3,17 +3,32 @@
 """SQL backends for the various services."""
 
 
-import json
+import collections
+import itertools
+import time
 
+import eventlet
+import eventlet.corolocal
 import eventlet.db_pool
+import eventlet.event
 import sqlalchemy as sql
+from sqlalchemy import exc as sql_exc
 from sqlalchemy import types as sql_types
 from sqlalchemy.ext import declarative
 import sqlalchemy.orm
+import sqlalchemy.orm.attributes
 import sqlalchemy.pool
 import sqlalchemy.engine.url
+import sqlalchemy.event
 
 from keystone import config
+from keystone.common import logging
+
+try:
+    # the speedups make it several times faster than the stdlib module
+    import simplejson as json
+except ImportError:
+    import json
 
 
 CONF = config.CONF
@@ -25,23 +40,144 @@ ModelBase = declarative.declarative_base()
 # For exporting to other modules
 Column = sql.Column
 String = sql.String
+DateTime = sql.DateTime
 ForeignKey = sql.ForeignKey
+and_ = sql.and_
 
 
 # Special Fields
+class JsonText(object):
+    """A JsonBlob value as loaded from the database, not decoded yet."""
+
+    __slots__ = ('text',)
+
+    def __init__(self, text):
+        self.text = text
+
+
 class JsonBlob(sql_types.TypeDecorator):
+    """JSON stored as text.
+
+    Loaded values are left encoded as :class:`JsonText`, map the column with
+    :func:`lazy_json` to decode them the first time they are read. Values
+    that were never decoded are written back as they are.
+
+    """
+
     impl = sql.Text
 
     def process_bind_param(self, value, dialect):
+        if isinstance(value, JsonText):
+            return value.text
         return json.dumps(value)
 
     def process_result_value(self, value, dialect):
-        return json.loads(value)
+        if value is None:
+            return None
+        return JsonText(value)
+
+
+def lazy_json(key):
+    """Expose the JsonBlob column mapped as `key`, decoding it on first read.
+
+    For example::
+
+        _extra = sql.Column('extra', sql.JsonBlob())
+        extra = sql.lazy_json('_extra')
+
+    """
+    def get(self):
+        value = getattr(self, key)
+        if isinstance(value, JsonText):
+            value = json.loads(value.text)
+            sqlalchemy.orm.attributes.set_committed_value(self, key, value)
+        return value
+
+    def set(self, value):
+        setattr(self, key, value)
+
+    return sqlalchemy.orm.synonym(key, descriptor=property(get, set))
+
+
+def json_dict(value):
+    """Return a dict loaded from a JsonBlob column for the caller to keep.
+
+    Decodes straight into a new dict if the value hasn't been read yet rather
+    than decoding and then copying.
+
+    """
+    if isinstance(value, JsonText):
+        return json.loads(value.text)
+    return value.copy()
+
+
+def paginate(query, column, limit=None, marker=None, batch_size=100):
+    """Page through `query` ordered by the unique `column`.
+
+    Yields the rows after the one whose `column` is `marker`, at most
+    `limit` of them. They are fetched `batch_size` at a time, each batch
+    starting after the last row of the one before, so skipping ahead is an
+    index lookup however deep into the results it is, unlike an offset, and
+    only one batch is held in memory.
+
+    """
+    query = query.order_by(column)
+    while limit is None or limit > 0:
+        size = batch_size
+        if limit is not None:
+            size = min(size, limit)
+            limit -= size
+        batch = query
+        if marker is not None:
+            batch = batch.filter(column > marker)
+        rows = batch.limit(size).all()
+        for row in rows:
+            yield row
+        if len(rows) < size:
+            return
+        marker = getattr(rows[-1], column.key)
 
 
 class DictBase(object):
+    @classmethod
+    def _columns(cls):
+        """(attribute, column name) for each mapped column, found once."""
+        columns = cls.__dict__.get('_column_names')
+        if columns is None:
+            mapper = sqlalchemy.orm.class_mapper(cls)
+            columns = tuple((prop.key, prop.columns[0].name)
+                            for prop in mapper.iterate_properties
+                            if isinstance(prop, sqlalchemy.orm.ColumnProperty))
+            cls._column_names = columns
+        return columns
+
+    @classmethod
+    def columns(cls):
+        """The mapped columns, as arguments for `session.query`.
+
+        Rows queried this way skip building model objects and can be turned
+        into dicts with `row_to_dict`.
+
+        """
+        return [getattr(cls, key) for key, name in cls._columns()]
+
+    @classmethod
+    def row_to_dict(cls, row):
+        """Build the dict `to_dict` returns from a row of `columns()`.
+
+        Model objects work as well, they have the same attributes as rows.
+
+        """
+        d = {}
+        for key, name in cls._columns():
+            value = getattr(row, key)
+            if isinstance(value, JsonText):
+                value = json.loads(value.text)
+            d[name] = value
+        return d
+
     def to_dict(self):
-        return dict(self.iteritems())
+        return self.row_to_dict(self)
 
     def __setitem__(self, key, value):
         setattr(self, key, value)
@@ -53,12 +189,7 @@ class DictBase(object):
         return getattr(self, key, default)
 
     def __iter__(self):
-        self._i = iter(sqlalchemy.orm.object_mapper(self).columns)
-        return self
-
-    def next(self):
-        n = self._i.next().name
-        return n
+        return (name for key, name in self._columns())
 
     def update(self, values):
         """Make the model object behave like a dict."""
@@ -66,17 +197,185 @@ class DictBase(object):
             setattr(self, k, v)
 
     def iteritems(self):
-        """Make the model object behave like a dict.
-
-        Includes attributes from joins.
+        """Make the model object behave like a dict."""
+        return ((name, getattr(self, name)) for key, name in self._columns())
+
+
+class GreenConnectionPool(eventlet.db_pool.RawConnectionPool):
+    """A pool of DB-API connections shared by green threads.
+
+    `min_size` connections are opened up front. When all `max_size` are in
+    use, green threads wait for one to be returned, in the order they asked,
+    for at most `timeout` seconds. Waiting yields to other green threads
+    rather than blocking the whole process the way a thread lock would.
+
+    """
+
+    def __init__(self, db_module, timeout=None, *args, **kw):
+        self.timeout = timeout
+        self.checkouts = 0
+        self.waits = 0
+        self.wait_time = 0.0
+        # eventlet's own channel wakes its getters in no particular order,
+        # so waiters queue here and are woken one at a time as connections
+        # come back
+        self.waiters = collections.deque()
+        super(GreenConnectionPool, self).__init__(db_module, *args, **kw)
+
+    def get(self):
+        if self.waiters or not self.free():
+            self._wait_turn()
+        conn = super(GreenConnectionPool, self).get()
+        self.checkouts += 1
+        return conn
+
+    def put(self, conn):
+        super(GreenConnectionPool, self).put(conn)
+        self._wake_next()
+
+    def _expire_old_connections(self, now):
+        super(GreenConnectionPool, self)._expire_old_connections(now)
+        self._wake_next()
+
+    def _wait_turn(self):
+        self.waits += 1
+        start = time.time()
+        timeout = eventlet.Timeout(
+                self.timeout,
+                sql_exc.TimeoutError('No connection was returned to the '
+                                     'pool within %s seconds' % self.timeout))
+        try:
+            event = eventlet.event.Event()
+            self.waiters.append(event)
+            while True:
+                try:
+                    event.wait()
+                except BaseException:
+                    if event in self.waiters:
+                        self.waiters.remove(event)
+                    else:
+                        # woken but gave up, pass the connection on
+                        self._wake_next()
+                    raise
+                if self.free():
+                    return
+                # somebody else got there first, keep our place at the front
+                event = eventlet.event.Event()
+                self.waiters.appendleft(event)
+        finally:
+            timeout.cancel()
+            self.wait_time += time.time() - start
+
+    def _wake_next(self):
+        if self.waiters and self.free():
+            self.waiters.popleft().send()
+
+    def stats(self):
+        idle = len(self.free_items)
+        return {'size': self.current_size,
+                'max_size': self.max_size,
+                'in_use': self.current_size - idle,
+                'idle': idle,
+                'waiting': len(self.waiters),
+                'checkouts': self.checkouts,
+                'waits': self.waits,
+                'wait_time': self.wait_time}
+
+
+_ENGINES = {}
+_POOLS = {}
+_LOCAL = eventlet.corolocal.local()
+
+# replica engine -> when it is next worth trying / was last known to be up
+_REPLICAS_DOWN = {}
+_REPLICAS_CHECKED = {}
+_REPLICA_TURNS = itertools.count()
+
+
+class _WorkSession(sqlalchemy.orm.Session):
+    """A session shared by the backend calls in a :class:`UnitOfWork`."""
+
+    work = None
+
+    def begin(self, subtransactions=False, nested=False):
+        # the transactions backends begin become part of the unit of work's
+        return super(_WorkSession, self).begin(subtransactions=True,
+                                               nested=nested)
+
+    def flush(self, objects=None):
+        if self.new or self.dirty or self.deleted:
+            self.work.wrote = True
+        super(_WorkSession, self).flush(objects)
+
+    def execute(self, clause, *args, **kwargs):
+        # bulk query.update() and query.delete() write without the orm
+        # tracking any changes, only selects are known not to write
+        if not isinstance(clause, sql.sql.expression.Select):
+            self.work.wrote = True
+        return super(_WorkSession, self).execute(clause, *args, **kwargs)
+
+
+class UnitOfWork(object):
+    """Share a session between all the sql backend calls in a green thread.
+
+    While one is active `Base.get_session` returns the same session for each
+    database, in a transaction that is started on first use. On exit the
+    transaction is committed, or rolled back if the block raised, a backend
+    call failed part way or `rollback` was called. Nested units of work are
+    part of the outermost one.
+
+    Reads stick to the first replica `Base.get_read_session` picks, and go
+    to the primary once something has been written, to see the write.
+
+    """
+
+    def __init__(self):
+        self.sessions = {}
+        self.failed = False
+        self.active = False
+        self.wrote = False
+        self.read_engine = None
+
+    def __enter__(self):
+        if getattr(_LOCAL, 'work', None) is None:
+            _LOCAL.work = self
+            self.active = True
+        return self
 
-        """
-        return dict([(k, getattr(self, k)) for k in self])
-        #local = dict(self)
-        #joined = dict([(k, v) for k, v in self.__dict__.iteritems()
-        #               if not k[0] == '_'])
-        #local.update(joined)
-        #return local.iteritems()
+    def __exit__(self, exc_type, exc_value, tb):
+        if not self.active:
+            return
+        _LOCAL.work = None
+        self.active = False
+        if exc_type is not None:
+            self.failed = True
+        sessions, self.sessions = self.sessions, {}
+        self.wrote = False
+        self.read_engine = None
+        try:
+            for session in sessions.itervalues():
+                if self.failed or not session.is_active:
+                    session.rollback()
+                else:
+                    session.commit()
+        finally:
+            for session in sessions.itervalues():
+                session.close()
+
+    def rollback(self):
+        """Roll back rather than commit at the end."""
+        self.failed = True
+
+    def get_session(self, engine):
+        session = self.sessions.get(engine)
+        if session is None:
+            session = _WorkSession(bind=engine,
+                                   autocommit=True,
+                                   expire_on_commit=False)
+            session.work = self
+            session.begin()
+            self.sessions[engine] = session
+        return session
 
 
 # Backends
@@ -85,22 +384,85 @@ class Base(object):
     _ENGINE = None
 
     def get_session(self, autocommit=True, expire_on_commit=False):
-        """Return a SQLAlchemy session."""
+        """Return a SQLAlchemy session, the shared one in a UnitOfWork."""
         if self._MAKER is None or self._ENGINE is None:
             self._ENGINE = self.get_engine()
             self._MAKER = self.get_maker(self._ENGINE,
                                          autocommit,
                                          expire_on_commit)
 
+        work = getattr(_LOCAL, 'work', None)
+        if work is not None:
+            return work.get_session(self._ENGINE)
+
         session = self._MAKER()
         # TODO(termie): we may want to do something similar
         #session.query = nova.exception.wrap_db_error(session.query)
         #session.flush = nova.exception.wrap_db_error(session.flush)
         return session
 
-    def get_engine(self):
-        """Return a SQLAlchemy engine."""
-        connection_dict = sqlalchemy.engine.url.make_url(CONF.sql.connection)
+    def get_read_session(self):
+        """Return a session for reads, on a read replica if there are any.
+
+        The replicas in `[sql] read_connections` take turns. One that can't
+        be reached is left out for `[sql] replica_retry_interval` seconds and
+        if none are left the primary is used. Only use it for methods that
+        don't write, the replicas may lag a little behind the primary.
+
+        """
+        work = getattr(_LOCAL, 'work', None)
+        if work is not None:
+            if work.wrote:
+                return self.get_session()
+            if work.read_engine is not None:
+                return work.get_session(work.read_engine)
+
+        engine = self._get_replica()
+        if engine is None:
+            return self.get_session()
+        if work is not None:
+            work.read_engine = engine
+            return work.get_session(engine)
+        return sqlalchemy.orm.Session(bind=engine,
+                                      autocommit=True,
+                                      expire_on_commit=False)
+
+    def _get_replica(self):
+        connections = CONF.sql.read_connections
+        if not connections:
+            return
+        now = time.time()
+        turn = _REPLICA_TURNS.next()
+        for i in range(len(connections)):
+            connection = connections[(turn + i) % len(connections)]
+            engine = self.get_engine(connection)
+            if _REPLICAS_DOWN.get(engine, 0) > now:
+                continue
+            checked = _REPLICAS_CHECKED.get(engine, 0)
+            if checked + CONF.sql.replica_check_interval > now:
+                return engine
+            try:
+                engine.execute(sql.select([1])).close()
+            except sql_exc.DBAPIError as e:
+                _replica_failed(engine, e)
+                continue
+            _REPLICAS_CHECKED[engine] = now
+            return engine
+
+    def get_engine(self, connection=None):
+        """Return a SQLAlchemy engine, for the primary database by default.
+
+        Engines are shared by every backend using the same database. Unless
+        it is sqlite, their connections come from a
+        :class:`GreenConnectionPool` sized by the `[sql]` pool options.
+
+        """
+        if connection is None:
+            connection = CONF.sql.connection
+        if connection in _ENGINES:
+            return _ENGINES[connection]
+
+        connection_dict = sqlalchemy.engine.url.make_url(connection)
 
         engine_args = {"pool_recycle": CONF.sql.idle_timeout,
                        "echo": False,
@@ -108,11 +470,57 @@ class Base(object):
 
         if "sqlite" in connection_dict.drivername:
             engine_args["poolclass"] = sqlalchemy.pool.NullPool
-
-        return sql.create_engine(CONF.sql.connection, **engine_args)
+        else:
+            pool = self._create_pool(connection_dict)
+            _POOLS[connection] = pool
+            engine_args["poolclass"] = sqlalchemy.pool.NullPool
+            engine_args["creator"] = pool.get
+
+        engine = sql.create_engine(connection, **engine_args)
+        if connection in CONF.sql.read_connections:
+            sqlalchemy.event.listen(engine, 'dbapi_error', _check_replica)
+        _ENGINES[connection] = engine
+        return engine
+
+    def _create_pool(self, connection_dict):
+        dialect_cls = connection_dict.get_dialect()
+        dialect = dialect_cls(dbapi=dialect_cls.dbapi())
+        args, kwargs = dialect.create_connect_args(connection_dict)
+        # positional, so the connect arguments can follow: idle connections
+        # and ones older than idle_timeout are closed when checked in, which
+        # stands in for the engine's pool_recycle
+        return GreenConnectionPool(dialect.dbapi,
+                                   CONF.sql.pool_timeout,
+                                   CONF.sql.min_pool_size,
+                                   CONF.sql.max_pool_size,
+                                   CONF.sql.idle_timeout,
+                                   CONF.sql.idle_timeout,
+                                   CONF.sql.connect_timeout,
+                                   *args,
+                                   **kwargs)
+
+    def get_pool_stats(self):
+        """Return usage counters for the connection pool, if there is one."""
+        pool = _POOLS.get(CONF.sql.connection)
+        if pool is not None:
+            return pool.stats()
 
     def get_maker(self, engine, autocommit=True, expire_on_commit=False):
         """Return a SQLAlchemy sessionmaker using the given engine."""
         return sqlalchemy.orm.sessionmaker(bind=engine,
                                            autocommit=autocommit,
                                            expire_on_commit=expire_on_commit)
+
+
+def _replica_failed(engine, error):
+    url = engine.url
+    logging.warning('Read replica %s is unavailable: %s',
+                    url.host or url.database, error)
+    _REPLICAS_DOWN[engine] = time.time() + CONF.sql.replica_retry_interval
+    _REPLICAS_CHECKED.pop(engine, None)
+
+
+def _check_replica(conn, cursor, statement, parameters, context, error):
+    """Take a replica out of turn when it loses its connection mid-query."""
+    if conn.dialect.is_disconnect(error, conn.connection, cursor):
+        _replica_failed(conn.engine, error)
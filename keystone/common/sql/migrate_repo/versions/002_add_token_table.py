@@ -0,0 +1,22 @@
+from sqlalchemy import *
+from migrate import *
+
+from keystone.common import sql
+
+# this is to make sure the model we care about is defined
+import keystone.token.backends.sql
+
+
+def upgrade(migrate_engine):
+    # Upgrade operations go here. Don't create your own engine; bind
+    # migrate_engine to your metadata
+    token_table = keystone.token.backends.sql.TokenModel.__table__
+    # the table may already exist as version 001 creates every model that
+    # happens to be loaded
+    token_table.create(migrate_engine, checkfirst=True)
+
+
+def downgrade(migrate_engine):
+    # Operations to reverse the above upgrade go here.
+    token_table = keystone.token.backends.sql.TokenModel.__table__
+    token_table.drop(migrate_engine, checkfirst=True)
@@ -0,0 +1,40 @@
+import json
+
+from sqlalchemy import *
+from sqlalchemy.engine import reflection
+from migrate import *
+
+
+def upgrade(migrate_engine):
+    # Upgrade operations go here. Don't create your own engine; bind
+    # migrate_engine to your metadata
+    meta = MetaData(bind=migrate_engine)
+    token_table = Table('token', meta, autoload=True)
+
+    # the column may already exist as version 001 creates every model that
+    # happens to be loaded
+    if 'user_id' not in token_table.c:
+        user_id = Column('user_id', String(64))
+        user_id.create(token_table)
+
+        # fill in the owner of existing tokens
+        for token_id, extra in select([token_table.c.id,
+                                       token_table.c.extra]).execute():
+            user_ref = json.loads(extra).get('user') or {}
+            token_table.update()\
+                       .where(token_table.c.id == token_id)\
+                       .values(user_id=user_ref.get('id'))\
+                       .execute()
+
+    inspector = reflection.Inspector.from_engine(migrate_engine)
+    index_names = [x['name'] for x in inspector.get_indexes('token')]
+    if 'ix_token_user_id' not in index_names:
+        Index('ix_token_user_id', token_table.c.user_id).create()
+
+
+def downgrade(migrate_engine):
+    # Operations to reverse the above upgrade go here.
+    meta = MetaData(bind=migrate_engine)
+    token_table = Table('token', meta, autoload=True)
+    Index('ix_token_user_id', token_table.c.user_id).drop()
+    token_table.c.user_id.drop()
@@ -0,0 +1,41 @@
+from sqlalchemy import *
+from sqlalchemy.engine import reflection
+from migrate import *
+
+
+# (table, index name, columns) for lookups not already served by a primary
+# key or unique constraint
+INDEXES = [('user_tenant_membership', 'ix_user_tenant_membership_tenant_id',
+            ['tenant_id']),
+           ('ec2_credential', 'ix_ec2_credential_user_id', ['user_id'])]
+
+
+def _indexes(migrate_engine):
+    meta = MetaData(bind=migrate_engine)
+    inspector = reflection.Inspector.from_engine(migrate_engine)
+    table_names = inspector.get_table_names()
+    for table_name, index_name, columns in INDEXES:
+        if table_name not in table_names:
+            continue
+        table = Table(table_name, meta, autoload=True)
+        existing = [x['name'] for x in inspector.get_indexes(table_name)]
+        yield (Index(index_name, *[table.c[x] for x in columns]),
+               index_name in existing)
+
+
+def upgrade(migrate_engine):
+    # Upgrade operations go here. Don't create your own engine; bind
+    # migrate_engine to your metadata
+
+    # the indexes may already exist as version 001 creates every model that
+    # happens to be loaded
+    for index, exists in _indexes(migrate_engine):
+        if not exists:
+            index.create()
+
+
+def downgrade(migrate_engine):
+    # Operations to reverse the above upgrade go here.
+    for index, exists in _indexes(migrate_engine):
+        if exists:
+            index.drop()
@@ -18,21 +18,40 @@
 #    under the License.
 
 import base64
+import calendar
+import datetime
 import hashlib
 import hmac
 import json
+import os
 import subprocess
 import sys
 import urllib
 
 import bcrypt
+from eventlet import semaphore
+from eventlet import tpool
 
 from keystone import config
+from keystone.common import cache
 from keystone.common import logging
 
 
 CONF = config.CONF
 config.register_int('bcrypt_strength', default=12)
+config.register_int('password_cache_size', default=1000)
+config.register_int('password_cache_ttl', default=60)
+config.register_int('crypt_pool_size', default=4)
+
+
+# keys the digests held in the verified password cache, it never leaves the
+# process so a dump of the cache can't be used to test guesses offline
+_PASSWORD_CACHE_KEY = os.urandom(32)
+_password_cache = None
+_crypt_pool = None
+
+
+TIME_FORMAT = '%Y-%m-%dT%H:%M:%SZ'
 
 
 def import_class(import_str):
@@ -57,13 +76,27 @@ def import_object(import_str, *args, **kw):
 
 
 class SmarterEncoder(json.JSONEncoder):
-    """Help for JSON encoding dict-like objects."""
+    """Help for JSON encoding dict-like objects and datetimes."""
     def default(self, obj):
         if not isinstance(obj, dict) and hasattr(obj, 'iteritems'):
             return dict(obj.iteritems())
+        if isinstance(obj, datetime.datetime):
+            return isotime(obj)
         return super(SmarterEncoder, self).default(obj)
 
 
+def isotime(at=None):
+    """Format a naive utc datetime (default now) as an ISO 8601 string."""
+    if at is None:
+        at = datetime.datetime.utcnow()
+    return at.strftime(TIME_FORMAT)
+
+
+def unixtime(at):
+    """Convert a naive utc datetime to a unix timestamp."""
+    return calendar.timegm(at.utctimetuple())
+
+
 class Ec2Signer(object):
     """Hacked up code from boto/connection.py"""
 
@@ -141,10 +174,96 @@ class Ec2Signer(object):
         return b64
 
 
+class CryptPool(object):
+    """Runs bcrypt in native threads so it doesn't hold up the hub.
+
+    At most `size` hashes are computed at once, green threads beyond that
+    wait their turn; `stats` reports how many are running and waiting, and
+    the most that have waited at once. A `size` of 0 runs hashes in the
+    calling green thread.
+
+    The threads are eventlet's tpool, sized by the EVENTLET_THREADPOOL_SIZE
+    environment variable (20 by default); a `size` above that only queues
+    the extra hashes in tpool.
+
+    """
+
+    def __init__(self, size):
+        self.size = size
+        self.semaphore = semaphore.Semaphore(max(size, 1))
+        self.active = 0
+        self.waiting = 0
+        self.peak_waiting = 0
+        self.calls = 0
+
+    def execute(self, func, *args):
+        if not self.size:
+            self.calls += 1
+            return func(*args)
+
+        self.waiting += 1
+        self.peak_waiting = max(self.peak_waiting, self.waiting)
+        try:
+            self.semaphore.acquire()
+        finally:
+            self.waiting -= 1
+
+        self.active += 1
+        self.calls += 1
+        try:
+            return tpool.execute(func, *args)
+        finally:
+            self.active -= 1
+            self.semaphore.release()
+
+    def stats(self):
+        return {'size': self.size,
+                'active': self.active,
+                'waiting': self.waiting,
+                'peak_waiting': self.peak_waiting,
+                'calls': self.calls}
+
+
+def get_crypt_pool():
+    global _crypt_pool
+    if _crypt_pool is None:
+        _crypt_pool = CryptPool(CONF.crypt_pool_size)
+    return _crypt_pool
+
+
+def get_crypt_pool_stats():
+    """Return queue depth counters for the password hashing pool."""
+    return get_crypt_pool().stats()
+
+
 def hash_password(password):
     """Hash a password. Hard."""
     salt = bcrypt.gensalt(CONF.bcrypt_strength)
-    return bcrypt.hashpw(password, salt)
+    return get_crypt_pool().execute(bcrypt.hashpw, password, salt)
+
+
+def _get_password_cache():
+    global _password_cache
+    if _password_cache is None:
+        _password_cache = cache.LRUCache(maxsize=CONF.password_cache_size,
+                                         ttl=CONF.password_cache_ttl)
+    return _password_cache
+
+
+def _password_digest(password):
+    if isinstance(password, unicode):
+        password = password.encode('utf-8')
+    return hmac.new(_PASSWORD_CACHE_KEY, password, hashlib.sha256).digest()
+
+
+def auth_str_equal(provided, known):
+    """Compare two strings in time that doesn't depend on where they differ."""
+    if len(provided) != len(known):
+        return False
+    result = 0
+    for x, y in zip(provided, known):
+        result |= ord(x) ^ ord(y)
+    return result == 0
 
 
 def check_password(password, hashed):
@@ -154,9 +273,39 @@ def check_password(password, hashed):
     version of that password as salt will return the hashed version
     of that password (mostly). Neat!
 
+    Successful checks are remembered for ``password_cache_ttl`` seconds,
+    keyed by the hash and holding only an HMAC of the password, so that
+    repeated logins don't each pay for bcrypt.
+
     """
-    check = bcrypt.hashpw(password, hashed[:29])
-    return check == hashed
+    if password is None or not hashed:
+        return False
+    password_cache = _get_password_cache()
+    digest = _password_digest(password)
+    cached = password_cache.get(hashed)
+    if cached is not None and auth_str_equal(digest, cached):
+        return True
+
+    check = get_crypt_pool().execute(bcrypt.hashpw, password, hashed[:29])
+    if not auth_str_equal(check, hashed):
+        return False
+    password_cache.set(hashed, digest)
+    return True
+
+
+def forget_password(hashed):
+    """Drop any cached successful checks against a password hash."""
+    if hashed:
+        _get_password_cache().delete(hashed)
+
+
+def password_needs_rehash(hashed):
+    """Whether a hash was made with a cost other than ``bcrypt_strength``."""
+    # bcrypt hashes look like $2a$<cost>$<salt and hash>, gensalt applies
+    # the limits bcrypt places on the cost
+    wanted = bcrypt.gensalt(CONF.bcrypt_strength)
+    parts = hashed.split('$')
+    return len(parts) < 4 or parts[2] != wanted.split('$')[2]
 
 
 # From python 2.7
@@ -0,0 +1,156 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+"""Pre-forked worker processes sharing listening sockets."""
+
+import errno
+import os
+import signal
+import time
+
+import eventlet
+
+from keystone.common import logging
+
+
+class SignalExit(SystemExit):
+    def __init__(self, signo, graceful=False):
+        super(SignalExit, self).__init__(1)
+        self.signo = signo
+        self.graceful = graceful
+
+
+class Supervisor(object):
+    """Forks worker processes and keeps them running.
+
+    `start` is called in each worker after the fork, it should start serving
+    on sockets bound by the parent and return the servers it started; each
+    needs `stop` and `wait` methods like :class:`keystone.common.wsgi.Server`.
+
+    In the parent, SIGTERM and SIGINT stop the workers and exit, SIGHUP calls
+    `reload` and then restarts the workers gracefully: each stops accepting
+    connections and finishes the requests it has, for up to `drain_timeout`
+    seconds, before it is replaced. Workers that die are replaced as well.
+
+    """
+
+    # don't fork more often than this if workers keep dying straight away
+    respawn_delay = 1
+
+    def __init__(self, workers, start, reload=None, drain_timeout=30):
+        self.workers = workers
+        self.start = start
+        self.reload = reload
+        self.drain_timeout = drain_timeout
+        self.children = {}
+        self.running = False
+        self.restart_requested = False
+
+    def run(self):
+        """Run the workers until told to stop. Only returns in the parent."""
+        self.running = True
+        signal.signal(signal.SIGTERM, self._handle_stop)
+        signal.signal(signal.SIGINT, self._handle_stop)
+        signal.signal(signal.SIGHUP, self._handle_restart)
+
+        while self.running:
+            while self.running and len(self.children) < self.workers:
+                self._spawn()
+
+            try:
+                pid, status = os.wait()
+            except OSError as e:
+                if e.errno != errno.EINTR:
+                    raise
+            else:
+                self._reap(pid, status)
+
+            if self.restart_requested:
+                self.restart_requested = False
+                self._restart()
+
+        self._stop_children()
+
+    def _handle_stop(self, signo, frame):
+        self.running = False
+
+    def _handle_restart(self, signo, frame):
+        self.restart_requested = True
+
+    def _spawn(self):
+        pid = os.fork()
+        if pid == 0:
+            self._run_child()
+        logging.info('Started worker %s', pid)
+        self.children[pid] = time.time()
+        return pid
+
+    def _reap(self, pid, status):
+        started = self.children.pop(pid, None)
+        if started is None:
+            return
+        logging.info('Worker %s exited with status %s', pid, status)
+        if self.running and time.time() - started < self.respawn_delay:
+            time.sleep(self.respawn_delay)
+
+    def _restart(self):
+        if self.reload is not None:
+            self.reload()
+        for pid in self.children:
+            self._signal_child(pid, signal.SIGHUP)
+
+    def _stop_children(self):
+        for pid in self.children:
+            self._signal_child(pid, signal.SIGTERM)
+        while self.children:
+            try:
+                pid, status = os.wait()
+            except OSError as e:
+                if e.errno == errno.ECHILD:
+                    break
+                if e.errno != errno.EINTR:
+                    raise
+            else:
+                self.children.pop(pid, None)
+
+    def _signal_child(self, pid, signo):
+        try:
+            os.kill(pid, signo)
+        except OSError as e:
+            if e.errno != errno.ESRCH:
+                raise
+
+    def _run_child(self):
+        """Serve in a worker, never returns."""
+        status = 0
+        try:
+            signal.signal(signal.SIGTERM, self._child_exit)
+            signal.signal(signal.SIGINT, self._child_exit)
+            signal.signal(signal.SIGHUP, self._child_exit_gracefully)
+            servers = self.start()
+            try:
+                for server in servers:
+                    server.wait()
+            except SignalExit as e:
+                if e.graceful:
+                    self._drain(servers)
+        except SignalExit:
+            pass
+        except BaseException:
+            logging.exception('Worker %s failed', os.getpid())
+            status = 1
+        finally:
+            os._exit(status)
+
+    def _drain(self, servers):
+        signal.signal(signal.SIGHUP, signal.SIG_IGN)
+        for server in servers:
+            server.stop()
+        with eventlet.Timeout(self.drain_timeout, False):
+            for server in servers:
+                server.wait()
+
+    def _child_exit(self, signo, frame):
+        raise SignalExit(signo)
+
+    def _child_exit_gracefully(self, signo, frame):
+        raise SignalExit(signo, graceful=True)
@@ -21,20 +21,27 @@
 
 import json
 import logging
+import re
 import sys
+import types
 
 import eventlet
 import eventlet.wsgi
 eventlet.patcher.monkey_patch(all=False, socket=True, time=True)
 import routes
 import routes.middleware
+import routes.util
 import webob
 import webob.dec
 import webob.exc
 
+from keystone import config
 from keystone.common import utils
 
 
+CONF = config.CONF
+
+
 class WritableLogger(object):
     """A thin wrapper that responds to `write` and logs."""
 
@@ -54,18 +61,37 @@ class Server(object):
         self.port = port
         self.pool = eventlet.GreenPool(threads)
         self.socket_info = {}
+        self.socket = None
+        self._server = None
+
+    def listen(self, host='0.0.0.0', backlog=128):
+        """Bind the listening socket without serving on it yet.
+
+        This lets a parent process bind before forking workers that all
+        serve on the same socket.
+
+        """
+        if self.socket is None:
+            logging.debug('Starting %(arg0)s on %(host)s:%(port)s' % \
+                          {'arg0': sys.argv[0],
+                           'host': host,
+                           'port': self.port})
+            self.socket = eventlet.listen((host, self.port), backlog=backlog)
+        return self.socket
 
     def start(self, host='0.0.0.0', key=None, backlog=128):
         """Run a WSGI server with the given application."""
-        logging.debug('Starting %(arg0)s on %(host)s:%(port)s' % \
-                      {'arg0': sys.argv[0],
-                       'host': host,
-                       'port': self.port})
-        socket = eventlet.listen((host, self.port), backlog=backlog)
-        self.pool.spawn_n(self._run, self.application, socket)
+        socket = self.listen(host, backlog)
+        self._server = self.pool.spawn(self._run, self.application, socket)
         if key:
             self.socket_info[key] = socket.getsockname()
 
+    def stop(self):
+        """Stop accepting connections, requests in progress carry on."""
+        if self._server is not None:
+            self._server.kill()
+            self._server = None
+
     def wait(self):
         """Wait until all servers have completed running."""
         try:
@@ -149,6 +175,49 @@ class BaseApplication(object):
         raise NotImplementedError('You must implement __call__')
 
 
+class JsonStream(dict):
+    """A result sent as JSON a piece at a time rather than in one string.
+
+    Lists and generators in it are written an item at a time, buffered up
+    to `chunk_size` bytes, so a long listing never has to be held in memory
+    as JSON, nor at all when a driver yields it.
+
+    """
+
+    chunk_size = 65536
+
+    def iterencode(self):
+        """Yield the JSON encoding of the result in chunks."""
+        chunks = []
+        size = 0
+        for chunk in self._encode(self):
+            chunks.append(chunk)
+            size += len(chunk)
+            if size >= self.chunk_size:
+                yield ''.join(chunks)
+                chunks = []
+                size = 0
+        if chunks:
+            yield ''.join(chunks)
+
+    def _encode(self, obj):
+        if isinstance(obj, dict):
+            yield '{'
+            for i, (key, value) in enumerate(obj.iteritems()):
+                yield '%s%s: ' % (i and ', ' or '', json.dumps(key))
+                for chunk in self._encode(value):
+                    yield chunk
+            yield '}'
+        elif isinstance(obj, (list, types.GeneratorType)):
+            yield '['
+            for i, value in enumerate(obj):
+                yield '%s%s' % (i and ', ' or '',
+                                json.dumps(value, cls=utils.SmarterEncoder))
+            yield ']'
+        else:
+            yield json.dumps(obj, cls=utils.SmarterEncoder)
+
+
 class Application(BaseApplication):
     @webob.dec.wsgify
     def __call__(self, req):
@@ -159,6 +228,7 @@ class Application(BaseApplication):
         logging.debug('arg_dict: %s', arg_dict)
 
         context = req.environ.get('openstack.context', {})
+        context['query_string'] = dict(req.GET.iteritems())
         # allow middleware up the stack to override the params
         params = {}
         if 'openstack.params' in req.environ:
@@ -176,12 +246,38 @@ class Application(BaseApplication):
             return result
         elif isinstance(result, webob.exc.WSGIHTTPException):
             return result
+        elif isinstance(result, JsonStream):
+            return webob.Response(app_iter=result.iterencode())
 
         return self._serialize(result)
 
     def _serialize(self, result):
         return json.dumps(result, cls=utils.SmarterEncoder)
 
+    def _get_page(self, context):
+        """Return the `limit` and `marker` query parameters of a listing.
+
+        Without a `limit` at most ``list_limit`` entries are listed if that
+        is set, otherwise all of them. A `limit` is never more than
+        ``max_list_limit``.
+
+        """
+        query = context.get('query_string', {})
+        limit = query.get('limit')
+        if limit is None:
+            limit = CONF.list_limit
+            if limit is None:
+                return None, query.get('marker')
+        else:
+            try:
+                limit = int(limit)
+            except ValueError:
+                limit = -1
+            if limit < 0:
+                raise webob.exc.HTTPBadRequest(
+                        'limit must be a non-negative integer')
+        return min(limit, CONF.max_list_limit), query.get('marker')
+
     def _normalize_arg(self, arg):
         return str(arg).replace(':', '_').replace('-', '_')
 
@@ -309,9 +405,145 @@ class Debug(Middleware):
         print
 
 
+class RouteTable(object):
+    """Matches requests against the simple routes of a mapper.
+
+    A route is simple when its path is made of literal segments and whole
+    segment variables without requirements, like '/users/{user_id}/roles',
+    and it is at most conditioned on the request method. Those are indexed
+    in a tree of path segments so a request is matched with a dict lookup
+    per segment instead of trying each route's regex in turn. The catch-all
+    route :class:`ExtensionRouter` adds at the end is understood as well.
+
+    `match` returns None whenever `routes` has to decide: for paths that
+    could match one of the other routes before the simple match, or for
+    requests that override their method.
+
+    """
+
+    _name = re.compile(r'^\w+$')
+
+    def __init__(self, mapper):
+        self.tree = self._node()
+        self.catch_all = None
+        self.first_complex = None
+
+        if mapper.prefix or mapper.sub_domains:
+            self.first_complex = 0
+            return
+
+        matchlist = mapper.matchlist
+        for index, route in enumerate(matchlist):
+            if index == len(matchlist) - 1 and self._is_catch_all(route):
+                self.catch_all = route
+                continue
+            names = self._add(index, route)
+            if names is None and self.first_complex is None:
+                self.first_complex = index
+
+    @staticmethod
+    def _node():
+        # literal children, variable child, routes ending here
+        return [{}, None, []]
+
+    @staticmethod
+    def _is_catch_all(route):
+        return (route.routepath == '{path_info:.*}'
+                and not route.conditions
+                and not (route.static or route.redirect))
+
+    def _add(self, index, route):
+        conditions = route.conditions or {}
+        if (route.static or route.redirect or route.minimization
+                or not route.routepath.startswith('/')
+                or 'function' in conditions or 'sub_domain' in conditions):
+            return None
+
+        segments = route.routepath.split('/')[1:]
+        names = []
+        for segment in segments:
+            if segment.startswith('{') and segment.endswith('}'):
+                name = segment[1:-1]
+                if (not self._name.match(name) or name in route.reqs
+                        or name == 'path_info'):
+                    return None
+                names.append(name)
+            elif '{' in segment or ':' in segment or '*' in segment:
+                return None
+
+        node = self.tree
+        for segment in segments:
+            if segment.startswith('{'):
+                if node[1] is None:
+                    node[1] = self._node()
+                node = node[1]
+            else:
+                node = node[0].setdefault(segment, self._node())
+
+        node[2].append((index, conditions.get('method'), names, route))
+        return names
+
+    def _lookup(self, node, segments, position, values, method, best):
+        if position == len(segments):
+            for index, methods, names, route in node[2]:
+                if best is not None and best[0] <= index:
+                    break
+                if methods is None or method in methods:
+                    best = (index, route, names, list(values))
+                    break
+            return best
+
+        segment = segments[position]
+        child = node[0].get(segment)
+        if child is not None:
+            best = self._lookup(child, segments, position + 1, values,
+                                method, best)
+        if node[1] is not None and segment:
+            values.append(segment)
+            best = self._lookup(node[1], segments, position + 1, values,
+                                method, best)
+            values.pop()
+        return best
+
+    def match(self, environ):
+        """Return the (match dict, route) for a request, or None."""
+        path = environ.get('PATH_INFO')
+        if not path or path[0] != '/' or '\n' in path:
+            return None
+        method = environ['REQUEST_METHOD']
+        if ('_method' in environ.get('QUERY_STRING', '')
+                or (method == 'POST'
+                    and routes.middleware.is_form_post(environ))):
+            return None
+
+        best = self._lookup(self.tree, path.split('/')[1:], 0, [], method,
+                            None)
+        if best is None:
+            if self.first_complex is not None:
+                return None
+            if self.catch_all is None:
+                return {}, None
+            match = dict(self.catch_all.defaults)
+            match['path_info'] = path
+            return match, self.catch_all
+
+        index, route, names, values = best
+        if self.first_complex is not None and self.first_complex < index:
+            return None
+        match = dict(route.defaults)
+        if route.encoding:
+            values = [x.decode(route.encoding, route.decode_errors)
+                      for x in values]
+        match.update(zip(names, values))
+        return match, route
+
+
 class Router(object):
     """WSGI middleware that maps incoming requests to WSGI apps."""
 
+    # match simple routes with a RouteTable before asking `routes`
+    fast_path = True
+
     def __init__(self, mapper):
         """Create a router for the given routes.Mapper.
 
@@ -339,15 +571,30 @@ class Router(object):
         self.map = mapper
         self._router = routes.middleware.RoutesMiddleware(self._dispatch,
                                                           self.map)
+        self._table = RouteTable(self.map)
 
-    @webob.dec.wsgify(RequestClass=Request)
-    def __call__(self, req):
+    def __call__(self, environ, start_response):
         """Route the incoming request to a controller based on self.map.
 
         If no match, return a 404.
 
         """
-        return self._router
+        result = self.fast_path and self._table.match(environ)
+        if not result:
+            return self._router(environ, start_response)
+
+        match, route = result
+        url = routes.util.URLGenerator(self.map, environ)
+        environ['wsgiorg.routing_args'] = (url, match)
+        environ['routes.route'] = route
+        environ['routes.url'] = url
+        if not match:
+            return webob.exc.HTTPNotFound()(environ, start_response)
+
+        if route is self._table.catch_all:
+            # the same rewrite RoutesMiddleware does for a path_info match
+            environ['SCRIPT_NAME'] += environ['PATH_INFO']
+        return match['controller'](environ, start_response)
 
     @staticmethod
     @webob.dec.wsgify(RequestClass=Request)
@@ -127,6 +127,12 @@ def register_cli_int(*args, **kw):
     return conf.register_cli_opt(cfg.IntOpt(*args, **kw), group=group)
 
 
+def register_list(*args, **kw):
+    conf = kw.pop('conf', CONF)
+    group = _ensure_group(kw, conf)
+    return conf.register_opt(cfg.ListOpt(*args, **kw), group=group)
+
+
 def _ensure_group(kw, conf):
     group = kw.pop('group', None)
     if group:
@@ -141,14 +147,21 @@ register_str('admin_token', default='ADMIN')
 register_str('compute_port')
 register_str('admin_port')
 register_str('public_port')
+register_int('workers', default=0)
+register_int('list_limit')
+register_int('max_list_limit', default=5000)
 
 
 # sql options
 register_str('connection', group='sql')
-register_str('idle_timeout', group='sql')
-register_str('min_pool_size', group='sql')
-register_str('maz_pool_size', group='sql')
-register_str('pool_timeout', group='sql')
+register_int('idle_timeout', group='sql', default=200)
+register_int('min_pool_size', group='sql', default=0)
+register_int('max_pool_size', group='sql', default=10)
+register_int('pool_timeout', group='sql', default=200)
+register_int('connect_timeout', group='sql', default=5)
+register_list('read_connections', group='sql', default=[])
+register_int('replica_check_interval', group='sql', default=10)
+register_int('replica_retry_interval', group='sql', default=30)
 
 
 register_str('driver', group='catalog')
@@ -8,31 +8,30 @@ class Ec2Credential(sql.ModelBase, sql.DictBase):
     __tablename__ = 'ec2_credential'
     access = sql.Column(sql.String(64), primary_key=True)
     secret = sql.Column(sql.String(64))
-    user_id = sql.Column(sql.String(64))
+    user_id = sql.Column(sql.String(64), index=True)
     tenant_id = sql.Column(sql.String(64))
 
     @classmethod
     def from_dict(cls, user_dict):
         return cls(**user_dict)
 
-    def to_dict(self):
-        return dict(self.iteritems())
-
 
 class Ec2(sql.Base):
     def get_credential(self, credential_id):
-        session = self.get_session()
-        credential_ref = session.query(Ec2Credential)\
+        session = self.get_read_session()
+        credential_ref = session.query(*Ec2Credential.columns())\
                                 .filter_by(access=credential_id).first()
         if not credential_ref:
             return
-        return credential_ref.to_dict()
+        return Ec2Credential.row_to_dict(credential_ref)
 
-    def list_credentials(self, user_id):
-        session = self.get_session()
-        credential_refs = session.query(Ec2Credential)\
+    def list_credentials(self, user_id, limit=None, marker=None):
+        session = self.get_read_session()
+        credential_refs = session.query(*Ec2Credential.columns())\
                                  .filter_by(user_id=user_id)
-        return [x.to_dict() for x in credential_refs]
+        credential_refs = sql.paginate(credential_refs, Ec2Credential.access,
+                                       limit, marker)
+        return (Ec2Credential.row_to_dict(x) for x in credential_refs)
 
     # CRUD
     def create_credential(self, credential_id, credential):
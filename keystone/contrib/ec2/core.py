@@ -30,6 +30,7 @@ from keystone import identity
 from keystone import policy
 from keystone import service
 from keystone import token
+from keystone.common import logging
 from keystone.common import manager
 from keystone.common import utils
 from keystone.common import wsgi
@@ -155,31 +156,29 @@ class Ec2Controller(wsgi.Application):
                 context=context,
                 user_id=user_ref['id'],
                 tenant_id=tenant_ref['id'])
-        catalog_ref = self.catalog_api.get_catalog(
+        catalog_ref = self.catalog_api.get_formatted_catalog(
                 context=context,
                 user_id=user_ref['id'],
                 tenant_id=tenant_ref['id'],
                     metadata=metadata_ref)
 
-        token_ref = self.token_api.create_token(
-                context, token_id, dict(expires='',
-                                        id=token_id,
-                                        user=user_ref,
-                                        tenant=tenant_ref,
-                                        metadata=metadata_ref))
-
-        # TODO(termie): optimize this call at some point and put it into the
-        #               the return for metadata
         # fill out the roles in the metadata
-        roles_ref = []
-        for role_id in metadata_ref.get('roles', []):
-            roles_ref.append(self.identity_api.get_role(context, role_id))
+        roles_ref = self.identity_api.get_roles(context,
+                                                metadata_ref.get('roles', []))
 
         # TODO(termie): make this a util function or something
         # TODO(termie): i don't think the ec2 middleware currently expects a
         #               full return, but it contains a note saying that it
         #               would be better to expect a full return
         token_controller = service.TokenController()
+        try:
+            token_ref = self.token_api.create_token(
+                    context, token_id, token_controller._build_token_data(
+                            token_id, user_ref, tenant_ref, metadata_ref,
+                            roles_ref, catalog_ref))
+        except token.StorageError as e:
+            logging.error('Could not issue a token: %s', e)
+            raise webob.exc.HTTPServiceUnavailable()
         return token_controller._format_authenticate(
                 token_ref, roles_ref, catalog_ref)
 
@@ -206,6 +205,9 @@ class Ec2Controller(wsgi.Application):
     def get_credentials(self, context, user_id):
         """List all credentials for a user.
 
+        Ordered by access key, the `limit` and `marker` query parameters
+        page through them as for users.
+
         :param context: standard context
         :param user_id: id of user
         :returns: credentials: list of ec2 credential dicts
@@ -213,7 +215,12 @@ class Ec2Controller(wsgi.Application):
 
         # TODO(termie): validate that this request is valid for given user
         #               tenant
-        return {'credentials': self.ec2_api.list_credentials(context, user_id)}
+        limit, marker = self._get_page(context)
+        credential_refs = self.ec2_api.list_credentials(context,
+                                                        user_id,
+                                                        limit=limit,
+                                                        marker=marker)
+        return wsgi.JsonStream(credentials=credential_refs)
 
     def get_credential(self, context, user_id, credential_id):
         """Retreive a user's access/secret pair by the access key.
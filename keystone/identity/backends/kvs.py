@@ -5,6 +5,12 @@ from keystone.common import kvs
 from keystone.common import utils
 
 
+USER_NAME = kvs.Index('user_name', 'name')
+TENANT_USERS = kvs.Index('tenant_users', 'tenants')
+USER_INDEXES = (USER_NAME, TENANT_USERS)
+TENANT_NAME = kvs.Index('tenant_name', 'name')
+
+
 def _filter_user(user_ref):
     if user_ref:
         user_ref = user_ref.copy()
@@ -35,6 +41,9 @@ class Identity(kvs.Base, identity.Driver):
         if (not user_ref
             or not utils.check_password(password, user_ref.get('password'))):
             raise AssertionError('Invalid user / password')
+        if utils.password_needs_rehash(user_ref['password']):
+            # bcrypt_strength changed since the password was set
+            self.update_user(user_id, {'password': password})
         if tenant_id and tenant_id not in user_ref['tenants']:
             raise AssertionError('Invalid tenant')
 
@@ -50,16 +59,24 @@ class Identity(kvs.Base, identity.Driver):
         return tenant_ref
 
     def get_tenant_by_name(self, tenant_name):
-        tenant_ref = self.db.get('tenant_name-%s' % tenant_name)
-        return tenant_ref
+        for tenant_id in TENANT_NAME.lookup(self.db, tenant_name):
+            tenant_ref = self.get_tenant(tenant_id)
+            if TENANT_NAME.matches(tenant_ref, tenant_name):
+                return tenant_ref
+
+    def get_tenants(self, tenant_ids):
+        tenant_refs = [self.db.get('tenant-%s' % x) for x in tenant_ids]
+        return [x for x in tenant_refs if x is not None]
 
     def _get_user(self, user_id):
         user_ref = self.db.get('user-%s' % user_id)
         return user_ref
 
     def _get_user_by_name(self, user_name):
-        user_ref = self.db.get('user_name-%s' % user_name)
-        return user_ref
+        for user_id in USER_NAME.lookup(self.db, user_name):
+            user_ref = self._get_user(user_id)
+            if USER_NAME.matches(user_ref, user_name):
+                return user_ref
 
     def get_user(self, user_id):
         return _filter_user(self._get_user(user_id))
@@ -74,13 +91,19 @@ class Identity(kvs.Base, identity.Driver):
         role_ref = self.db.get('role-%s' % role_id)
         return role_ref
 
-    def list_users(self):
-        user_ids = self.db.get('user_list', [])
-        return [self.get_user(x) for x in user_ids]
+    def get_roles(self, role_ids):
+        role_refs = [self.get_role(x) for x in role_ids]
+        return [x for x in role_refs if x is not None]
 
-    def list_roles(self):
-        role_ids = self.db.get('role_list', [])
-        return [self.get_role(x) for x in role_ids]
+    def list_users(self, limit=None, marker=None):
+        user_ids = kvs.paginate(self.db.smembers('user_list'), limit, marker)
+        user_refs = (self.get_user(x) for x in user_ids)
+        return (x for x in user_refs if x is not None)
+
+    def list_roles(self, limit=None, marker=None):
+        role_ids = kvs.paginate(self.db.smembers('role_list'), limit, marker)
+        role_refs = (self.get_role(x) for x in role_ids)
+        return (x for x in role_refs if x is not None)
 
     # These should probably be part of the high-level API
     def add_user_to_tenant(self, tenant_id, user_id):
@@ -99,6 +122,15 @@ class Identity(kvs.Base, identity.Driver):
         user_ref = self._get_user(user_id)
         return user_ref.get('tenants', [])
 
+    def list_tenants_for_user(self, user_id):
+        return self.get_tenants(self.get_tenants_for_user(user_id))
+
+    def get_users_for_tenant(self, tenant_id):
+        user_ids = TENANT_USERS.lookup(self.db, tenant_id)
+        user_refs = [self._get_user(x) for x in user_ids]
+        return [_filter_user(x) for x in user_refs
+                if TENANT_USERS.matches(x, tenant_id)]
+
     def get_roles_for_user_and_tenant(self, user_id, tenant_id):
         metadata_ref = self.get_metadata(user_id, tenant_id)
         if not metadata_ref:
@@ -126,50 +158,56 @@ class Identity(kvs.Base, identity.Driver):
     # CRUD
     def create_user(self, user_id, user):
         user = _ensure_hashed_password(user)
-        self.db.set('user-%s' % user_id, user)
-        self.db.set('user_name-%s' % user['name'], user)
-        user_list = set(self.db.get('user_list', []))
-        user_list.add(user_id)
-        self.db.set('user_list', list(user_list))
+        with self.db.transaction():
+            self.db.set('user-%s' % user_id, user)
+            self._index_user(user_id, None, user)
+            self.db.sadd('user_list', user_id)
         return user
 
     def update_user(self, user_id, user):
         # get the old name and delete it too
         old_user = self.db.get('user-%s' % user_id)
         new_user = old_user.copy()
+        if 'password' in user:
+            utils.forget_password(old_user.get('password'))
         user = _ensure_hashed_password(user)
         new_user.update(user)
-        self.db.delete('user_name-%s' % old_user['name'])
-        self.db.set('user-%s' % user_id, new_user)
-        self.db.set('user_name-%s' % new_user['name'], new_user)
+        with self.db.transaction():
+            self.db.set('user-%s' % user_id, new_user)
+            self._index_user(user_id, old_user, new_user)
         return new_user
 
     def delete_user(self, user_id):
         old_user = self.db.get('user-%s' % user_id)
-        self.db.delete('user_name-%s' % old_user['name'])
-        self.db.delete('user-%s' % user_id)
-        user_list = set(self.db.get('user_list', []))
-        user_list.remove(user_id)
-        self.db.set('user_list', list(user_list))
+        with self.db.transaction():
+            self.db.delete('user-%s' % user_id)
+            self._index_user(user_id, old_user, None)
+            self.db.srem('user_list', user_id)
         return None
 
+    def _index_user(self, user_id, old_user, new_user):
+        for index in USER_INDEXES:
+            index.update(self.db, user_id, old_user, new_user)
+
     def create_tenant(self, tenant_id, tenant):
-        self.db.set('tenant-%s' % tenant_id, tenant)
-        self.db.set('tenant_name-%s' % tenant['name'], tenant)
+        with self.db.transaction():
+            self.db.set('tenant-%s' % tenant_id, tenant)
+            TENANT_NAME.update(self.db, tenant_id, None, tenant)
         return tenant
 
     def update_tenant(self, tenant_id, tenant):
         # get the old name and delete it too
         old_tenant = self.db.get('tenant-%s' % tenant_id)
-        self.db.delete('tenant_name-%s' % old_tenant['name'])
-        self.db.set('tenant-%s' % tenant_id, tenant)
-        self.db.set('tenant_name-%s' % tenant['name'], tenant)
+        with self.db.transaction():
+            self.db.set('tenant-%s' % tenant_id, tenant)
+            TENANT_NAME.update(self.db, tenant_id, old_tenant, tenant)
         return tenant
 
     def delete_tenant(self, tenant_id):
         old_tenant = self.db.get('tenant-%s' % tenant_id)
-        self.db.delete('tenant_name-%s' % old_tenant['name'])
-        self.db.delete('tenant-%s' % tenant_id)
+        with self.db.transaction():
+            self.db.delete('tenant-%s' % tenant_id)
+            TENANT_NAME.update(self.db, tenant_id, old_tenant, None)
         return None
 
     def create_metadata(self, user_id, tenant_id, metadata):
@@ -186,9 +224,7 @@ class Identity(kvs.Base, identity.Driver):
 
     def create_role(self, role_id, role):
         self.db.set('role-%s' % role_id, role)
-        role_list = set(self.db.get('role_list', []))
-        role_list.add(role_id)
-        self.db.set('role_list', list(role_list))
+        self.db.sadd('role_list', role_id)
         return role
 
     def update_role(self, role_id, role):
@@ -197,7 +233,5 @@ class Identity(kvs.Base, identity.Driver):
 
     def delete_role(self, role_id):
         self.db.delete('role-%s' % role_id)
-        role_list = set(self.db.get('role_list', []))
-        role_list.remove(role_id)
-        self.db.set('role_list', list(role_list))
+        self.db.srem('role_list', role_id)
         return None
@@ -24,7 +24,8 @@ class User(sql.ModelBase, sql.DictBase):
     id = sql.Column(sql.String(64), primary_key=True)
     name = sql.Column(sql.String(64), unique=True)
     #password = sql.Column(sql.String(64))
-    extra = sql.Column(sql.JsonBlob())
+    _extra = sql.Column('extra', sql.JsonBlob())
+    extra = sql.lazy_json('_extra')
 
     @classmethod
     def from_dict(cls, user_dict):
@@ -38,18 +39,20 @@ class User(sql.ModelBase, sql.DictBase):
         user_dict['extra'] = extra
         return cls(**user_dict)
 
-    def to_dict(self):
-        extra_copy = self.extra.copy()
-        extra_copy['id'] = self.id
-        extra_copy['name'] = self.name
-        return extra_copy
+    @classmethod
+    def row_to_dict(cls, row):
+        user_dict = sql.json_dict(row._extra)
+        user_dict['id'] = row.id
+        user_dict['name'] = row.name
+        return user_dict
 
 
 class Tenant(sql.ModelBase, sql.DictBase):
     __tablename__ = 'tenant'
     id = sql.Column(sql.String(64), primary_key=True)
     name = sql.Column(sql.String(64), unique=True)
-    extra = sql.Column(sql.JsonBlob())
+    _extra = sql.Column('extra', sql.JsonBlob())
+    extra = sql.lazy_json('_extra')
 
     @classmethod
     def from_dict(cls, tenant_dict):
@@ -63,11 +66,12 @@ class Tenant(sql.ModelBase, sql.DictBase):
         tenant_dict['extra'] = extra
         return cls(**tenant_dict)
 
-    def to_dict(self):
-        extra_copy = self.extra.copy()
-        extra_copy['id'] = self.id
-        extra_copy['name'] = self.name
-        return extra_copy
+    @classmethod
+    def row_to_dict(cls, row):
+        tenant_dict = sql.json_dict(row._extra)
+        tenant_dict['id'] = row.id
+        tenant_dict['name'] = row.name
+        return tenant_dict
 
 
 class Role(sql.ModelBase, sql.DictBase):
@@ -78,13 +82,11 @@ class Role(sql.ModelBase, sql.DictBase):
 
 class Metadata(sql.ModelBase, sql.DictBase):
     __tablename__ = 'metadata'
-    #__table_args__ = (
-    #    sql.Index('idx_metadata_usertenant', 'user', 'tenant'),
-    #    )
-
+    # the primary key covers lookups by user and by (user, tenant)
     user_id = sql.Column(sql.String(64), primary_key=True)
     tenant_id = sql.Column(sql.String(64), primary_key=True)
-    data = sql.Column(sql.JsonBlob())
+    _data = sql.Column('data', sql.JsonBlob())
+    data = sql.lazy_json('_data')
 
 
 class UserTenantMembership(sql.ModelBase, sql.DictBase):
@@ -95,7 +97,8 @@ class UserTenantMembership(sql.ModelBase, sql.DictBase):
                          primary_key=True)
     tenant_id = sql.Column(sql.String(64),
                            sql.ForeignKey('tenant.id'),
-                           primary_key=True)
+                           primary_key=True,
+                           index=True)
 
 
 class Identity(sql.Base, identity.Driver):
@@ -111,51 +114,101 @@ class Identity(sql.Base, identity.Driver):
         in the list of tenants on the user.
 
         """
-        user_ref = self._get_user(user_id)
-        tenant_ref = None
-        metadata_ref = None
-        if (not user_ref
-            or not utils.check_password(password, user_ref.get('password'))):
+        tenant_clause = None
+        if tenant_id:
+            tenant_clause = Tenant.id == tenant_id
+        return self._authenticate(User.id == user_id, tenant_clause, password)
+
+    def authenticate_by_name(self, user_name=None, tenant_id=None,
+                             tenant_name=None, password=None):
+        tenant_clause = None
+        if tenant_name:
+            tenant_clause = Tenant.name == tenant_name
+        elif tenant_id:
+            tenant_clause = Tenant.id == tenant_id
+        return self._authenticate(User.name == user_name, tenant_clause,
+                                  password)
+
+    def _authenticate(self, user_clause, tenant_clause, password):
+        """Fetch the user, tenant, membership and metadata in one query."""
+        session = self.get_read_session()
+        if tenant_clause is None:
+            row = session.query(User).filter(user_clause).first()
+            row = row and (row, None, None, None)
+        else:
+            row = session.query(User,
+                                Tenant,
+                                UserTenantMembership,
+                                Metadata)\
+                         .outerjoin(Tenant, tenant_clause)\
+                         .outerjoin(UserTenantMembership, sql.and_(
+                                UserTenantMembership.user_id == User.id,
+                                UserTenantMembership.tenant_id == Tenant.id))\
+                         .outerjoin(Metadata, sql.and_(
+                                Metadata.user_id == User.id,
+                                Metadata.tenant_id == Tenant.id))\
+                         .filter(user_clause)\
+                         .first()
+
+        if not row:
+            raise AssertionError('Invalid user / password')
+        user_ref, tenant_ref, membership, metadata = row
+        user_ref = user_ref.to_dict()
+        if not utils.check_password(password, user_ref.get('password')):
             raise AssertionError('Invalid user / password')
+        if utils.password_needs_rehash(user_ref['password']):
+            # bcrypt_strength changed since the password was set
+            self.update_user(user_ref['id'], {'password': password})
 
-        tenants = self.get_tenants_for_user(user_id)
-        if tenant_id and tenant_id not in tenants:
+        if tenant_clause is None:
+            return (_filter_user(user_ref), None, {})
+        if tenant_ref is None or membership is None:
             raise AssertionError('Invalid tenant')
-
-        tenant_ref = self.get_tenant(tenant_id)
-        if tenant_ref:
-            metadata_ref = self.get_metadata(user_id, tenant_id)
-        else:
-            metadata_ref = {}
-        return (_filter_user(user_ref), tenant_ref, metadata_ref)
+        return (_filter_user(user_ref), tenant_ref.to_dict(),
+                getattr(metadata, 'data', None))
 
     def get_tenant(self, tenant_id):
-        session = self.get_session()
-        tenant_ref = session.query(Tenant).filter_by(id=tenant_id).first()
+        session = self.get_read_session()
+        tenant_ref = session.query(*Tenant.columns())\
+                            .filter_by(id=tenant_id)\
+                            .first()
         if not tenant_ref:
             return
-        return tenant_ref.to_dict()
+        return Tenant.row_to_dict(tenant_ref)
 
     def get_tenant_by_name(self, tenant_name):
-        session = self.get_session()
-        tenant_ref = session.query(Tenant).filter_by(name=tenant_name).first()
+        session = self.get_read_session()
+        tenant_ref = session.query(*Tenant.columns())\
+                            .filter_by(name=tenant_name)\
+                            .first()
         if not tenant_ref:
             return
-        return tenant_ref.to_dict()
+        return Tenant.row_to_dict(tenant_ref)
+
+    def get_tenants(self, tenant_ids):
+        if not tenant_ids:
+            return []
+        session = self.get_read_session()
+        tenant_refs = session.query(*Tenant.columns())\
+                             .filter(Tenant.id.in_(tenant_ids))
+        tenant_map = dict((x.id, Tenant.row_to_dict(x)) for x in tenant_refs)
+        return [tenant_map[x] for x in tenant_ids if x in tenant_map]
 
     def _get_user(self, user_id):
-        session = self.get_session()
-        user_ref = session.query(User).filter_by(id=user_id).first()
+        session = self.get_read_session()
+        user_ref = session.query(*User.columns()).filter_by(id=user_id).first()
         if not user_ref:
             return
-        return user_ref.to_dict()
+        return User.row_to_dict(user_ref)
 
     def _get_user_by_name(self, user_name):
-        session = self.get_session()
-        user_ref = session.query(User).filter_by(name=user_name).first()
+        session = self.get_read_session()
+        user_ref = session.query(*User.columns())\
+                          .filter_by(name=user_name)\
+                          .first()
         if not user_ref:
             return
-        return user_ref.to_dict()
+        return User.row_to_dict(user_ref)
 
     def get_user(self, user_id):
         return _filter_user(self._get_user(user_id))
@@ -163,28 +216,48 @@ class Identity(sql.Base, identity.Driver):
     def get_user_by_name(self, user_name):
         return _filter_user(self._get_user_by_name(user_name))
 
-    def get_metadata(self, user_id, tenant_id):
-        session = self.get_session()
+    def _get_metadata(self, user_id, tenant_id, session=None):
+        # read-modify-write paths must not see a lagging replica, so this
+        # reads from the primary unless given another session
+        if session is None:
+            session = self.get_session()
         metadata_ref = session.query(Metadata)\
                               .filter_by(user_id=user_id)\
                               .filter_by(tenant_id=tenant_id)\
                               .first()
         return getattr(metadata_ref, 'data', None)
 
-    def get_role(self, role_id):
-        session = self.get_session()
-        role_ref = session.query(Role).filter_by(id=role_id).first()
-        return role_ref
-
-    def list_users(self):
-        session = self.get_session()
-        user_refs = session.query(User)
-        return [_filter_user(x.to_dict()) for x in user_refs]
+    def get_metadata(self, user_id, tenant_id):
+        return self._get_metadata(user_id, tenant_id,
+                                  session=self.get_read_session())
 
-    def list_roles(self):
-        session = self.get_session()
-        role_refs = session.query(Role)
-        return list(role_refs)
+    def get_role(self, role_id):
+        session = self.get_read_session()
+        role_ref = session.query(*Role.columns()).filter_by(id=role_id).first()
+        if not role_ref:
+            return
+        return Role.row_to_dict(role_ref)
+
+    def get_roles(self, role_ids):
+        if not role_ids:
+            return []
+        session = self.get_read_session()
+        role_refs = session.query(*Role.columns())\
+                           .filter(Role.id.in_(role_ids))
+        role_map = dict((x.id, Role.row_to_dict(x)) for x in role_refs)
+        return [role_map[x] for x in role_ids if x in role_map]
+
+    def list_users(self, limit=None, marker=None):
+        session = self.get_read_session()
+        user_refs = sql.paginate(session.query(*User.columns()),
+                                 User.id, limit, marker)
+        return (_filter_user(User.row_to_dict(x)) for x in user_refs)
+
+    def list_roles(self, limit=None, marker=None):
+        session = self.get_read_session()
+        role_refs = sql.paginate(session.query(*Role.columns()),
+                                 Role.id, limit, marker)
+        return (Role.row_to_dict(x) for x in role_refs)
 
     # These should probably be part of the high-level API
     def add_user_to_tenant(self, tenant_id, user_id):
@@ -212,13 +285,26 @@ class Identity(sql.Base, identity.Driver):
             session.flush()
 
     def get_tenants_for_user(self, user_id):
-        session = self.get_session()
-        membership_refs = session.query(UserTenantMembership)\
-                          .filter_by(user_id=user_id)\
-                          .all()
+        session = self.get_read_session()
+        membership_refs = session.query(UserTenantMembership.tenant_id)\
+                                 .filter_by(user_id=user_id)
 
         return [x.tenant_id for x in membership_refs]
 
+    def list_tenants_for_user(self, user_id):
+        session = self.get_read_session()
+        tenant_refs = session.query(*Tenant.columns())\
+                             .join(UserTenantMembership)\
+                             .filter(UserTenantMembership.user_id == user_id)
+        return [Tenant.row_to_dict(x) for x in tenant_refs]
+
+    def get_users_for_tenant(self, tenant_id):
+        session = self.get_read_session()
+        user_refs = session.query(*User.columns())\
+                           .join(UserTenantMembership)\
+                           .filter(UserTenantMembership.tenant_id == tenant_id)
+        return [_filter_user(User.row_to_dict(x)) for x in user_refs]
+
     def get_roles_for_user_and_tenant(self, user_id, tenant_id):
         metadata_ref = self.get_metadata(user_id, tenant_id)
         if not metadata_ref:
@@ -226,7 +312,7 @@ class Identity(sql.Base, identity.Driver):
         return metadata_ref.get('roles', [])
 
     def add_role_to_user_and_tenant(self, user_id, tenant_id, role_id):
-        metadata_ref = self.get_metadata(user_id, tenant_id)
+        metadata_ref = self._get_metadata(user_id, tenant_id)
         is_new = False
         if not metadata_ref:
             is_new = True
@@ -240,7 +326,7 @@ class Identity(sql.Base, identity.Driver):
             self.create_metadata(user_id, tenant_id, metadata_ref)
 
     def remove_role_from_user_and_tenant(self, user_id, tenant_id, role_id):
-        metadata_ref = self.get_metadata(user_id, tenant_id)
+        metadata_ref = self._get_metadata(user_id, tenant_id)
         is_new = False
         if not metadata_ref:
             is_new = True
@@ -268,6 +354,8 @@ class Identity(sql.Base, identity.Driver):
         with session.begin():
             user_ref = session.query(User).filter_by(id=user_id).first()
             old_user_dict = user_ref.to_dict()
+            if 'password' in user:
+                utils.forget_password(old_user_dict.get('password'))
             user = _ensure_hashed_password(user)
             for k in user:
                 old_user_dict[k] = user[k]
@@ -330,7 +418,7 @@ class Identity(sql.Base, identity.Driver):
                                   .filter_by(user_id=user_id)\
                                   .filter_by(tenant_id=tenant_id)\
                                   .first()
-            data = metadata_ref.data.copy()
+            data = sql.json_dict(metadata_ref._data)
             for k in metadata:
                 data[k] = metadata[k]
             metadata_ref.data = data
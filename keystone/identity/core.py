@@ -42,6 +42,28 @@ class Driver(object):
         """
         raise NotImplementedError()
 
+    def authenticate_by_name(self, user_name=None, tenant_id=None,
+                             tenant_name=None, password=None):
+        """Authenticate a user given by name, the tenant may be given by name.
+
+        Backends that can should look everything up in one go, this falls
+        back to resolving the names first.
+
+        Returns: (user, tenant, metadata).
+
+        """
+        user_ref = self.get_user_by_name(user_name)
+        if not user_ref:
+            raise AssertionError('Invalid user / password')
+        if tenant_name:
+            tenant_ref = self.get_tenant_by_name(tenant_name)
+            if not tenant_ref:
+                raise AssertionError('Invalid tenant')
+            tenant_id = tenant_ref['id']
+        return self.authenticate(user_id=user_ref['id'],
+                                 tenant_id=tenant_id,
+                                 password=password)
+
     def get_tenant(self, tenant_id):
         """Get a tenant by id.
 
@@ -58,6 +80,15 @@ class Driver(object):
         """
         raise NotImplementedError()
 
+    def get_tenants(self, tenant_ids):
+        """Get several tenants by id in one lookup.
+
+        Returns: a list of tenant_refs in the order of tenant_ids, tenants
+                 that don't exist are left out.
+
+        """
+        raise NotImplementedError()
+
     def get_user(self, user_id):
         """Get a user by id.
 
@@ -82,21 +113,35 @@ class Driver(object):
         """
         raise NotImplementedError()
 
-    def list_users(self):
+    def get_roles(self, role_ids):
+        """Get several roles by id in one lookup.
+
+        Returns: a list of role_refs in the order of role_ids, roles that
+                 don't exist are left out.
+
+        """
+        raise NotImplementedError()
+
+    def list_users(self, limit=None, marker=None):
         """List all users in the system.
 
         NOTE(termie): I'd prefer if this listed only the users for a given
                       tenant.
 
-        Returns: a list of user_refs or an empty list.
+        Ordered by id. Only the users after the one with id `marker` are
+        listed if it is given, and at most `limit` of them.
+
+        Returns: an iterator over the user_refs, read as it goes.
 
         """
         raise NotImplementedError()
 
-    def list_roles(self):
+    def list_roles(self, limit=None, marker=None):
         """List all roles in the system.
 
-        Returns: a list of role_refs or an empty list.
+        Ordered and paged through like `list_users`.
+
+        Returns: an iterator over the role_refs, read as it goes.
 
         """
         raise NotImplementedError()
@@ -117,6 +162,22 @@ class Driver(object):
         """
         raise NotImplementedError()
 
+    def list_tenants_for_user(self, user_id):
+        """Get the tenants a given user is a member of in one lookup.
+
+        Returns: a list of tenant_refs or an empty list.
+
+        """
+        raise NotImplementedError()
+
+    def get_users_for_tenant(self, tenant_id):
+        """Get the users who are members of a given tenant.
+
+        Returns: a list of user_refs or an empty list.
+
+        """
+        raise NotImplementedError()
+
     def get_roles_for_user_and_tenant(self, user_id, tenant_id):
         """Get the roles associated with a user within given tenant.
 
@@ -236,13 +297,8 @@ class TenantController(wsgi.Application):
         assert token_ref is not None
 
         user_ref = token_ref['user']
-        tenant_ids = self.identity_api.get_tenants_for_user(
+        tenant_refs = self.identity_api.list_tenants_for_user(
                 context, user_ref['id'])
-        tenant_refs = []
-        for tenant_id in tenant_ids:
-            tenant_refs.append(self.identity_api.get_tenant(
-                    context=context,
-                    tenant_id=tenant_id))
         return self._format_tenants_for_token(tenant_refs)
 
     def get_tenant(self, context, tenant_id):
@@ -317,8 +373,11 @@ class UserController(wsgi.Application):
         # NOTE(termie): i can't imagine that this really wants all the data
         #               about every single user in the system...
         self.assert_admin(context)
-        user_refs = self.identity_api.list_users(context)
-        return {'users': user_refs}
+        limit, marker = self._get_page(context)
+        user_refs = self.identity_api.list_users(context,
+                                                 limit=limit,
+                                                 marker=marker)
+        return wsgi.JsonStream(users=user_refs)
 
     # CRUD extension
     def create_user(self, context, user):
@@ -378,8 +437,7 @@ class RoleController(wsgi.Application):
             raise Exception('User roles not supported: tenant_id required')
         roles = self.identity_api.get_roles_for_user_and_tenant(
                 context, user_id, tenant_id)
-        return {'roles': [self.identity_api.get_role(context, x)
-                          for x in roles]}
+        return {'roles': self.identity_api.get_roles(context, roles)}
 
     # CRUD extension
     def get_role(self, context, role_id):
@@ -400,12 +458,41 @@ class RoleController(wsgi.Application):
     def delete_role(self, context, role_id):
         self.assert_admin(context)
         role_ref = self.identity_api.delete_role(context, role_id)
+        self._revoke_tokens_with_role(context, role_id)
+
+    def _revoke_tokens_with_role(self, context, role_id, user_ids=None,
+                                 tenant_id=None):
+        """Delete the tokens that were issued with a role embedded.
+
+        See ``[token] embed_roles``, such tokens would otherwise go on
+        reporting the role until they expire. All users are checked unless
+        `user_ids` is given, and only tokens scoped to `tenant_id` if given.
+
+        """
+        if not CONF.token.embed_roles:
+            return
+        if user_ids is None:
+            user_ids = [x['id'] for x in self.identity_api.list_users(context)]
+        user_tokens = self.token_api.list_tokens_by_user(context, user_ids)
+        token_ids = [x for token_ids in user_tokens.itervalues()
+                     for x in token_ids]
+        if not token_ids:
+            return
+        token_refs = self.token_api.get_tokens(context, token_ids)
+        for token_id, token_ref in token_refs.iteritems():
+            token_tenant = token_ref.get('tenant') or {}
+            if tenant_id and token_tenant.get('id') != tenant_id:
+                continue
+            if role_id in [x['id'] for x in token_ref.get('roles', [])]:
+                self.token_api.delete_token(context, token_id)
 
     def get_roles(self, context):
         self.assert_admin(context)
-        roles = self.identity_api.list_roles(context)
-        # TODO(termie): probably inefficient at some point
-        return {'roles': roles}
+        limit, marker = self._get_page(context)
+        roles = self.identity_api.list_roles(context,
+                                             limit=limit,
+                                             marker=marker)
+        return wsgi.JsonStream(roles=roles)
 
     def add_role_to_user(self, context, user_id, role_id, tenant_id=None):
         """Add a role to a user and tenant pair.
@@ -441,6 +528,8 @@ class RoleController(wsgi.Application):
         # a user also adds them to a tenant
         self.identity_api.remove_role_from_user_and_tenant(
                 context, user_id, tenant_id, role_id)
+        self._revoke_tokens_with_role(context, role_id, user_ids=[user_id],
+                                      tenant_id=tenant_id)
         roles = self.identity_api.get_roles_for_user_and_tenant(
                 context, user_id, tenant_id)
         if not roles:
@@ -510,6 +599,8 @@ class RoleController(wsgi.Application):
         role_id = role_ref_ref.get('roleId')[0]
         self.identity_api.remove_role_from_user_and_tenant(
                 context, user_id, tenant_id, role_id)
+        self._revoke_tokens_with_role(context, role_id, user_ids=[user_id],
+                                      tenant_id=tenant_id)
         roles = self.identity_api.get_roles_for_user_and_tenant(
                 context, user_id, tenant_id)
         if not roles:
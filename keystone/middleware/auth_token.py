@@ -64,9 +64,11 @@ HTTP_X_AUTHORIZATION
     the client identity being passed in
 
 """
+import calendar
 import httplib
 import json
 import os
+import time
 
 import eventlet
 from eventlet import wsgi
@@ -76,6 +78,8 @@ import webob
 import webob.exc
 from webob.exc import HTTPUnauthorized
 
+from keystone.common import bufferedhttp
+from keystone.common import cache
 from keystone.common.bufferedhttp import http_connect_raw as http_connect
 
 PROTOCOL_NAME = "Token Authentication"
@@ -128,6 +132,20 @@ class AuthProtocol(object):
         # validating tokens is a privileged call
         self.admin_token = conf.get('admin_token')
 
+        # Validated claims are kept locally so that repeat requests with the
+        # same token don't need to go back to the auth service. Entries live
+        # for at most token_cache_ttl seconds and never past token expiry.
+        self.token_cache = cache.LRUCache(
+                maxsize=int(conf.get('token_cache_size', 1000)),
+                ttl=int(conf.get('token_cache_ttl', 300)))
+
+        # Keep-alive connections to the auth service, reused across requests
+        self.auth_http_pool = bufferedhttp.HTTPConnectionPool(
+                self.auth_host,
+                self.auth_port,
+                size=int(conf.get('http_pool_size', 10)),
+                idle_timeout=int(conf.get('http_pool_idle_timeout', 60)))
+
     def __init__(self, app, conf):
         """ Common initialization code """
 
@@ -159,7 +177,8 @@ class AuthProtocol(object):
                 return self._reject_request(env, start_response)
         else:
             # this request is presenting claims. Let's validate them
-            valid = self._validate_claims(claims)
+            verified_claims = self._validate_claims(claims)
+            valid = verified_claims is not None
             if not valid:
                 # Keystone rejected claim
                 if self.delay_auth_decision:
@@ -175,7 +194,7 @@ class AuthProtocol(object):
 
             #Collect information about valid claims
             if valid:
-                claims = self._expound_claims(claims)
+                claims = verified_claims
 
                 # Store authentication data
                 if claims:
@@ -249,7 +268,16 @@ class AuthProtocol(object):
             start_response)
 
     def _validate_claims(self, claims):
-        """Validate claims, and provide identity information isf applicable """
+        """Validate claims, and provide identity information isf applicable.
+
+        Returns the verified claims or None if the auth service rejected
+        them. Verified claims are cached so a single call to the auth service
+        serves every request made with the same token until it expires.
+
+        """
+        verified_claims = self.token_cache.get(claims)
+        if verified_claims is not None:
+            return verified_claims
 
         # Step 1: We need to auth with the keystone service, so get an
         # admin token
@@ -269,42 +297,26 @@ class AuthProtocol(object):
                     #Khaled's version uses creds to get a token
                     # "X-Auth-Token": admin_token}
                     # we're using a test token from the ini file for now
-        conn = http_connect(self.auth_host, self.auth_port, 'GET',
-                            '/v2.0/tokens/%s' % claims, headers=headers)
-        resp = conn.getresponse()
-        # data = resp.read()
-        conn.close()
+        resp, data = self.auth_http_pool.request(
+                'GET', '/v2.0/tokens/%s' % claims, headers=headers)
 
         if not str(resp.status).startswith('20'):
             # Keystone rejected claim
-            return False
-        else:
-            #TODO(Ziad): there is an optimization we can do here. We have just
-            #received data from Keystone that we can use instead of making
-            #another call in _expound_claims
-            return True
-
-    def _expound_claims(self, claims):
-        # Valid token. Get user data and put it in to the call
-        # so the downstream service can use it
-        headers = {"Content-type": "application/json",
-                    "Accept": "application/json",
-                    "X-Auth-Token": self.admin_token}
-                    ##TODO(ziad):we need to figure out how to auth to keystone
-                    #since validate_token is a priviledged call
-                    #Khaled's version uses creds to get a token
-                    # "X-Auth-Token": admin_token}
-                    # we're using a test token from the ini file for now
-        conn = http_connect(self.auth_host, self.auth_port, 'GET',
-                            '/v2.0/tokens/%s' % claims, headers=headers)
-        resp = conn.getresponse()
-        data = resp.read()
-        conn.close()
-
-        if not str(resp.status).startswith('20'):
-            raise LookupError('Unable to locate claims: %s' % resp.status)
+            return None
 
         token_info = json.loads(data)
+        verified_claims = self._expound_claims(token_info)
+        self.token_cache.set(claims,
+                             verified_claims,
+                             expires=self._get_token_expiry(token_info))
+        return verified_claims
+
+    def _expound_claims(self, token_info):
+        """Extract the user data from a validation response.
+
+        These are put into the call so the downstream service can use them.
+
+        """
         roles = []
         role_refs = token_info["access"]["user"]["roles"]
         if role_refs != None:
@@ -329,6 +341,18 @@ class AuthProtocol(object):
             verified_claims['tenantName'] = tenant_name
         return verified_claims
 
+    def _get_token_expiry(self, token_info):
+        """Return the token expiry as a unix timestamp, or None if unknown."""
+        expires = token_info['access']['token'].get('expires')
+        if not expires:
+            return None
+        try:
+            # ISO 8601 in UTC, ignore fractional seconds and any suffix
+            expires = time.strptime(expires[:19], '%Y-%m-%dT%H:%M:%S')
+        except ValueError:
+            return None
+        return calendar.timegm(expires)
+
     def _decorate_request(self, index, value, env, proxy_headers):
         """Add headers to request"""
         proxy_headers[index] = value
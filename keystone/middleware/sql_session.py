@@ -0,0 +1,35 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+"""Middleware sharing one sql session per request.
+
+Kept apart from :mod:`keystone.middleware.core` so the middleware other
+services load from this package doesn't pull in sqlalchemy.
+
+"""
+
+import webob.dec
+
+from keystone.common import sql
+from keystone.common import wsgi
+
+
+class SqlSessionMiddleware(wsgi.Middleware):
+    """Run each request in one :class:`keystone.common.sql.UnitOfWork`.
+
+    The sql backends share a session and a transaction for the request, it
+    is committed once the response is ready or rolled back if it is an
+    error. Streamed bodies, such as a :class:`keystone.common.wsgi.JsonStream`
+    listing, are read in the unit of work too, so the reads they make share
+    its session.
+
+    """
+
+    @webob.dec.wsgify(RequestClass=wsgi.Request)
+    def __call__(self, request):
+        with sql.UnitOfWork() as work:
+            response = request.get_response(self.application)
+            # reading the body runs the reads of a streamed listing
+            response.body = response.body
+            if response.status_int >= 400:
+                work.rollback()
+        return response
@@ -43,7 +43,7 @@ import json
 from urlparse import urlparse
 from webob.exc import HTTPUnauthorized, HTTPNotFound, HTTPExpectationFailed
 
-from keystone.common.bufferedhttp import http_connect_raw as http_connect
+from keystone.common import bufferedhttp
 
 from swift.common.middleware.acl import clean_acl, parse_acl, referrer_allowed
 from swift.common.utils import get_logger, split_path
@@ -64,6 +64,10 @@ class AuthProtocol(object):
         use = egg:keystone#swiftauth
         keystone_url = http://127.0.0.1:8080
         keystone_admin_token = 999888777666
+
+    Connections to keystone are kept alive and reused, up to
+    `http_pool_size` idle connections are kept for at most
+    `http_pool_idle_timeout` seconds.
     """
 
     def __init__(self, app, conf):
@@ -72,6 +76,11 @@ class AuthProtocol(object):
         self.keystone_url = urlparse(conf.get('keystone_url'))
         self.admin_token = conf.get('keystone_admin_token')
         self.reseller_prefix = conf.get('reseller_prefix', 'AUTH')
+        self.http_pool = bufferedhttp.HTTPConnectionPool(
+                self.keystone_url.hostname,
+                self.keystone_url.port,
+                size=int(conf.get('http_pool_size', 10)),
+                idle_timeout=int(conf.get('http_pool_idle_timeout', 60)))
         self.log = get_logger(conf, log_route='keystone')
         self.log.info('Keystone middleware started')
 
@@ -200,11 +209,8 @@ class AuthProtocol(object):
                     "X-Auth-Token": self.admin_token}
         self.log.debug('headers: %r', headers)
         self.log.debug('url: %s', self.keystone_url)
-        conn = http_connect(self.keystone_url.hostname, self.keystone_url.port,
-                            'GET', '/v2.0/tokens/%s' % claims, headers=headers)
-        resp = conn.getresponse()
-        data = resp.read()
-        conn.close()
+        resp, data = self.http_pool.request('GET', '/v2.0/tokens/%s' % claims,
+                                            headers=headers)
 
         # Check http status code for the "OK" family of responses
         if not str(resp.status).startswith('20'):
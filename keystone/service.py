@@ -10,14 +10,19 @@ import webob.dec
 import webob.exc
 
 from keystone import catalog
+from keystone import config
 from keystone import identity
 from keystone import policy
 from keystone import token
+from keystone.common import cache
 from keystone.common import logging
 from keystone.common import utils
 from keystone.common import wsgi
 
 
+CONF = config.CONF
+
+
 class AdminRouter(wsgi.ComposingRouter):
     def __init__(self):
         mapper = routes.Mapper()
@@ -108,6 +113,10 @@ class TokenController(wsgi.Application):
         self.identity_api = identity.Manager()
         self.token_api = token.Manager()
         self.policy_api = policy.Manager()
+        # serialized validate_token responses keyed by token id
+        self.validate_cache = cache.LRUCache(
+                maxsize=CONF.token.response_cache_size,
+                ttl=CONF.token.response_cache_ttl)
         super(TokenController, self).__init__()
 
     def authenticate(self, context, auth=None):
@@ -138,27 +147,32 @@ class TokenController(wsgi.Application):
             password = auth['passwordCredentials'].get('password', '')
             tenant_name = auth.get('tenantName', None)
 
-            if username:
-                user_ref = self.identity_api.get_user_by_name(
-                        context=context, user_name=username)
-                user_id = user_ref['id']
-            else:
-                user_id = auth['passwordCredentials'].get('userId', None)
-
-            # more compat
-            if tenant_name:
-                tenant_ref = self.identity_api.get_tenant_by_name(
-                        context=context, tenant_name=tenant_name)
-                tenant_id = tenant_ref['id']
-            else:
-                tenant_id = auth.get('tenantId', None)
+            tenant_id = auth.get('tenantId', None)
 
             try:
-                (user_ref, tenant_ref, metadata_ref) = \
-                        self.identity_api.authenticate(context=context,
-                                                       user_id=user_id,
-                                                       password=password,
-                                                       tenant_id=tenant_id)
+                if username:
+                    # the backend resolves the names along with the rest
+                    (user_ref, tenant_ref, metadata_ref) = \
+                            self.identity_api.authenticate_by_name(
+                                    context=context,
+                                    user_name=username,
+                                    password=password,
+                                    tenant_id=tenant_id,
+                                    tenant_name=tenant_name)
+                else:
+                    user_id = auth['passwordCredentials'].get('userId', None)
+
+                    # more compat
+                    if tenant_name:
+                        tenant_ref = self.identity_api.get_tenant_by_name(
+                                context=context, tenant_name=tenant_name)
+                        tenant_id = tenant_ref['id']
+
+                    (user_ref, tenant_ref, metadata_ref) = \
+                            self.identity_api.authenticate(context=context,
+                                                           user_id=user_id,
+                                                           password=password,
+                                                           tenant_id=tenant_id)
 
                 # If the user is disabled don't allow them to authenticate
                 if not user_ref.get('enabled', True):
@@ -166,14 +180,8 @@ class TokenController(wsgi.Application):
             except AssertionError as e:
                 raise webob.exc.HTTPForbidden(e.message)
 
-            token_ref = self.token_api.create_token(
-                    context, token_id, dict(expires='',
-                                            id=token_id,
-                                            user=user_ref,
-                                            tenant=tenant_ref,
-                                            metadata=metadata_ref))
             if tenant_ref:
-                catalog_ref = self.catalog_api.get_catalog(
+                catalog_ref = self.catalog_api.get_formatted_catalog(
                         context=context,
                         user_id=user_ref['id'],
                         tenant_id=tenant_ref['id'],
@@ -182,7 +190,7 @@ class TokenController(wsgi.Application):
                 catalog_ref = {}
 
         elif 'token' in auth:
-            token = auth['token'].get('id', None)
+            old_token_id = auth['token'].get('id', None)
 
             tenant_name = auth.get('tenantName')
 
@@ -195,7 +203,7 @@ class TokenController(wsgi.Application):
                 tenant_id = auth.get('tenantId', None)
 
             old_token_ref = self.token_api.get_token(context=context,
-                                                     token_id=token)
+                                                     token_id=old_token_id)
             user_ref = old_token_ref['user']
 
             tenants = self.identity_api.get_tenants_for_user(context,
@@ -210,7 +218,7 @@ class TokenController(wsgi.Application):
                         context=context,
                         user_id=user_ref['id'],
                         tenant_id=tenant_ref['id'])
-                catalog_ref = self.catalog_api.get_catalog(
+                catalog_ref = self.catalog_api.get_formatted_catalog(
                         context=context,
                         user_id=user_ref['id'],
                         tenant_id=tenant_ref['id'],
@@ -219,19 +227,17 @@ class TokenController(wsgi.Application):
                 metadata_ref = {}
                 catalog_ref = {}
 
-            token_ref = self.token_api.create_token(
-                    context, token_id, dict(expires='',
-                                            id=token_id,
-                                            user=user_ref,
-                                            tenant=tenant_ref,
-                                            metadata=metadata_ref))
-
-        # TODO(termie): optimize this call at some point and put it into the
-        #               the return for metadata
         # fill out the roles in the metadata
-        roles_ref = []
-        for role_id in metadata_ref.get('roles', []):
-            roles_ref.append(self.identity_api.get_role(context, role_id))
+        roles_ref = self.identity_api.get_roles(context,
+                                                metadata_ref.get('roles', []))
+        try:
+            token_ref = self.token_api.create_token(
+                    context, token_id, self._build_token_data(
+                            token_id, user_ref, tenant_ref, metadata_ref,
+                            roles_ref, catalog_ref))
+        except token.StorageError as e:
+            logging.error('Could not issue a token: %s', e)
+            raise webob.exc.HTTPServiceUnavailable()
         logging.debug('TOKEN_REF %s', token_ref)
         return self._format_authenticate(token_ref, roles_ref, catalog_ref)
 
@@ -241,23 +247,45 @@ class TokenController(wsgi.Application):
 
         Optionally, also ensure that it is owned by a specific tenant.
 
+        For tokens holding their roles (see ``[token] embed_roles``) the
+        serialized response is cached until the token expires or is
+        deleted, for at most ``[token] response_cache_ttl`` seconds. Other
+        responses depend on roles looked up for each request and are never
+        cached.
+
         """
         # TODO(termie): this stuff should probably be moved to middleware
         self.assert_admin(context)
 
         token_ref = self.token_api.get_token(context=context,
                                              token_id=token_id)
+        if not token_ref:
+            self.validate_cache.delete(token_id)
+            raise webob.exc.HTTPNotFound()
         if belongs_to:
             assert token_ref['tenant']['id'] == belongs_to
 
-        # TODO(termie): optimize this call at some point and put it into the
-        #               the return for metadata
-        # fill out the roles in the metadata
-        metadata_ref = token_ref['metadata']
-        roles_ref = []
-        for role_id in metadata_ref.get('roles', []):
-            roles_ref.append(self.identity_api.get_role(context, role_id))
-        return self._format_token(token_ref, roles_ref)
+        if 'roles' not in token_ref:
+            # fill out the roles in the metadata, they can change at any
+            # time so the response isn't cached
+            metadata_ref = token_ref['metadata']
+            roles_ref = self.identity_api.get_roles(
+                    context, metadata_ref.get('roles', []))
+            return self._serialize(self._format_token(token_ref, roles_ref))
+
+        # revoking an embedded role deletes the token, so a cached response
+        # can't outlive the roles it reports
+        body = self.validate_cache.get(token_id)
+        if body is not None:
+            return body
+        body = self._serialize(self._format_token(token_ref,
+                                                  token_ref['roles']))
+
+        expires = None
+        if token_ref.get('expires'):
+            expires = utils.unixtime(token_ref['expires'])
+        self.validate_cache.set(token_id, body, expires=expires)
+        return body
 
     def delete_token(self, context, token_id):
         """Delete a token, effectively invalidating it for authz."""
@@ -265,19 +293,49 @@ class TokenController(wsgi.Application):
         self.assert_admin(context)
 
         self.token_api.delete_token(context=context, token_id=token_id)
+        self.validate_cache.delete(token_id)
 
     def endpoints(self, context, token_id):
         """Return service catalog endpoints."""
         token_ref = self.token_api.get_token(context=context,
                                              token_id=token_id)
-        catalog_ref = self.catalog_api.get_catalog(context,
-                                                   token_ref['user']['id'],
-                                                   token_ref['tenant']['id'])
-        return {'token': {'serviceCatalog': self._format_catalog(catalog_ref)}}
+        if 'catalog' in token_ref:
+            catalog_ref = token_ref['catalog']
+        else:
+            catalog_ref = self.catalog_api.get_formatted_catalog(
+                    context, token_ref['user']['id'],
+                    token_ref['tenant']['id'])
+        return {'token': {'serviceCatalog': catalog_ref}}
+
+    def _build_token_data(self, token_id, user_ref, tenant_ref, metadata_ref,
+                          roles_ref, catalog_ref):
+        """Build the record stored for a new token.
+
+        With ``[token] embed_roles`` and ``[token] embed_catalog`` the
+        resolved roles and the formatted catalog are stored along with the
+        token so that they don't need to be looked up again when it is used.
+
+        """
+        data = dict(expires='',
+                    id=token_id,
+                    user=user_ref,
+                    tenant=tenant_ref,
+                    metadata=metadata_ref)
+        if CONF.token.embed_roles:
+            data['roles'] = roles_ref
+        if CONF.token.embed_catalog:
+            data['catalog'] = catalog_ref
+        return data
 
     def _format_authenticate(self, token_ref, roles_ref, catalog_ref):
+        """Build the authenticate response.
+
+        `catalog_ref` is expected to already be in the output format, see
+        :func:`keystone.catalog.core.format_catalog`.
+
+        """
         o = self._format_token(token_ref, roles_ref)
-        o['access']['serviceCatalog'] = self._format_catalog(catalog_ref)
+        o['access']['serviceCatalog'] = catalog_ref
         return o
 
     def _format_token(self, token_ref, roles_ref):
@@ -300,51 +358,6 @@ class TokenController(wsgi.Application):
             o['access']['token']['tenant'] = token_ref['tenant']
         return o
 
-    def _format_catalog(self, catalog_ref):
-        """Munge catalogs from internal to output format
-        Internal catalogs look like:
-
-        {$REGION: {
-            {$SERVICE: {
-                $key1: $value1,
-                ...
-                }
-            }
-        }
-
-        The legacy api wants them to look like
-
-        [{'name': $SERVICE[name],
-          'type': $SERVICE,
-          'endpoints': [{
-              'tenantId': $tenant_id,
-              ...
-              'region': $REGION,
-              }],
-          'endpoints_links': [],
-         }]
-
-        """
-        if not catalog_ref:
-            return {}
-
-        services = {}
-        for region, region_ref in catalog_ref.iteritems():
-            for service, service_ref in region_ref.iteritems():
-                new_service_ref = services.get(service, {})
-                new_service_ref['name'] = service_ref.pop('name')
-                new_service_ref['type'] = service
-                new_service_ref['endpoints_links'] = []
-                service_ref['region'] = region
-
-                endpoints_ref = new_service_ref.get('endpoints', [])
-                endpoints_ref.append(service_ref)
-
-                new_service_ref['endpoints'] = endpoints_ref
-                services[service] = new_service_ref
-
-        return services.values()
-
 
 class VersionController(wsgi.Application):
     def __init__(self):
@@ -1,5 +1,7 @@
 # vim: tabstop=4 shiftwidth=4 softtabstop=4
 
+import datetime
+
 from keystone import token
 from keystone.common import kvs
 
@@ -10,8 +12,35 @@ class Token(kvs.Base, token.Driver):
         return self.db.get('token-%s' % token_id)
 
     def create_token(self, token_id, data):
-        self.db.set('token-%s' % token_id, data)
-        return data
+        data_copy = data.copy()
+        if not data_copy.get('expires'):
+            data_copy['expires'] = token.default_expire_time()
+
+        try:
+            self.db.set('token-%s' % token_id, data_copy,
+                        expires=data_copy['expires'])
+        except kvs.FullError as e:
+            raise token.StorageError(str(e))
+        return data_copy
 
     def delete_token(self, token_id):
         return self.db.delete('token-%s' % token_id)
+
+    def list_tokens(self, user_id):
+        return self.list_tokens_by_user([user_id]).get(user_id, [])
+
+    def list_tokens_by_user(self, user_ids):
+        # there is no index of tokens by user, so read them all once
+        user_ids = set(user_ids)
+        now = datetime.datetime.utcnow()
+        user_tokens = {}
+        for key, token_ref in self.db.items():
+            if not key.startswith('token-'):
+                continue
+            user_id = (token_ref.get('user') or {}).get('id')
+            if user_id not in user_ids:
+                continue
+            if token_ref.get('expires') and token_ref['expires'] <= now:
+                continue
+            user_tokens.setdefault(user_id, []).append(key[len('token-'):])
+        return user_tokens
@@ -0,0 +1,210 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+from __future__ import absolute_import
+
+import datetime
+import time
+
+from eventlet import pools
+import memcache
+
+from keystone import config
+from keystone import token
+from keystone.common import utils
+
+
+CONF = config.CONF
+config.register_list('servers', group='memcache', default=['localhost:11211'])
+config.register_int('max_connections', group='memcache', default=10)
+
+
+# memcached treats expiry times longer than this as absolute unix timestamps
+MAX_RELATIVE_TTL = 60 * 60 * 24 * 30
+
+
+class ClientPool(pools.Pool):
+    """Pool of memcache clients, one per concurrent green thread.
+
+    `memcache.Client` keeps its sockets in thread local storage which, with
+    threads left unpatched, is shared by every green thread in the process,
+    so a client may only be used by one green thread at a time.
+
+    """
+
+    def __init__(self, servers, max_size=10):
+        self.servers = servers
+        super(ClientPool, self).__init__(max_size=max_size)
+
+    def create(self):
+        return memcache.Client(self.servers, cache_cas=True)
+
+
+# pools are shared by every driver talking to the same servers
+_POOLS = {}
+
+
+def get_pool(servers, max_size):
+    key = (tuple(servers), max_size)
+    if key not in _POOLS:
+        _POOLS[key] = ClientPool(servers, max_size=max_size)
+    return _POOLS[key]
+
+
+class Token(token.Driver):
+    """Token driver storing tokens in memcached.
+
+    Each token is stored with a TTL matching its ``expires`` so memcached
+    drops it once it is no longer valid, tokens without one are given the
+    default ``[token] expiration``.
+
+    """
+
+    # how often adding to a user index is tried before giving up
+    index_retries = 10
+
+    def __init__(self, servers=None, max_connections=None):
+        if servers is None:
+            servers = CONF.memcache.servers
+        if max_connections is None:
+            max_connections = CONF.memcache.max_connections
+        self.pool = get_pool(servers, max_connections)
+
+    def _key(self, token_id):
+        return ('token-%s' % token_id).encode('utf-8')
+
+    def _user_key(self, user_id):
+        return ('usertokens-%s' % user_id).encode('utf-8')
+
+    def _read_user_index(self, index):
+        """Return the (token_id, expires_at) entries of a user index."""
+        entries = []
+        for entry in (index or '').split(','):
+            token_id, sep, expires_at = entry.rpartition(':')
+            if token_id:
+                entries.append((token_id, int(expires_at)))
+        return entries
+
+    def _add_to_user_index(self, client, user_id, token_id, expires_at):
+        """Record a token against its user so it can be found by list_tokens.
+
+        The index is a comma separated string of ``token_id:expires_at``
+        entries that lives as long as the last of its tokens. It is rewritten
+        with check and set for each new token, dropping the entries of tokens
+        that have expired, so it only grows with the valid tokens of a user.
+
+        :raises: StorageError if the index could not be written.
+
+        """
+        key = self._user_key(user_id)
+        try:
+            for i in xrange(self.index_retries):
+                index = client.gets(key)
+                now = int(time.time())
+                entries = [x for x in self._read_user_index(index)
+                           if x[1] > now]
+                entries.append((str(token_id), expires_at))
+                value = ','.join('%s:%d' % x for x in entries)
+                ttl = self._ttl_at(max(x[1] for x in entries))
+                # add only works on missing keys and cas only on ones that
+                # haven't changed since gets, retry if another client won
+                if index is None:
+                    stored = client.add(key, value, time=ttl)
+                else:
+                    stored = client.cas(key, value, time=ttl)
+                if stored:
+                    return
+        finally:
+            client.reset_cas()
+        raise token.StorageError('Failed to index token in memcache')
+
+    def _ttl(self, expires):
+        """Convert a naive utc datetime into a memcached expiry time."""
+        return self._ttl_at(utils.unixtime(expires))
+
+    def _ttl_at(self, expires_at):
+        """Convert a unix timestamp into a memcached expiry time."""
+        ttl = expires_at - int(time.time())
+        if ttl > MAX_RELATIVE_TTL:
+            return expires_at
+        return ttl
+
+    def _is_valid(self, token_ref):
+        # memcached only expires to the second, don't rely on it alone
+        expires = token_ref.get('expires')
+        return expires is None or expires > datetime.datetime.utcnow()
+
+    # Public interface
+    def get_token(self, token_id):
+        with self.pool.item() as client:
+            try:
+                token_ref = client.get(self._key(token_id))
+            except memcache.Client.MemcachedKeyError:
+                return
+        if token_ref is not None and self._is_valid(token_ref):
+            return token_ref
+
+    def get_tokens(self, token_ids):
+        with self.pool.item() as client:
+            keys = {}
+            for token_id in token_ids:
+                key = self._key(token_id)
+                try:
+                    client.check_key(key)
+                except memcache.Client.MemcachedKeyError:
+                    continue
+                keys[key] = token_id
+            found = client.get_multi(keys.keys())
+        return dict((keys[key], token_ref)
+                    for key, token_ref in found.iteritems()
+                    if self._is_valid(token_ref))
+
+    def create_token(self, token_id, data):
+        data_copy = data.copy()
+        if not data_copy.get('expires'):
+            data_copy['expires'] = token.default_expire_time()
+
+        ttl = self._ttl(data_copy['expires'])
+        if ttl <= 0:
+            # already expired, memcached would store it forever
+            return data_copy
+        user_id = (data_copy.get('user') or {}).get('id')
+        with self.pool.item() as client:
+            if not client.set(self._key(token_id), data_copy, time=ttl):
+                raise token.StorageError('Failed to store token in memcache')
+            if user_id:
+                try:
+                    self._add_to_user_index(
+                            client, user_id, token_id,
+                            utils.unixtime(data_copy['expires']))
+                except token.StorageError:
+                    # a token missing from the index can't be revoked
+                    client.delete(self._key(token_id))
+                    raise
+        return data_copy
+
+    def delete_token(self, token_id):
+        with self.pool.item() as client:
+            try:
+                client.delete(self._key(token_id))
+            except memcache.Client.MemcachedKeyError:
+                pass
+
+    def list_tokens(self, user_id):
+        return self.list_tokens_by_user([user_id]).get(user_id, [])
+
+    def list_tokens_by_user(self, user_ids):
+        keys = dict((self._user_key(x), x) for x in user_ids)
+        with self.pool.item() as client:
+            indexes = client.get_multi(keys.keys())
+        user_tokens = {}
+        for key, index in indexes.iteritems():
+            user_tokens[keys[key]] = [token_id for token_id, expires_at
+                                      in self._read_user_index(index)]
+        token_refs = self.get_tokens(
+                [x for token_ids in user_tokens.values() for x in token_ids])
+        rv = {}
+        for user_id, token_ids in user_tokens.iteritems():
+            token_ids = [x for x in token_ids if x in token_refs]
+            if token_ids:
+                rv[user_id] = token_ids
+        return rv
@@ -0,0 +1,152 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+import datetime
+
+import eventlet
+
+from keystone import config
+from keystone import token
+from keystone.common import logging
+from keystone.common import sql
+from keystone.common.sql import migration
+
+
+CONF = config.CONF
+config.register_int('purge_interval', group='token', default=0)
+config.register_int('purge_batch_size', group='token', default=1000)
+
+
+class TokenModel(sql.ModelBase, sql.DictBase):
+    __tablename__ = 'token'
+    id = sql.Column(sql.String(64), primary_key=True)
+    expires = sql.Column(sql.DateTime(), index=True)
+    user_id = sql.Column(sql.String(64), index=True)
+    _extra = sql.Column('extra', sql.JsonBlob())
+    extra = sql.lazy_json('_extra')
+
+    @classmethod
+    def from_dict(cls, token_dict):
+        # shove any non-indexed properties into extra
+        extra = {}
+        for k, v in token_dict.copy().iteritems():
+            if k not in ['id', 'expires']:
+                extra[k] = token_dict.pop(k)
+
+        token_dict['extra'] = extra
+        # the owner gets its own column so tokens can be listed by user
+        token_dict['user_id'] = (extra.get('user') or {}).get('id')
+        return cls(**token_dict)
+
+    @classmethod
+    def row_to_dict(cls, row):
+        token_dict = sql.json_dict(row._extra)
+        token_dict['id'] = row.id
+        token_dict['expires'] = row.expires
+        return token_dict
+
+
+class Token(sql.Base, token.Driver):
+    """Token driver storing tokens in a table keyed by id.
+
+    Tokens are given an expiry of ``[token] expiration`` seconds if they don't
+    carry one and are treated as missing once expired. Expired rows are
+    deleted by `flush_expired_tokens`, which is run every
+    ``[token] purge_interval`` seconds in the background if that is set.
+
+    """
+
+    _purge_thread = None
+
+    def __init__(self):
+        super(Token, self).__init__()
+        if CONF.token.purge_interval > 0 and Token._purge_thread is None:
+            Token._purge_thread = eventlet.spawn(self._purge_loop,
+                                                 CONF.token.purge_interval)
+
+    # Internal interface to manage the database
+    def db_sync(self):
+        migration.db_sync()
+
+    # Public interface
+    def get_token(self, token_id):
+        session = self.get_session()
+        token_ref = session.query(TokenModel).get(token_id)
+        if not token_ref:
+            return
+        now = datetime.datetime.utcnow()
+        if token_ref.expires and token_ref.expires <= now:
+            return
+        return token_ref.to_dict()
+
+    def create_token(self, token_id, data):
+        data_copy = data.copy()
+        if not data_copy.get('expires'):
+            data_copy['expires'] = token.default_expire_time()
+
+        session = self.get_session()
+        with session.begin():
+            token_ref = TokenModel.from_dict(data_copy)
+            session.add(token_ref)
+            session.flush()
+        return token_ref.to_dict()
+
+    def delete_token(self, token_id):
+        session = self.get_session()
+        token_ref = session.query(TokenModel).get(token_id)
+        if not token_ref:
+            return
+        with session.begin():
+            session.delete(token_ref)
+            session.flush()
+
+    def list_tokens(self, user_id):
+        now = datetime.datetime.utcnow()
+        session = self.get_session()
+        token_refs = session.query(TokenModel.id)\
+                            .filter_by(user_id=user_id)\
+                            .filter(TokenModel.expires > now)
+        return [x.id for x in token_refs]
+
+    def flush_expired_tokens(self, batch_size=None):
+        """Delete expired tokens.
+
+        Rows are deleted in batches of at most `batch_size`, yielding to
+        other green threads in between, so that a large backlog doesn't hold
+        a long running transaction.
+
+        :returns: the number of tokens deleted.
+
+        """
+        if batch_size is None:
+            batch_size = CONF.token.purge_batch_size
+        now = datetime.datetime.utcnow()
+        session = self.get_session()
+        deleted = 0
+        while True:
+            # uses the index on expires
+            expired = session.query(TokenModel.id)\
+                             .filter(TokenModel.expires <= now)\
+                             .limit(batch_size)\
+                             .all()
+            token_ids = [x.id for x in expired]
+            if not token_ids:
+                break
+
+            with session.begin():
+                session.query(TokenModel)\
+                       .filter(TokenModel.id.in_(token_ids))\
+                       .delete(synchronize_session=False)
+            deleted += len(token_ids)
+            if len(token_ids) < batch_size:
+                break
+            eventlet.sleep(0)
+        return deleted
+
+    def _purge_loop(self, interval):
+        while True:
+            eventlet.sleep(interval)
+            try:
+                deleted = self.flush_expired_tokens()
+                logging.debug('Purged %s expired tokens', deleted)
+            except Exception:
+                logging.exception('Failed to purge expired tokens')
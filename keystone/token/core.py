@@ -2,11 +2,34 @@
 
 """Main entry point into the Token service."""
 
+import datetime
+
 from keystone import config
 from keystone.common import manager
 
 
 CONF = config.CONF
+config.register_int('expiration', group='token', default=86400)
+config.register_bool('embed_roles', group='token', default=False)
+config.register_bool('embed_catalog', group='token', default=False)
+config.register_int('response_cache_size', group='token', default=1000)
+config.register_int('response_cache_ttl', group='token', default=300)
+
+
+def default_expire_time():
+    """Determine when a fresh token should expire.
+
+    Expiration time varies based on configuration (see ``[token] expiration``).
+
+    :returns: a naive utc datetime.datetime object
+
+    """
+    expire_delta = datetime.timedelta(seconds=CONF.token.expiration)
+    return datetime.datetime.utcnow() + expire_delta
+
+
+class StorageError(Exception):
+    """A token driver could not store a token."""
 
 
 class Manager(manager.Manager):
@@ -34,6 +57,24 @@ class Driver(object):
         """
         raise NotImplementedError()
 
+    def get_tokens(self, token_ids):
+        """Get several tokens by id.
+
+        Drivers that can fetch many keys in one round trip should override
+        this, the default falls back to `get_token` for each id.
+
+        :param token_ids: identities of the tokens
+        :type token_ids: list
+        :returns: dict of token_id to token_ref, missing tokens are left out.
+
+        """
+        token_refs = {}
+        for token_id in token_ids:
+            token_ref = self.get_token(token_id)
+            if token_ref is not None:
+                token_refs[token_id] = token_ref
+        return token_refs
+
     def create_token(self, token_id, data):
         """Create a token by id and data.
 
@@ -53,6 +94,7 @@ class Driver(object):
 
         :type data: dict
         :returns: token_ref or None.
+        :raises: StorageError if the backend failed to store the token.
 
         """
         raise NotImplementedError()
@@ -66,3 +108,32 @@ class Driver(object):
 
         """
         raise NotImplementedError()
+
+    def list_tokens(self, user_id):
+        """List the unexpired tokens issued to a user.
+
+        :param user_id: identity of the user
+        :type user_id: string
+        :returns: a list of token ids.
+
+        """
+        raise NotImplementedError()
+
+    def list_tokens_by_user(self, user_ids):
+        """List the unexpired tokens issued to each of several users.
+
+        Drivers that can find them all in one pass should override this,
+        the default falls back to `list_tokens` for each user.
+
+        :param user_ids: identities of the users
+        :type user_ids: iterable
+        :returns: dict of user_id to a list of token ids, users without
+                  tokens are left out.
+
+        """
+        user_tokens = {}
+        for user_id in user_ids:
+            token_ids = self.list_tokens(user_id)
+            if token_ids:
+                user_tokens[user_id] = token_ids
+        return user_tokens
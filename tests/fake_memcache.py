@@ -0,0 +1,194 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+"""In-process stand-in for memcached.
+
+Speaks enough of the memcached text protocol (get, gets, set, add, replace,
+cas, append, prepend, delete, touch, flush_all, version) for the memcache
+token backend to be tested without a real server.
+
+"""
+
+import time
+
+import eventlet
+
+
+# memcached treats expiry times longer than this as absolute unix timestamps
+MAX_RELATIVE_TTL = 60 * 60 * 24 * 30
+
+
+class FakeMemcacheServer(object):
+    def __init__(self):
+        self.data = {}
+        # the cas unique of each key, bumped whenever its value changes
+        self.cas_ids = {}
+        self.last_cas_id = 0
+        self.socket = None
+        self.threads = set()
+
+    def start(self, host='127.0.0.1', port=0):
+        """Start serving, returns the address to hand to clients."""
+        self.socket = eventlet.listen((host, port))
+        self.port = self.socket.getsockname()[1]
+        self._spawn(self._serve)
+        return '%s:%s' % (host, self.port)
+
+    def stop(self):
+        for thread in list(self.threads):
+            thread.kill()
+        self.socket.close()
+
+    def _spawn(self, func, *args):
+        thread = eventlet.spawn(func, *args)
+        self.threads.add(thread)
+        thread.link(lambda *a: self.threads.discard(thread))
+
+    def _serve(self):
+        while True:
+            sock, addr = self.socket.accept()
+            self._spawn(self._handle, sock)
+
+    def _handle(self, sock):
+        fp = sock.makefile('rwb')
+        try:
+            while True:
+                line = fp.readline()
+                if not line:
+                    break
+                args = line.split()
+                if not args:
+                    continue
+                command = args.pop(0)
+                if command == 'quit':
+                    break
+                handler = getattr(self, '_do_%s' % command, None)
+                if handler is None:
+                    fp.write('ERROR\r\n')
+                else:
+                    handler(fp, args)
+                fp.flush()
+        finally:
+            fp.close()
+            sock.close()
+
+    def _get(self, key):
+        item = self.data.get(key)
+        if item is None:
+            return
+        flags, value, expires = item
+        if expires and expires <= time.time():
+            del self.data[key]
+            return
+        return flags, value
+
+    def _reply(self, fp, args, message):
+        if 'noreply' not in args:
+            fp.write(message)
+
+    def _changed(self, key):
+        self.last_cas_id += 1
+        self.cas_ids[key] = self.last_cas_id
+
+    def _do_get(self, fp, args):
+        for key in args:
+            item = self._get(key)
+            if item is not None:
+                flags, value = item
+                fp.write('VALUE %s %s %d\r\n%s\r\n'
+                         % (key, flags, len(value), value))
+        fp.write('END\r\n')
+
+    def _do_gets(self, fp, args):
+        for key in args:
+            item = self._get(key)
+            if item is not None:
+                flags, value = item
+                fp.write('VALUE %s %s %d %d\r\n%s\r\n'
+                         % (key, flags, len(value), self.cas_ids.get(key, 0),
+                            value))
+        fp.write('END\r\n')
+
+    def _expires(self, exptime):
+        exptime = int(exptime)
+        if exptime < 0:
+            return time.time()
+        elif exptime and exptime <= MAX_RELATIVE_TTL:
+            return time.time() + exptime
+        return exptime
+
+    def _store(self, fp, args, condition):
+        key, flags, exptime, length = args[:4]
+        value = fp.read(int(length))
+        fp.read(2)
+
+        if condition(self._get(key)):
+            self.data[key] = (int(flags), value, self._expires(exptime))
+            self._changed(key)
+            self._reply(fp, args, 'STORED\r\n')
+        else:
+            self._reply(fp, args, 'NOT_STORED\r\n')
+
+    def _concat(self, fp, args, join):
+        key, flags, exptime, length = args[:4]
+        value = fp.read(int(length))
+        fp.read(2)
+
+        item = self._get(key)
+        if item is None:
+            self._reply(fp, args, 'NOT_STORED\r\n')
+            return
+        old_flags, old_value, expires = self.data[key]
+        self.data[key] = (old_flags, join(old_value, value), expires)
+        self._changed(key)
+        self._reply(fp, args, 'STORED\r\n')
+
+    def _do_set(self, fp, args):
+        self._store(fp, args, lambda item: True)
+
+    def _do_add(self, fp, args):
+        self._store(fp, args, lambda item: item is None)
+
+    def _do_replace(self, fp, args):
+        self._store(fp, args, lambda item: item is not None)
+
+    def _do_cas(self, fp, args):
+        key, flags, exptime, length, cas_id = args[:5]
+        value = fp.read(int(length))
+        fp.read(2)
+
+        if self._get(key) is None:
+            self._reply(fp, args, 'NOT_FOUND\r\n')
+        elif self.cas_ids.get(key, 0) != int(cas_id):
+            self._reply(fp, args, 'EXISTS\r\n')
+        else:
+            self.data[key] = (int(flags), value, self._expires(exptime))
+            self._changed(key)
+            self._reply(fp, args, 'STORED\r\n')
+
+    def _do_append(self, fp, args):
+        self._concat(fp, args, lambda old, new: old + new)
+
+    def _do_prepend(self, fp, args):
+        self._concat(fp, args, lambda old, new: new + old)
+
+    def _do_touch(self, fp, args):
+        if self._get(args[0]) is None:
+            self._reply(fp, args, 'NOT_FOUND\r\n')
+        else:
+            flags, value, expires = self.data[args[0]]
+            self.data[args[0]] = (flags, value, self._expires(args[1]))
+            self._reply(fp, args, 'TOUCHED\r\n')
+
+    def _do_delete(self, fp, args):
+        if self._get(args[0]) is None:
+            self._reply(fp, args, 'NOT_FOUND\r\n')
+        else:
+            del self.data[args[0]]
+            self._reply(fp, args, 'DELETED\r\n')
+
+    def _do_flush_all(self, fp, args):
+        self.data.clear()
+        self._reply(fp, args, 'OK\r\n')
+
+    def _do_version(self, fp, args):
+        fp.write('VERSION fake\r\n')
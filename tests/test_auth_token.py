@@ -0,0 +1,110 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+import json
+
+import webob
+
+from keystone import config
+from keystone import test
+from keystone.middleware import auth_token
+
+import default_fixtures
+
+
+CONF = config.CONF
+
+
+class FakeApp(object):
+    """Downstream app that echoes the identity headers it was given."""
+
+    def __call__(self, env, start_response):
+        headers = dict((k, v) for k, v in env.iteritems()
+                       if k.startswith('HTTP_X_'))
+        return webob.Response(json.dumps(headers))(env, start_response)
+
+
+class AuthTokenTestCase(test.TestCase):
+    def setUp(self):
+        super(AuthTokenTestCase, self).setUp()
+        self.load_backends()
+        self.load_fixtures(default_fixtures)
+        self.metadata_foobar = self.identity_api.update_metadata(
+            self.user_foo['id'], self.tenant_bar['id'],
+            dict(roles=['keystone_admin'], is_admin='1'))
+
+        self.public_app = self.loadapp('keystone', name='main')
+        self.admin_server = self.serveapp('keystone', name='admin')
+        admin_port = self.admin_server.socket_info['socket'][1]
+
+        self.middleware = auth_token.filter_factory(
+                {},
+                auth_protocol='http',
+                auth_host='localhost',
+                auth_port=admin_port,
+                admin_token=CONF.admin_token,
+                service_port='0')(FakeApp())
+
+    def _get_token(self):
+        client = self.client(self.public_app)
+        body = json.dumps({'auth': {
+            'passwordCredentials': {'username': self.user_foo['name'],
+                                    'password': self.user_foo['password']},
+            'tenantId': self.tenant_bar['id']}})
+        resp = client.post('/v2.0/tokens', body=body)
+        return json.loads(resp.body)['access']['token']['id']
+
+    def _request(self, token):
+        client = self.client(self.middleware, token=token)
+        return client.get('/')
+
+    def test_valid_token_is_cached(self):
+        token = self._get_token()
+
+        resp = self._request(token)
+        self.assertEquals(resp.status_int, 200)
+        headers = json.loads(resp.body)
+        self.assertEquals(headers['HTTP_X_IDENTITY_STATUS'], 'Confirmed')
+        self.assertEquals(headers['HTTP_X_TENANT_ID'], self.tenant_bar['id'])
+        self.assertEquals(headers['HTTP_X_ROLE'], 'Keystone Admin')
+        self.assertEquals(self.middleware.token_cache.misses, 1)
+
+        resp = self._request(token)
+        self.assertEquals(resp.status_int, 200)
+        self.assertEquals(json.loads(resp.body), headers)
+        self.assertEquals(self.middleware.token_cache.hits, 1)
+        self.assertEquals(self.middleware.token_cache.misses, 1)
+
+    def test_invalid_token_is_not_cached(self):
+        resp = self._request('nonexistent')
+        self.assertEquals(resp.status_int, 401)
+        self.assertEquals(len(self.middleware.token_cache), 0)
+
+    def test_connections_are_reused(self):
+        self.middleware.token_cache.maxsize = 0
+        token = self._get_token()
+
+        for i in range(3):
+            resp = self._request(token)
+            self.assertEquals(resp.status_int, 200)
+        self.assertEquals(self.middleware.auth_http_pool.created, 1)
+        self.assertEquals(self.middleware.auth_http_pool.reused, 2)
+
+    def test_stale_connection_is_replaced(self):
+        self.middleware.token_cache.maxsize = 0
+        token = self._get_token()
+        resp = self._request(token)
+        self.assertEquals(resp.status_int, 200)
+
+        # simulate the server dropping an idle keep-alive connection
+        conn, last_used = self.middleware.auth_http_pool._idle[0]
+        conn.sock.close()
+
+        resp = self._request(token)
+        self.assertEquals(resp.status_int, 200)
+        self.assertEquals(self.middleware.auth_http_pool.created, 2)
+
+    def test_token_expiry(self):
+        token_info = {'access': {'token': {'expires': '2012-02-05T00:00:00'}}}
+        self.assertEquals(self.middleware._get_token_expiry(token_info),
+                          1328400000)
+        token_info = {'access': {'token': {'expires': ''}}}
+        self.assert_(self.middleware._get_token_expiry(token_info) is None)
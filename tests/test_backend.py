@@ -1,3 +1,11 @@
+import uuid
+
+from keystone import config
+
+
+CONF = config.CONF
+
+
 class IdentityTests(object):
   def test_authenticate_bad_user(self):
     self.assertRaises(AssertionError,
@@ -45,6 +53,81 @@ class IdentityTests(object):
     self.assertDictEquals(tenant_ref, self.tenant_bar)
     self.assertDictEquals(metadata_ref, self.metadata_foobar)
 
+  def test_authenticate_by_name(self):
+    user_ref, tenant_ref, metadata_ref = \
+        self.identity_api.authenticate_by_name(
+            user_name=self.user_foo['name'],
+            tenant_name=self.tenant_bar['name'],
+            password=self.user_foo['password'])
+    self.assertEquals(user_ref['id'], self.user_foo['id'])
+    self.assert_('password' not in user_ref)
+    self.assertDictEquals(tenant_ref, self.tenant_bar)
+    self.assertDictEquals(metadata_ref, self.metadata_foobar)
+
+    user_ref, tenant_ref, metadata_ref = \
+        self.identity_api.authenticate_by_name(
+            user_name=self.user_foo['name'],
+            tenant_id=self.tenant_bar['id'],
+            password=self.user_foo['password'])
+    self.assertDictEquals(tenant_ref, self.tenant_bar)
+
+    user_ref, tenant_ref, metadata_ref = \
+        self.identity_api.authenticate_by_name(
+            user_name=self.user_foo['name'],
+            password=self.user_foo['password'])
+    self.assertEquals(user_ref['id'], self.user_foo['id'])
+    self.assert_(tenant_ref is None)
+
+  def test_authenticate_by_name_invalid(self):
+    self.assertRaises(AssertionError,
+        self.identity_api.authenticate_by_name,
+        user_name=self.user_foo['name'] + 'WRONG',
+        password=self.user_foo['password'])
+    self.assertRaises(AssertionError,
+        self.identity_api.authenticate_by_name,
+        user_name=self.user_foo['name'],
+        password=self.user_foo['password'] + 'WRONG')
+    self.assertRaises(AssertionError,
+        self.identity_api.authenticate_by_name,
+        user_name=self.user_foo['name'],
+        tenant_name=self.tenant_bar['name'] + 'WRONG',
+        password=self.user_foo['password'])
+    # the tenant exists but the user isn't a member
+    self.assertRaises(AssertionError,
+        self.identity_api.authenticate_by_name,
+        user_name=self.user_foo['name'],
+        tenant_name=self.tenant_baz['name'],
+        password=self.user_foo['password'])
+
+  def test_authenticate_rehashes_password(self):
+    self.identity_api.update_user(self.user_foo['id'],
+                                  {'password': self.user_foo['password']})
+    old_hash = self.identity_api._get_user(self.user_foo['id'])['password']
+    CONF.set_override('bcrypt_strength', 5)
+    try:
+      self.identity_api.authenticate(
+          user_id=self.user_foo['id'],
+          tenant_id=self.tenant_bar['id'],
+          password=self.user_foo['password'])
+    finally:
+      CONF.set_override('bcrypt_strength', None)
+    new_hash = self.identity_api._get_user(self.user_foo['id'])['password']
+    self.assertNotEquals(new_hash, old_hash)
+    self.assert_(new_hash.startswith('$2a$05$'))
+
+  def test_changed_password_is_not_cached(self):
+    self.identity_api.authenticate(
+        user_id=self.user_foo['id'],
+        tenant_id=self.tenant_bar['id'],
+        password=self.user_foo['password'])
+    self.identity_api.update_user(self.user_foo['id'],
+                                  {'password': 'new_password'})
+    self.assertRaises(AssertionError,
+        self.identity_api.authenticate,
+        user_id=self.user_foo['id'],
+        tenant_id=self.tenant_bar['id'],
+        password=self.user_foo['password'])
+
   def test_password_hashed(self):
     user_ref = self.identity_api._get_user(self.user_foo['id'])
     self.assertNotEqual(user_ref['password'], self.user_foo['password'])
@@ -82,6 +165,64 @@ class IdentityTests(object):
     self.user_foo.pop('password')
     self.assertDictEquals(user_ref, self.user_foo)
 
+  def test_get_tenants(self):
+    tenant_refs = self.identity_api.get_tenants(
+        [self.tenant_baz['id'], 'fake_tenant', self.tenant_bar['id']])
+    self.assertEquals(len(tenant_refs), 2)
+    self.assertDictEquals(tenant_refs[0], self.tenant_baz)
+    self.assertDictEquals(tenant_refs[1], self.tenant_bar)
+    self.assertEquals(self.identity_api.get_tenants([]), [])
+
+  def test_list_tenants_for_user(self):
+    tenant_refs = self.identity_api.list_tenants_for_user(self.user_foo['id'])
+    self.assertEquals(len(tenant_refs), 1)
+    self.assertDictEquals(tenant_refs[0], self.tenant_bar)
+
+    self.identity_api.add_user_to_tenant(self.tenant_baz['id'],
+                                         self.user_foo['id'])
+    tenant_refs = self.identity_api.list_tenants_for_user(self.user_foo['id'])
+    self.assertEquals(sorted(x['id'] for x in tenant_refs),
+                      sorted([self.tenant_bar['id'], self.tenant_baz['id']]))
+
+  def test_list_users_paginated(self):
+    user_ids = sorted(x['id'] for x in self.identity_api.list_users())
+    self.assertEquals(user_ids, sorted([self.user_foo['id'],
+                                        self.user_two['id']]))
+    first = list(self.identity_api.list_users(limit=1))
+    self.assertEquals([x['id'] for x in first], user_ids[:1])
+    rest = self.identity_api.list_users(marker=first[-1]['id'])
+    self.assertEquals([x['id'] for x in rest], user_ids[1:])
+    self.assertEquals(list(self.identity_api.list_users(limit=0)), [])
+    self.assertEquals(
+        list(self.identity_api.list_users(marker=user_ids[-1])), [])
+
+  def test_list_roles_paginated(self):
+    role_ids = sorted(x['id'] for x in self.identity_api.list_roles())
+    page = self.identity_api.list_roles(limit=1, marker=role_ids[0])
+    self.assertEquals([x['id'] for x in page], role_ids[1:2])
+
+  def test_get_users_for_tenant(self):
+    user_refs = self.identity_api.get_users_for_tenant(self.tenant_bar['id'])
+    self.assertEquals([x['id'] for x in user_refs], [self.user_foo['id']])
+
+    self.identity_api.add_user_to_tenant(self.tenant_baz['id'],
+                                         self.user_foo['id'])
+    user_refs = self.identity_api.get_users_for_tenant(self.tenant_baz['id'])
+    self.assertEquals(sorted(x['id'] for x in user_refs),
+                      sorted([self.user_foo['id'], self.user_two['id']]))
+
+    self.identity_api.remove_user_from_tenant(self.tenant_bar['id'],
+                                              self.user_foo['id'])
+    self.assertEquals(
+        self.identity_api.get_users_for_tenant(self.tenant_bar['id']), [])
+
+  def test_get_user_by_name_after_rename(self):
+    self.identity_api.update_user(self.user_foo['id'], {'name': 'fred'})
+    user_ref = self.identity_api.get_user_by_name(user_name='fred')
+    self.assertEquals(user_ref['id'], self.user_foo['id'])
+    self.assert_(self.identity_api.get_user_by_name(
+        user_name=self.user_foo['name']) is None)
+
   def test_get_metadata_bad_user(self):
     metadata_ref = self.identity_api.get_metadata(
         user_id=self.user_foo['id'] + 'WRONG',
@@ -105,4 +246,14 @@ class IdentityTests(object):
         role_id=self.role_keystone_admin['id'])
     self.assertDictEquals(role_ref, self.role_keystone_admin)
 
+  def test_get_roles(self):
+    role = {'id': uuid.uuid4().hex, 'name': uuid.uuid4().hex}
+    self.identity_api.create_role(role['id'], role)
+    role_refs = self.identity_api.get_roles(
+        [role['id'], 'fake_role', self.role_keystone_admin['id']])
+    self.assertEquals(len(role_refs), 2)
+    self.assertDictEquals(role_refs[0], role)
+    self.assertDictEquals(role_refs[1], self.role_keystone_admin)
+    self.assertEquals(self.identity_api.get_roles([]), [])
+
 
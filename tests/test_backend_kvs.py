@@ -1,6 +1,15 @@
+import datetime
+import os
+import shutil
+import tempfile
+import time
 import uuid
 
+from keystone import config
 from keystone import test
+from keystone import token
+from keystone.common import kvs
+from keystone.contrib.ec2.backends import kvs as ec2_kvs
 from keystone.identity.backends import kvs as identity_kvs
 from keystone.token.backends import kvs as token_kvs
 from keystone.catalog.backends import kvs as catalog_kvs
@@ -9,6 +18,9 @@ import test_backend
 import default_fixtures
 
 
+CONF = config.CONF
+
+
 class KvsIdentity(test.TestCase, test_backend.IdentityTests):
   def setUp(self):
     super(KvsIdentity, self).setUp()
@@ -16,6 +28,91 @@ class KvsIdentity(test.TestCase, test_backend.IdentityTests):
     self.load_fixtures(default_fixtures)
 
 
+class DictKvs(test.TestCase):
+  def test_sets(self):
+    db = kvs.DictKvs()
+    self.assertEquals(db.smembers('foo'), frozenset())
+    db.sadd('foo', 'a', 'b')
+    members = db.smembers('foo')
+    db.srem('foo', 'a', 'c')
+    db.sadd('foo', 'd')
+    self.assertEquals(db.smembers('foo'), frozenset(['b', 'd']))
+    self.assertEquals(members, frozenset(['a', 'b']))
+    db.srem('bar', 'a')
+
+  def test_immutable_values_are_not_copied(self):
+    db = kvs.DictKvs()
+    value = ('a', 'b')
+    db.set('foo', value)
+    self.assert_(db.get('foo') is value)
+    db.set('bar', 1)
+    self.assertEquals(db.get('bar'), 1)
+
+    value = {'a': 'b'}
+    db.set('foo', value)
+    value['a'] = 'c'
+    self.assertEquals(db.get('foo'), {'a': 'b'})
+
+
+class KvsIndex(test.TestCase):
+  def test_index(self):
+    db = kvs.DictKvs()
+    index = kvs.Index('tenant_users', 'tenants')
+    index.update(db, 'foo', None, {'tenants': ['bar', 'baz']})
+    index.update(db, 'two', None, {'tenants': ['baz']})
+    self.assertEquals(index.lookup(db, 'baz'), frozenset(['foo', 'two']))
+
+    index.update(db, 'foo', {'tenants': ['bar', 'baz']}, {'tenants': ['qux']})
+    self.assertEquals(index.lookup(db, 'bar'), frozenset())
+    self.assertEquals(index.lookup(db, 'baz'), frozenset(['two']))
+    self.assertEquals(index.lookup(db, 'qux'), frozenset(['foo']))
+
+    index.update(db, 'two', {'tenants': ['baz']}, None)
+    self.assertEquals(sorted(db.keys()), ['index-tenant_users-qux'])
+
+  def test_credentials_by_user(self):
+    ec2_api = ec2_kvs.Ec2(db={})
+    ec2_api.create_credential('a', {'id': 'a', 'user_id': 'foo'})
+    ec2_api.create_credential('b', {'id': 'b', 'user_id': 'bar'})
+    self.assertEquals([x['id'] for x in ec2_api.list_credentials('foo')],
+                      ['a'])
+    ec2_api.delete_credential('a')
+    self.assertEquals(list(ec2_api.list_credentials('foo')), [])
+
+  def test_index_ahead_of_records(self):
+    # readers of a shared kvs can see an index change before the records
+    identity_api = identity_kvs.Identity(db={})
+    identity_api.create_user('foo', {'id': 'foo', 'name': 'foo',
+                                     'tenants': ['bar']})
+    db = identity_api.db
+    identity_kvs.USER_NAME.update(db, 'new', None, {'name': 'new'})
+    identity_kvs.USER_NAME.update(db, 'foo', None, {'name': 'renamed'})
+    identity_kvs.TENANT_USERS.update(db, 'new', None, {'tenants': ['bar']})
+    db.sadd('user_list', 'new')
+
+    self.assert_(identity_api.get_user_by_name('new') is None)
+    self.assert_(identity_api.get_user_by_name('renamed') is None)
+    self.assertEquals(identity_api.get_user_by_name('foo')['id'], 'foo')
+    self.assertEquals([x['id'] for x in identity_api.list_users()], ['foo'])
+    self.assertEquals(
+        [x['id'] for x in identity_api.get_users_for_tenant('bar')], ['foo'])
+
+    ec2_api = ec2_kvs.Ec2(db={})
+    ec2_api.create_credential('a', {'id': 'a', 'user_id': 'foo'})
+    ec2_kvs.USER_CREDENTIALS.update(ec2_api.db, 'b', None, {'user_id': 'foo'})
+    self.assertEquals([x['id'] for x in ec2_api.list_credentials('foo')],
+                      ['a'])
+
+  def test_credentials_are_paginated(self):
+    ec2_api = ec2_kvs.Ec2(db={})
+    for x in 'cab':
+      ec2_api.create_credential(x, {'id': x, 'user_id': 'foo'})
+    page = ec2_api.list_credentials('foo', limit=2)
+    self.assertEquals([x['id'] for x in page], ['a', 'b'])
+    page = ec2_api.list_credentials('foo', limit=2, marker='b')
+    self.assertEquals([x['id'] for x in page], ['c'])
+
+
 class KvsToken(test.TestCase):
   def setUp(self):
     super(KvsToken, self).setUp()
@@ -26,15 +123,35 @@ class KvsToken(test.TestCase):
     data = {'id': token_id,
             'a': 'b'}
     data_ref = self.token_api.create_token(token_id, data)
+    expires = data_ref.pop('expires')
+    self.assert_(isinstance(expires, datetime.datetime))
     self.assertDictEquals(data_ref, data)
 
     new_data_ref = self.token_api.get_token(token_id)
+    self.assertEquals(new_data_ref.pop('expires'), expires)
     self.assertEquals(new_data_ref, data)
 
     self.token_api.delete_token(token_id)
     deleted_data_ref = self.token_api.get_token(token_id)
     self.assert_(deleted_data_ref is None)
 
+  def test_list_tokens(self):
+    token_ids = [uuid.uuid4().hex for x in range(2)]
+    for token_id in token_ids:
+      self.token_api.create_token(token_id, {'id': token_id,
+                                             'user': {'id': 'foo'}})
+    self.token_api.create_token('other', {'id': 'other',
+                                          'user': {'id': 'bar'}})
+    self.assertEquals(sorted(self.token_api.list_tokens('foo')),
+                      sorted(token_ids))
+
+  def test_list_tokens_by_user(self):
+    for token_id, user_id in [('a', 'foo'), ('b', 'bar'), ('c', 'baz')]:
+      self.token_api.create_token(token_id, {'id': token_id,
+                                             'user': {'id': user_id}})
+    self.assertEquals(self.token_api.list_tokens_by_user(['foo', 'bar', 'x']),
+                      {'foo': ['a'], 'bar': ['b']})
+
 
 class KvsCatalog(test.TestCase):
   def setUp(self):
@@ -58,3 +175,165 @@ class KvsCatalog(test.TestCase):
   def test_get_catalog(self):
     catalog_ref = self.catalog_api.get_catalog('foo', 'bar')
     self.assertDictEquals(catalog_ref, self.catalog_foobar)
+
+  def test_catalog_version(self):
+    version = self.catalog_api.get_catalog_version()
+    self.assertEquals(self.catalog_api.get_catalog_version(), version)
+
+    self.catalog_api.create_service('baz', {'id': 'baz'})
+    new_version = self.catalog_api.get_catalog_version()
+    self.assertNotEquals(new_version, version)
+
+    self.catalog_api.delete_service('baz')
+    self.assertNotEquals(self.catalog_api.get_catalog_version(), new_version)
+
+
+class SharedKvsTestCase(test.TestCase):
+  def setUp(self):
+    super(SharedKvsTestCase, self).setUp()
+    self.tmpdir = tempfile.mkdtemp()
+    self.path = os.path.join(self.tmpdir, 'kvs')
+    self.db = kvs.SharedKvs(self.path, slots=64, slot_size=1024)
+
+  def tearDown(self):
+    self.db.close()
+    shutil.rmtree(self.tmpdir)
+    super(SharedKvsTestCase, self).tearDown()
+
+
+class SharedKvsIdentity(SharedKvsTestCase, test_backend.IdentityTests):
+  def setUp(self):
+    super(SharedKvsIdentity, self).setUp()
+    self.identity_api = identity_kvs.Identity(db=self.db)
+    self.load_fixtures(default_fixtures)
+
+
+class SharedKvs(SharedKvsTestCase):
+  def test_crud(self):
+    self.db.set('foo', {'a': [1, 2]})
+    self.assertEquals(self.db.get('foo'), {'a': [1, 2]})
+    self.assert_('foo' in self.db)
+    self.db.set(u'foo', 'bar')
+    self.assertEquals(self.db['foo'], 'bar')
+    self.assertEquals(self.db.items(), [('foo', 'bar')])
+
+    self.db.delete('foo')
+    self.assert_(self.db.get('foo') is None)
+    self.assertRaises(KeyError, self.db.delete, 'foo')
+
+  def test_sets(self):
+    self.db.sadd('foo', 'a', 'b')
+    self.db.srem('foo', 'a', 'c')
+    other = kvs.SharedKvs(self.path)
+    other.sadd('foo', 'd')
+    other.close()
+    self.assertEquals(self.db.smembers('foo'), frozenset(['b', 'd']))
+    self.assertEquals(self.db.smembers('bar'), frozenset())
+
+  def test_collisions(self):
+    keys = ['key-%s' % x for x in range(64)]
+    for key in keys:
+      self.db.set(key, key)
+    for key in keys[::2]:
+      self.db.delete(key)
+    self.assertEquals(sorted(self.db.keys()), sorted(keys[1::2]))
+    for key in keys[1::2]:
+      self.assertEquals(self.db.get(key), key)
+    self.assertRaises(kvs.FullError, self.db.set, 'big', 'x' * 1024 * 64)
+
+  def test_values_bigger_than_a_slot(self):
+    big = dict(('key-%s' % x, 'x' * 100) for x in range(50))
+    self.db.set('big', big)
+    self.assertEquals(self.db.get('big'), big)
+    self.assertEquals(self.db.items(), [('big', big)])
+    used = 64 - self._free_slots()
+    self.assert_(used > 5)
+
+    # replacing it frees the chunks it had
+    big['key-0'] = 'y' * 200
+    self.db.set('big', big)
+    self.assertEquals(self.db['big'], big)
+    self.assert_(64 - self._free_slots() in (used, used + 1))
+    self.db.set('big', 'small')
+    self.assertEquals(self._free_slots(), 63)
+    self.db.set('big', big)
+    self.db.delete('big')
+    self.assertEquals(self._free_slots(), 64)
+
+  def test_sets_bigger_than_a_slot(self):
+    db = kvs.SharedKvs(os.path.join(self.tmpdir, 'users'), slots=1024,
+                       slot_size=256)
+    try:
+      identity_api = identity_kvs.Identity(db=db)
+      user_ids = ['user-%s' % x for x in range(100)]
+      for user_id in user_ids:
+        identity_api.create_user(user_id, {'id': user_id, 'name': user_id})
+      self.assertEquals(sorted(x['id'] for x in identity_api.list_users()),
+                        sorted(user_ids))
+      for user_id in user_ids[:-1]:
+        identity_api.delete_user(user_id)
+      self.assertEquals([x['id'] for x in identity_api.list_users()],
+                        user_ids[-1:])
+    finally:
+      db.close()
+
+  def _free_slots(self):
+    return len([x for x in range(self.db.slots)
+                if self.db._read(x, with_value=False)[0] in (0, 2)])
+
+  def test_expired_values_are_evicted(self):
+    past = datetime.datetime.utcnow() - datetime.timedelta(seconds=1)
+    future = datetime.datetime.utcnow() + datetime.timedelta(minutes=1)
+    self.db.set('current', 'value', expires=future)
+    self.db.set('expired', 'value', expires=past)
+    self.assertEquals(self.db.get('current'), 'value')
+    self.assert_(self.db.get('expired') is None)
+
+    # values that expire make room for more once they have
+    soon = datetime.datetime.utcnow() + datetime.timedelta(seconds=1)
+    for x in range(63):
+      self.db.set('key-%s' % x, x, expires=soon)
+    self.assertRaises(kvs.FullError, self.db.set, 'more', 'value')
+    time.sleep(1.1)
+    self.assert_(self.db.get('key-0') is None)
+    self.db.set('more', 'value')
+    self.assertEquals(self.db.get('more'), 'value')
+    self.assertEquals(self.db.evict_expired(), 62)
+    self.assertEquals(sorted(self.db.keys()), ['current', 'more'])
+
+  def test_expired_tokens_are_reclaimed(self):
+    token_api = token_kvs.Token(db=self.db)
+    CONF.set_override('expiration', 1, group='token')
+    try:
+      for x in range(64):
+        token_api.create_token('token-%s' % x, {'id': 'token-%s' % x})
+      self.assertRaises(token.StorageError, token_api.create_token,
+                        'more', {'id': 'more'})
+    finally:
+      CONF.set_override('expiration', None, group='token')
+
+    time.sleep(1.1)
+    token_api.create_token('more', {'id': 'more'})
+    self.assertEquals(token_api.get_token('more')['id'], 'more')
+    self.assert_(token_api.get_token('token-0') is None)
+
+  def test_shared_between_processes(self):
+    pid = os.fork()
+    if pid == 0:
+      try:
+        db = kvs.SharedKvs(self.path)
+        db.set('token-child', {'id': 'child'})
+      finally:
+        os._exit(0)
+    os.waitpid(pid, 0)
+    self.assertEquals(self.db.get('token-child'), {'id': 'child'})
+
+    token_api = token_kvs.Token(db=self.db)
+    self.assertEquals(token_api.get_token('child'), {'id': 'child'})
+
+  def test_reopen_keeps_layout(self):
+    self.db.set('foo', 'bar')
+    db = kvs.SharedKvs(self.path, slots=8, slot_size=128)
+    self.assertEquals(db.slots, 64)
+    self.assertEquals(db.get('foo'), 'bar')
+    db.close()
@@ -0,0 +1,143 @@
+import datetime
+import time
+import uuid
+
+import eventlet
+
+from keystone import test
+from keystone import token
+from keystone.token.backends import memcache as token_memcache
+
+import fake_memcache
+
+
+class MemcacheToken(test.TestCase):
+  def setUp(self):
+    super(MemcacheToken, self).setUp()
+    self.memcache_server = fake_memcache.FakeMemcacheServer()
+    self.servers = [self.memcache_server.start()]
+    self.token_api = token_memcache.Token(servers=self.servers)
+
+  def tearDown(self):
+    self.memcache_server.stop()
+    super(MemcacheToken, self).tearDown()
+
+  def test_token_crud(self):
+    token_id = uuid.uuid4().hex
+    data = {'id': token_id,
+            'a': 'b'}
+    data_ref = self.token_api.create_token(token_id, data)
+    expires = data_ref.pop('expires')
+    self.assert_(isinstance(expires, datetime.datetime))
+    self.assertDictEquals(data_ref, data)
+
+    new_data_ref = self.token_api.get_token(token_id)
+    self.assertEquals(new_data_ref.pop('expires'), expires)
+    self.assertEquals(new_data_ref, data)
+
+    self.token_api.delete_token(token_id)
+    deleted_data_ref = self.token_api.get_token(token_id)
+    self.assert_(deleted_data_ref is None)
+
+  def test_expired_token(self):
+    token_id = uuid.uuid4().hex
+    expires = datetime.datetime.utcnow() - datetime.timedelta(minutes=1)
+    data = {'id': token_id,
+            'expires': expires}
+    data_ref = self.token_api.create_token(token_id, data)
+    self.assertEquals(data_ref['expires'], expires)
+    self.assert_(self.token_api.get_token(token_id) is None)
+
+  def test_ttl_follows_expires(self):
+    token_id = uuid.uuid4().hex
+    expires = datetime.datetime.utcnow() + datetime.timedelta(minutes=5)
+    self.token_api.create_token(token_id, {'id': token_id,
+                                           'expires': expires})
+    flags, value, stored_expires = self.memcache_server.data[
+        'token-%s' % token_id]
+    self.assert_(abs(stored_expires - (time.time() + 300)) < 5)
+
+    # past the relative limit memcached wants an absolute timestamp
+    token_id = uuid.uuid4().hex
+    expires = datetime.datetime.utcnow() + datetime.timedelta(days=60)
+    self.token_api.create_token(token_id, {'id': token_id,
+                                           'expires': expires})
+    flags, value, stored_expires = self.memcache_server.data[
+        'token-%s' % token_id]
+    self.assert_(abs(stored_expires - (time.time() + 60 * 86400)) < 5)
+
+  def test_get_tokens(self):
+    token_ids = [uuid.uuid4().hex for x in range(3)]
+    for token_id in token_ids:
+      self.token_api.create_token(token_id, {'id': token_id})
+
+    token_refs = self.token_api.get_tokens(token_ids + ['missing',
+                                                        'bad key'])
+    self.assertEquals(sorted(token_refs.keys()), sorted(token_ids))
+    for token_id in token_ids:
+      self.assertEquals(token_refs[token_id]['id'], token_id)
+
+  def test_list_tokens(self):
+    token_ids = [uuid.uuid4().hex for x in range(2)]
+    for token_id in token_ids:
+      self.token_api.create_token(token_id, {'id': token_id,
+                                             'user': {'id': 'foo'}})
+    self.token_api.create_token('other', {'id': 'other',
+                                          'user': {'id': 'bar'}})
+    self.token_api.delete_token(token_ids[0])
+    self.assertEquals(self.token_api.list_tokens('foo'), token_ids[1:])
+    self.assertEquals(self.token_api.list_tokens('baz'), [])
+
+  def test_store_failure(self):
+    # memcached refuses values bigger than its item size limit
+    token_id = uuid.uuid4().hex
+    self.assertRaises(token.StorageError,
+                      self.token_api.create_token,
+                      token_id, {'id': token_id, 'a': 'x' * 2 * 1024 * 1024})
+    self.assert_(self.token_api.get_token(token_id) is None)
+
+  def test_list_tokens_by_user(self):
+    for token_id, user_id in [('a', 'foo'), ('b', 'foo'), ('c', 'bar')]:
+      self.token_api.create_token(token_id, {'id': token_id,
+                                             'user': {'id': user_id}})
+    self.token_api.delete_token('c')
+    user_tokens = self.token_api.list_tokens_by_user(['foo', 'bar', 'baz'])
+    self.assertEquals(user_tokens, {'foo': ['a', 'b']})
+
+  def test_user_index_drops_expired_tokens(self):
+    past = int(time.time()) - 60
+    self.memcache_server.data['usertokens-foo'] = (
+        0, ','.join('old-%s:%s' % (x, past) for x in range(100)), 0)
+    token_id = uuid.uuid4().hex
+    self.token_api.create_token(token_id, {'id': token_id,
+                                           'user': {'id': 'foo'}})
+    flags, index, expires = self.memcache_server.data['usertokens-foo']
+    self.assertEquals(index.split(':')[0], token_id)
+    self.assertEquals(self.token_api.list_tokens('foo'), [token_id])
+
+  def test_user_index_failure(self):
+    # an index memcached won't store means the token couldn't be revoked
+    future = int(time.time()) + 3600
+    self.memcache_server.data['usertokens-foo'] = (
+        0, ','.join('%032d:%s' % (x, future) for x in range(40000)), 0)
+    token_id = uuid.uuid4().hex
+    self.assertRaises(token.StorageError,
+                      self.token_api.create_token,
+                      token_id, {'id': token_id, 'user': {'id': 'foo'}})
+    self.assert_(self.token_api.get_token(token_id) is None)
+
+  def test_bad_token_id(self):
+    self.assert_(self.token_api.get_token('bad key') is None)
+    self.assert_(self.token_api.get_token('x' * 300) is None)
+
+  def test_clients_are_pooled(self):
+    other_api = token_memcache.Token(servers=self.servers)
+    self.assert_(other_api.pool is self.token_api.pool)
+
+    token_id = uuid.uuid4().hex
+    self.token_api.create_token(token_id, {'id': token_id})
+    pool = eventlet.GreenPool()
+    results = list(pool.imap(self.token_api.get_token, [token_id] * 20))
+    self.assertEquals([x['id'] for x in results], [token_id] * 20)
+    self.assert_(self.token_api.pool.current_size
+                 <= self.token_api.pool.max_size)
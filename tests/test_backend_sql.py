@@ -1,10 +1,25 @@
+import datetime
 import os
 import uuid
 
+import eventlet
+import sqlalchemy
+import sqlalchemy.engine.url
+import sqlalchemy.event
+import sqlalchemy.exc
+import sqlalchemy.orm
+import sqlalchemy.pool
+import webob
+import webob.dec
+
 from keystone import config
 from keystone import test
+from keystone.common import sql
 from keystone.common.sql import util as sql_util
+from keystone.contrib.ec2.backends import sql as ec2_sql
 from keystone.identity.backends import sql as identity_sql
+from keystone.middleware import sql_session
+from keystone.token.backends import sql as token_sql
 
 import test_backend
 import default_fixtures
@@ -28,26 +43,486 @@ class SqlIdentity(test.TestCase, test_backend.IdentityTests):
     self.identity_api = identity_sql.Identity()
     self.load_fixtures(default_fixtures)
 
+  def test_authenticate_is_one_query(self):
+    statements = []
+    def count(conn, cursor, statement, *args):
+      statements.append(statement)
 
-#class SqlToken(test_backend_kvs.KvsToken):
-#  def setUp(self):
-#    super(SqlToken, self).setUp()
-#    self.token_api = sql.SqlToken()
-#    self.load_fixtures(default_fixtures)
-
-#  def test_token_crud(self):
-#    token_id = uuid.uuid4().hex
-#    data = {'id': token_id,
-#            'a': 'b'}
-#    data_ref = self.token_api.create_token(token_id, data)
-#    self.assertDictEquals(data_ref, data)
-
-#    new_data_ref = self.token_api.get_token(token_id)
-#    self.assertEquals(new_data_ref, data)
-
-#    self.token_api.delete_token(token_id)
-#    deleted_data_ref = self.token_api.get_token(token_id)
-#    self.assert_(deleted_data_ref is None)
+    engine = self.identity_api.get_engine()
+    sqlalchemy.event.listen(engine, 'before_cursor_execute', count)
+    try:
+      self.identity_api.authenticate_by_name(
+          user_name=self.user_foo['name'],
+          tenant_name=self.tenant_bar['name'],
+          password=self.user_foo['password'])
+    finally:
+      engine.dispatch.before_cursor_execute.remove(count, engine)
+    self.assertEquals(len(statements), 1)
+
+  def test_extra_is_decoded_lazily(self):
+    session = self.identity_api.get_session()
+    user_ref = session.query(identity_sql.User)\
+                      .filter_by(id=self.user_foo['id'])\
+                      .first()
+    self.assert_(isinstance(user_ref._extra, sql.JsonText))
+
+    user_dict = user_ref.to_dict()
+    self.assertEquals(user_dict['name'], self.user_foo['name'])
+    self.assert_(isinstance(user_ref._extra, sql.JsonText))
+
+    self.assert_('id' not in user_ref.extra)
+    self.assert_(isinstance(user_ref._extra, dict))
+    self.assert_(user_ref.to_dict() is not user_ref.extra)
+    self.assertFalse(session.dirty)
+
+  def test_rows_and_models_give_the_same_dict(self):
+    session = self.identity_api.get_session()
+    for model in (identity_sql.User, identity_sql.Tenant, identity_sql.Role):
+      for model_ref in session.query(model):
+        row = session.query(*model.columns())\
+                     .filter_by(id=model_ref.id)\
+                     .one()
+        self.assert_(not isinstance(row, model))
+        self.assertEquals(model.row_to_dict(row), model_ref.to_dict())
+
+  def test_iteration_is_reentrant(self):
+    session = self.identity_api.get_session()
+    role_ref = session.query(identity_sql.Role).first()
+    pairs = [(x, y) for x in role_ref for y in role_ref]
+    self.assertEquals(len(pairs), 4)
+    self.assertEquals(dict(role_ref.iteritems()), role_ref.to_dict())
+
+
+class SqlUnitOfWork(test.TestCase):
+  def setUp(self):
+    super(SqlUnitOfWork, self).setUp()
+    CONF(config_files=[test.etcdir('keystone.conf'),
+                       test.testsdir('test_overrides.conf'),
+                       test.testsdir('backend_sql.conf')])
+    sql_util.setup_test_database()
+    self.identity_api = identity_sql.Identity()
+
+  def _create_user(self):
+    user_id = uuid.uuid4().hex
+    self.identity_api.create_user(user_id, {'id': user_id,
+                                            'name': user_id,
+                                            'password': 'secret'})
+    return user_id
+
+  def test_session_is_shared(self):
+    with sql.UnitOfWork():
+      session = self.identity_api.get_session()
+      self.assert_(self.identity_api.get_session() is session)
+      self.assert_(token_sql.Token().get_session() is session)
+    self.assert_(self.identity_api.get_session() is not session)
+
+  def test_commit(self):
+    with sql.UnitOfWork():
+      user_id = self._create_user()
+      self.identity_api.update_user(user_id, {'email': 'foo@example.com'})
+    self.assertEquals(self.identity_api.get_user(user_id)['email'],
+                      'foo@example.com')
+
+  def test_rollback(self):
+    with sql.UnitOfWork() as work:
+      user_id = self._create_user()
+      self.assert_(self.identity_api.get_user(user_id) is not None)
+      work.rollback()
+    self.assert_(self.identity_api.get_user(user_id) is None)
+
+  def test_rollback_on_error(self):
+    try:
+      with sql.UnitOfWork():
+        user_id = self._create_user()
+        raise ValueError()
+    except ValueError:
+      pass
+    self.assert_(self.identity_api.get_user(user_id) is None)
+
+  def test_nested(self):
+    with sql.UnitOfWork() as work:
+      with sql.UnitOfWork():
+        user_id = self._create_user()
+      self.assert_(self.identity_api.get_session().is_active)
+      work.rollback()
+    self.assert_(self.identity_api.get_user(user_id) is None)
+
+  def test_middleware_rolls_back_errors(self):
+    created = []
+
+    @webob.dec.wsgify
+    def app(request):
+      created.append(self._create_user())
+      return webob.Response(status=request.params['status'])
+
+    session_app = sql_session.SqlSessionMiddleware(app)
+    webob.Request.blank('/?status=200').get_response(session_app)
+    webob.Request.blank('/?status=500').get_response(session_app)
+    self.assert_(self.identity_api.get_user(created[0]) is not None)
+    self.assert_(self.identity_api.get_user(created[1]) is None)
+
+  def test_middleware_reads_streamed_bodies(self):
+    sessions = []
+
+    def body():
+      sessions.append(self.identity_api.get_session())
+      yield '[]'
+
+    @webob.dec.wsgify
+    def app(request):
+      sessions.append(self.identity_api.get_session())
+      return webob.Response(app_iter=body())
+
+    session_app = sql_session.SqlSessionMiddleware(app)
+    response = webob.Request.blank('/').get_response(session_app)
+    self.assertEquals(response.body, '[]')
+    self.assert_(sessions[0] is sessions[1])
+
+
+class SqlReadReplicas(test.TestCase):
+  replicas = ['sqlite:///replica1.db', 'sqlite:///replica2.db']
+  unreachable = 'sqlite:////nonexistent/replica.db'
+
+  def setUp(self):
+    super(SqlReadReplicas, self).setUp()
+    CONF(config_files=[test.etcdir('keystone.conf'),
+                       test.testsdir('test_overrides.conf'),
+                       test.testsdir('backend_sql.conf')])
+    sql_util.setup_test_database()
+    self.identity_api = identity_sql.Identity()
+    self.load_fixtures(default_fixtures)
+    for connection in self.replicas:
+      self._remove(connection)
+      sql.ModelBase.metadata.create_all(
+          self.identity_api.get_engine(connection))
+
+  def tearDown(self):
+    CONF.set_override('read_connections', None, group='sql')
+    for connection in self.replicas:
+      self._remove(connection)
+    sql.core._REPLICAS_DOWN.clear()
+    sql.core._REPLICAS_CHECKED.clear()
+    super(SqlReadReplicas, self).tearDown()
+
+  def _remove(self, connection):
+    try:
+      os.unlink(sqlalchemy.engine.url.make_url(connection).database)
+    except OSError:
+      pass
+
+  def _replicate_user(self, connection, user_id):
+    session = sqlalchemy.orm.Session(
+        bind=self.identity_api.get_engine(connection), autocommit=True)
+    with session.begin():
+      session.add(identity_sql.User.from_dict({'id': user_id,
+                                               'name': user_id}))
+
+  def test_reads_go_to_replica(self):
+    CONF.set_override('read_connections', self.replicas[:1], group='sql')
+    self.assert_(self.identity_api.get_user(self.user_foo['id']) is None)
+    self._replicate_user(self.replicas[0], self.user_foo['id'])
+    self.assertEquals(self.identity_api.get_user(self.user_foo['id'])['id'],
+                      self.user_foo['id'])
+
+  def test_replicas_take_turns(self):
+    CONF.set_override('read_connections', self.replicas, group='sql')
+    self._replicate_user(self.replicas[0], 'replicated')
+    found = [self.identity_api.get_user('replicated') is not None
+             for x in range(4)]
+    self.assertEquals(sorted(found), [False, False, True, True])
+
+  def test_unreachable_replica_is_skipped(self):
+    CONF.set_override('read_connections',
+                      [self.unreachable, self.replicas[0]],
+                      group='sql')
+    self._replicate_user(self.replicas[0], 'replicated')
+    for x in range(4):
+      self.assert_(self.identity_api.get_user('replicated') is not None)
+    self.assert_(self.identity_api.get_engine(self.unreachable)
+                 in sql.core._REPLICAS_DOWN)
+
+  def test_primary_is_used_without_replicas(self):
+    CONF.set_override('read_connections', [self.unreachable], group='sql')
+    self.assertEquals(self.identity_api.get_user(self.user_foo['id'])['id'],
+                      self.user_foo['id'])
+
+  def test_reads_follow_writes_in_unit_of_work(self):
+    CONF.set_override('read_connections', self.replicas, group='sql')
+    with sql.UnitOfWork():
+      self.assert_(self.identity_api.get_user(self.user_foo['id']) is None)
+      self.identity_api.create_user('new', {'id': 'new', 'name': 'new'})
+      self.assert_(self.identity_api.get_user('new') is not None)
+      self.assert_(self.identity_api.get_user(self.user_foo['id'])
+                   is not None)
+
+  def test_reads_follow_bulk_writes_in_unit_of_work(self):
+    CONF.set_override('read_connections', self.replicas, group='sql')
+    with sql.UnitOfWork():
+      self.assert_(self.identity_api.get_user(self.user_foo['id']) is None)
+      session = self.identity_api.get_session()
+      session.query(identity_sql.User).filter_by(id='missing').delete()
+      self.assert_(self.identity_api.get_user(self.user_foo['id'])
+                   is not None)
+
+  def test_role_changes_read_from_primary(self):
+    CONF.set_override('read_connections', self.replicas[:1], group='sql')
+    self.assert_(self.identity_api.get_metadata(self.user_foo['id'],
+                                                self.tenant_bar['id'])
+                 is None)
+    self.identity_api.add_role_to_user_and_tenant(
+        self.user_foo['id'], self.tenant_bar['id'], 'useless')
+    with sql.UnitOfWork():
+      self.identity_api.add_role_to_user_and_tenant(
+          self.user_foo['id'], self.tenant_bar['id'], 'keystone_admin')
+    self.identity_api.remove_role_from_user_and_tenant(
+        self.user_foo['id'], self.tenant_bar['id'], 'useless')
+
+    CONF.set_override('read_connections', None, group='sql')
+    metadata_ref = self.identity_api.get_metadata(self.user_foo['id'],
+                                                  self.tenant_bar['id'])
+    self.assertEquals(metadata_ref['roles'], ['keystone_admin'])
+    self.assertEquals(metadata_ref['extra'], 'extra')
+
+
+class SqlEc2(test.TestCase):
+  def setUp(self):
+    super(SqlEc2, self).setUp()
+    CONF(config_files=[test.etcdir('keystone.conf'),
+                       test.testsdir('test_overrides.conf'),
+                       test.testsdir('backend_sql.conf')])
+    sql_util.setup_test_database()
+    self.ec2_api = ec2_sql.Ec2()
+
+  def test_credentials_are_paginated(self):
+    for x in 'cab':
+      self.ec2_api.create_credential(x, {'access': x, 'user_id': 'foo'})
+    self.ec2_api.create_credential('d', {'access': 'd', 'user_id': 'bar'})
+    page = self.ec2_api.list_credentials('foo', limit=2)
+    self.assertEquals([x['access'] for x in page], ['a', 'b'])
+    page = self.ec2_api.list_credentials('foo', limit=2, marker='b')
+    self.assertEquals([x['access'] for x in page], ['c'])
+
+  def test_credentials_are_read_in_batches(self):
+    for x in 'ecadb':
+      self.ec2_api.create_credential(x, {'access': x, 'user_id': 'foo'})
+    statements = []
+    def count(conn, cursor, statement, *args):
+      statements.append(statement)
+
+    engine = self.ec2_api.get_engine()
+    sqlalchemy.event.listen(engine, 'before_cursor_execute', count)
+    try:
+      model = ec2_sql.Ec2Credential
+      query = self.ec2_api.get_session().query(*model.columns())
+      column = model.access
+      rows = list(sql.paginate(query, column, batch_size=2))
+      self.assertEquals([x.access for x in rows], list('abcde'))
+      self.assertEquals(len(statements), 3)
+      rows = list(sql.paginate(query, column, limit=3, batch_size=2))
+      self.assertEquals([x.access for x in rows], list('abc'))
+      self.assertEquals(len(statements), 5)
+    finally:
+      engine.dispatch.before_cursor_execute.remove(count, engine)
+
+
+class SqlToken(test.TestCase):
+  def setUp(self):
+    super(SqlToken, self).setUp()
+    CONF(config_files=[test.etcdir('keystone.conf'),
+                       test.testsdir('test_overrides.conf'),
+                       test.testsdir('backend_sql.conf')])
+    sql_util.setup_test_database()
+    self.token_api = token_sql.Token()
+
+  def test_token_crud(self):
+    token_id = uuid.uuid4().hex
+    data = {'id': token_id,
+            'a': 'b'}
+    data_ref = self.token_api.create_token(token_id, data)
+    expires = data_ref.pop('expires')
+    self.assert_(isinstance(expires, datetime.datetime))
+    self.assertDictEquals(data_ref, data)
+
+    new_data_ref = self.token_api.get_token(token_id)
+    self.assertEquals(new_data_ref.pop('expires'), expires)
+    self.assertEquals(new_data_ref, data)
+
+    self.token_api.delete_token(token_id)
+    deleted_data_ref = self.token_api.get_token(token_id)
+    self.assert_(deleted_data_ref is None)
+
+  def test_expired_token(self):
+    token_id = uuid.uuid4().hex
+    expires = datetime.datetime.utcnow() - datetime.timedelta(minutes=1)
+    data = {'id': token_id,
+            'expires': expires}
+    data_ref = self.token_api.create_token(token_id, data)
+    self.assertEquals(data_ref['expires'], expires)
+    self.assert_(self.token_api.get_token(token_id) is None)
+
+  def test_flush_expired_tokens(self):
+    past = datetime.datetime.utcnow() - datetime.timedelta(minutes=1)
+    expired_ids = [uuid.uuid4().hex for x in range(5)]
+    for token_id in expired_ids:
+      self.token_api.create_token(token_id, {'id': token_id, 'expires': past})
+    valid_id = uuid.uuid4().hex
+    self.token_api.create_token(valid_id, {'id': valid_id})
+
+    self.assertEquals(self.token_api.flush_expired_tokens(batch_size=2), 5)
+    self.assertEquals(self.token_api.flush_expired_tokens(batch_size=2), 0)
+    self.assert_(self.token_api.get_token(valid_id) is not None)
+
+  def test_list_tokens(self):
+    token_ids = [uuid.uuid4().hex for x in range(2)]
+    for token_id in token_ids:
+      self.token_api.create_token(token_id, {'id': token_id,
+                                             'user': {'id': 'foo'}})
+    past = datetime.datetime.utcnow() - datetime.timedelta(minutes=1)
+    self.token_api.create_token('expired', {'id': 'expired',
+                                            'expires': past,
+                                            'user': {'id': 'foo'}})
+    self.token_api.create_token('other', {'id': 'other',
+                                          'user': {'id': 'bar'}})
+    self.assertEquals(sorted(self.token_api.list_tokens('foo')),
+                      sorted(token_ids))
+
+
+class SqlIndexes(test.TestCase):
+  """The hot lookups should be index searches, not table scans."""
+
+  def setUp(self):
+    super(SqlIndexes, self).setUp()
+    CONF(config_files=[test.etcdir('keystone.conf'),
+                       test.testsdir('test_overrides.conf'),
+                       test.testsdir('backend_sql.conf')])
+    sql_util.setup_test_database()
+    self.identity_api = identity_sql.Identity()
+    self.session = self.identity_api.get_session()
+
+  def assertUsesIndex(self, query):
+    engine = self.identity_api.get_engine()
+    compiled = query.statement.compile(dialect=engine.dialect)
+    params = [compiled.params[x] for x in compiled.positiontup]
+    plan = [row['detail'] for row in
+            engine.execute('EXPLAIN QUERY PLAN %s' % compiled, *params)]
+    for step in plan:
+      self.assert_(step.startswith('SEARCH'), plan)
+
+  def test_user_by_name(self):
+    self.assertUsesIndex(self.session.query(identity_sql.User)
+                                     .filter_by(name='foo'))
+
+  def test_tenant_by_name(self):
+    self.assertUsesIndex(self.session.query(identity_sql.Tenant)
+                                     .filter_by(name='bar'))
+
+  def test_metadata(self):
+    self.assertUsesIndex(self.session.query(identity_sql.Metadata)
+                                     .filter_by(user_id='foo')
+                                     .filter_by(tenant_id='bar'))
+
+  def test_tenants_for_user(self):
+    self.assertUsesIndex(
+        self.session.query(identity_sql.UserTenantMembership)
+                    .filter_by(user_id='foo'))
+
+  def test_tenant_refs_for_user(self):
+    self.assertUsesIndex(
+        self.session.query(identity_sql.Tenant)
+                    .join(identity_sql.UserTenantMembership)
+                    .filter(identity_sql.UserTenantMembership.user_id
+                            == 'foo'))
+
+  def test_users_for_tenant(self):
+    self.assertUsesIndex(
+        self.session.query(identity_sql.User)
+                    .join(identity_sql.UserTenantMembership)
+                    .filter(identity_sql.UserTenantMembership.tenant_id
+                            == 'bar'))
+
+  def test_credentials_for_user(self):
+    self.assertUsesIndex(self.session.query(ec2_sql.Ec2Credential)
+                                     .filter_by(user_id='foo'))
+
+  def test_tokens_for_user(self):
+    self.assertUsesIndex(self.session.query(token_sql.TokenModel)
+                                     .filter_by(user_id='foo'))
+
+
+class SqlConnectionPool(test.TestCase):
+  def setUp(self):
+    super(SqlConnectionPool, self).setUp()
+    CONF(config_files=[test.etcdir('keystone.conf'),
+                       test.testsdir('test_overrides.conf'),
+                       test.testsdir('backend_sql.conf')])
+    url = sqlalchemy.engine.url.make_url(CONF.sql.connection)
+    CONF.set_override('min_pool_size', 1, group='sql')
+    CONF.set_override('max_pool_size', 2, group='sql')
+    self.pool = sql.Base()._create_pool(url)
+
+  def tearDown(self):
+    self.pool.clear()
+    CONF.set_override('min_pool_size', None, group='sql')
+    CONF.set_override('max_pool_size', None, group='sql')
+    super(SqlConnectionPool, self).tearDown()
+
+  def test_timeouts(self):
+    CONF.set_override('pool_timeout', 1, group='sql')
+    CONF.set_override('connect_timeout', 7, group='sql')
+    try:
+      url = sqlalchemy.engine.url.make_url(CONF.sql.connection)
+      pool = sql.Base()._create_pool(url)
+    finally:
+      CONF.set_override('pool_timeout', None, group='sql')
+      CONF.set_override('connect_timeout', None, group='sql')
+    pool.clear()
+    self.assertEquals(pool.timeout, 1)
+    self.assertEquals(pool.connect_timeout, 7)
+
+  def test_prewarmed(self):
+    stats = self.pool.stats()
+    self.assertEquals(stats['size'], 1)
+    self.assertEquals(stats['idle'], 1)
+    self.assertEquals(stats['in_use'], 0)
+
+  def test_waiters_are_served_in_order(self):
+    conns = [self.pool.get(), self.pool.get()]
+    self.assertEquals(self.pool.stats()['in_use'], 2)
+
+    served = []
+    def checkout(name):
+      conn = self.pool.get()
+      served.append(name)
+      return conn
+
+    waiters = [eventlet.spawn(checkout, x) for x in range(2)]
+    eventlet.sleep(0)
+    self.assertEquals(self.pool.stats()['waiting'], 2)
+
+    conns.pop().close()
+    conns.append(waiters[0].wait())
+    conns.pop(0).close()
+    conns.append(waiters[1].wait())
+    self.assertEquals(served, [0, 1])
+
+    stats = self.pool.stats()
+    self.assertEquals(stats['waits'], 2)
+    self.assertEquals(stats['waiting'], 0)
+    self.assertEquals(stats['checkouts'], 4)
+    self.assert_(stats['wait_time'] > 0)
+
+  def test_timeout(self):
+    self.pool.timeout = 0.01
+    conns = [self.pool.get(), self.pool.get()]
+    self.assertRaises(sqlalchemy.exc.TimeoutError, self.pool.get)
+
+  def test_engine_returns_connections(self):
+    engine = sqlalchemy.create_engine(CONF.sql.connection,
+                                      poolclass=sqlalchemy.pool.NullPool,
+                                      creator=self.pool.get)
+    self.assertEquals(engine.execute('select 1').scalar(), 1)
+    self.assertEquals(self.pool.stats()['in_use'], 0)
+    self.assertEquals(self.pool.stats()['size'], 1)
 
 
 #class SqlCatalog(test_backend_kvs.KvsCatalog):
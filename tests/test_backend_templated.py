@@ -0,0 +1,141 @@
+import os
+import shutil
+import tempfile
+
+from keystone import catalog
+from keystone import config
+from keystone import test
+from keystone.catalog.backends import templated as catalog_templated
+
+
+CONF = config.CONF
+
+
+class TemplatedCatalog(test.TestCase):
+  def setUp(self):
+    super(TemplatedCatalog, self).setUp()
+    CONF.public_port = '5000'
+    self.catalog_api = catalog_templated.TemplatedCatalog(templates={
+        'RegionOne': {
+            'compute': {
+                'publicURL': 'http://localhost:$(public_port)s/$(tenant_id)s',
+                'name': "'Compute Service'"},
+            'identity': {
+                'publicURL': 'http://localhost:$(public_port)s/v2.0',
+                'name': "'Identity Service'"}}})
+
+  def test_get_catalog(self):
+    catalog_ref = self.catalog_api.get_catalog('foo', 'bar')
+    self.assertDictEquals(catalog_ref, {
+        'RegionOne': {
+            'compute': {
+                'publicURL': 'http://localhost:5000/bar',
+                'name': "'Compute Service'"},
+            'identity': {
+                'publicURL': 'http://localhost:5000/v2.0',
+                'name': "'Identity Service'"}}})
+    self.assertEquals(self.catalog_api.conf_keys, ['public_port'])
+
+  def test_rendered_catalog_is_cached(self):
+    self.catalog_api.get_catalog('foo', 'bar')
+    self.catalog_api.get_catalog('foo', 'bar')
+    self.assertEquals(self.catalog_api.catalog_cache.misses, 1)
+    self.assertEquals(self.catalog_api.catalog_cache.hits, 1)
+
+    catalog_ref = self.catalog_api.get_catalog('foo', 'baz')
+    self.assertEquals(catalog_ref['RegionOne']['compute']['publicURL'],
+                      'http://localhost:5000/baz')
+    self.assertEquals(self.catalog_api.catalog_cache.misses, 2)
+
+  def test_config_change_is_rendered(self):
+    self.catalog_api.get_catalog('foo', 'bar')
+    CONF.public_port = '5001'
+    catalog_ref = self.catalog_api.get_catalog('foo', 'bar')
+    self.assertEquals(catalog_ref['RegionOne']['identity']['publicURL'],
+                      'http://localhost:5001/v2.0')
+
+  def test_cached_catalog_is_not_shared(self):
+    catalog_ref = self.catalog_api.get_catalog('foo', 'bar')
+    catalog_ref['RegionOne']['compute'].pop('name')
+    catalog_ref = self.catalog_api.get_catalog('foo', 'bar')
+    self.assertEquals(catalog_ref['RegionOne']['compute']['name'],
+                      "'Compute Service'")
+
+  def test_catalog_version(self):
+    version = self.catalog_api.get_catalog_version()
+    self.assertEquals(self.catalog_api.get_catalog_version(), version)
+    CONF.public_port = '5001'
+    self.assertNotEquals(self.catalog_api.get_catalog_version(), version)
+
+
+class TemplatedCatalogFile(test.TestCase):
+  def setUp(self):
+    super(TemplatedCatalogFile, self).setUp()
+    self.tmpdir = tempfile.mkdtemp()
+    self.template_file = os.path.join(self.tmpdir, 'catalog.templates')
+    self._write_templates('Compute Service')
+    CONF.set_override('template_file', self.template_file, group='catalog')
+    self.catalog_api = catalog_templated.TemplatedCatalog()
+
+  def tearDown(self):
+    CONF.set_override('template_file', None, group='catalog')
+    shutil.rmtree(self.tmpdir)
+    super(TemplatedCatalogFile, self).tearDown()
+
+  def _write_templates(self, name):
+    with open(self.template_file, 'w') as f:
+      f.write('catalog.RegionOne.compute.publicURL = http://localhost/\n')
+      f.write('catalog.RegionOne.compute.name = %s\n' % name)
+
+  def test_modified_templates_are_reloaded(self):
+    version = self.catalog_api.get_catalog_version()
+    catalog_ref = self.catalog_api.get_catalog('foo', 'bar')
+    self.assertEquals(catalog_ref['RegionOne']['compute']['name'],
+                      'Compute Service')
+
+    self._write_templates('Other Service')
+    mtime = os.stat(self.template_file).st_mtime
+    os.utime(self.template_file, (mtime + 10, mtime + 10))
+
+    self.assertNotEquals(self.catalog_api.get_catalog_version(), version)
+    catalog_ref = self.catalog_api.get_catalog('foo', 'bar')
+    self.assertEquals(catalog_ref['RegionOne']['compute']['name'],
+                      'Other Service')
+
+
+class FormattedCatalog(test.TestCase):
+  def setUp(self):
+    super(FormattedCatalog, self).setUp()
+    self.catalog_api = catalog.Manager()
+
+  def test_format_catalog(self):
+    catalog_ref = {'RegionOne': {'compute': {'publicURL': 'http://one/',
+                                             'name': 'Compute'}},
+                   'RegionTwo': {'compute': {'publicURL': 'http://two/',
+                                             'name': 'Compute'}}}
+    formatted = catalog.format_catalog(catalog_ref)
+    self.assertEquals(len(formatted), 1)
+    self.assertEquals(formatted[0]['name'], 'Compute')
+    self.assertEquals(formatted[0]['type'], 'compute')
+    self.assertEquals(
+        sorted((x['region'], x['publicURL'])
+               for x in formatted[0]['endpoints']),
+        [('RegionOne', 'http://one/'), ('RegionTwo', 'http://two/')])
+
+    # the source catalog is left alone
+    self.assertEquals(catalog_ref['RegionOne']['compute'],
+                      {'publicURL': 'http://one/', 'name': 'Compute'})
+    self.assertEquals(catalog.format_catalog({}), {})
+
+  def test_formatted_catalog_is_cached(self):
+    formatted = self.catalog_api.get_formatted_catalog(None, 'foo', 'bar')
+    self.assert_(
+        self.catalog_api.get_formatted_catalog(None, 'foo', 'bar')
+        is formatted)
+    self.assertEquals(self.catalog_api.formatted_cache.hits, 1)
+
+    CONF.compute_port = '9999'
+    formatted = self.catalog_api.get_formatted_catalog(None, 'foo', 'bar')
+    compute_ref = [x for x in formatted if x['type'] == 'compute'][0]
+    self.assertEquals(compute_ref['endpoints'][0]['publicURL'],
+                      'http://localhost:9999/v1.1/bar')
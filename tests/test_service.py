@@ -0,0 +1,242 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+import datetime
+import json
+
+import webob.exc
+
+from keystone import config
+from keystone import identity
+from keystone import service
+from keystone import test
+from keystone import token
+from keystone.common import utils
+
+import default_fixtures
+
+
+CONF = config.CONF
+
+
+class EmbeddedTokenTestCase(test.TestCase):
+    def setUp(self):
+        super(EmbeddedTokenTestCase, self).setUp()
+        CONF.set_override('embed_roles', True, group='token')
+        CONF.set_override('embed_catalog', True, group='token')
+        self.load_backends()
+        self.load_fixtures(default_fixtures)
+        self.identity_api.update_metadata(
+                self.user_foo['id'], self.tenant_bar['id'],
+                dict(roles=['keystone_admin', 'useless']))
+
+        self.token_controller = service.TokenController()
+        self.role_controller = identity.RoleController()
+        self.context = {'is_admin': True}
+
+    def tearDown(self):
+        CONF.set_override('embed_roles', None, group='token')
+        CONF.set_override('embed_catalog', None, group='token')
+        super(EmbeddedTokenTestCase, self).tearDown()
+
+    def _authenticate(self):
+        auth = {'passwordCredentials': {'username': self.user_foo['name'],
+                                        'password': self.user_foo['password']},
+                'tenantId': self.tenant_bar['id']}
+        o = self.token_controller.authenticate(self.context, auth=auth)
+        return o['access']
+
+    def test_roles_and_catalog_are_embedded(self):
+        access = self._authenticate()
+        token_ref = self.token_api.get_token(access['token']['id'])
+        self.assertEquals(token_ref['roles'], access['user']['roles'])
+        self.assertEquals(token_ref['catalog'], access['serviceCatalog'])
+        self.assertEquals(
+                sorted(x['id'] for x in token_ref['roles']),
+                ['keystone_admin', 'useless'])
+
+    def test_validate_uses_embedded_roles(self):
+        access = self._authenticate()
+        token_id = access['token']['id']
+        token_ref = self.token_api.get_token(token_id)
+        token_ref['roles'] = [{'id': 'useless', 'name': 'Embedded'}]
+        self.token_api.create_token(token_id, token_ref)
+
+        o = json.loads(
+                self.token_controller.validate_token(self.context, token_id))
+        self.assertEquals(o['access']['user']['roles'],
+                          [{'id': 'useless', 'name': 'Embedded'}])
+
+    def test_deleting_role_revokes_tokens(self):
+        access = self._authenticate()
+        token_id = access['token']['id']
+        other_token_id = self.token_api.create_token(
+                'other', {'id': 'other', 'user': self.user_foo})['id']
+
+        self.role_controller.delete_role(self.context, 'useless')
+        self.assert_(self.token_api.get_token(token_id) is None)
+        self.assert_(self.token_api.get_token(other_token_id) is not None)
+
+    def test_removing_role_revokes_tokens(self):
+        access = self._authenticate()
+        token_id = access['token']['id']
+        self.role_controller.remove_role_from_user(
+                self.context, self.user_foo['id'], 'keystone_admin',
+                tenant_id=self.tenant_bar['id'])
+        self.assert_(self.token_api.get_token(token_id) is None)
+
+    def test_removing_legacy_role_ref_revokes_tokens(self):
+        access = self._authenticate()
+        token_id = access['token']['id']
+        role_ref_id = 'tenantId=%s&roleId=useless' % self.tenant_bar['id']
+        self.role_controller.delete_role_ref(
+                self.context, self.user_foo['id'], role_ref_id)
+        self.assert_(self.token_api.get_token(token_id) is None)
+
+    def test_deleting_role_reads_tokens_once(self):
+        self._authenticate()
+        db = self.role_controller.token_api.driver.db
+        items = db.items
+        scans = []
+
+        def counting_items():
+            scans.append(True)
+            return items()
+
+        db.items = counting_items
+        try:
+            self.role_controller.delete_role(self.context, 'useless')
+        finally:
+            del db.items
+        self.assertEquals(len(scans), 1)
+
+    def test_nothing_is_revoked_without_embedded_roles(self):
+        CONF.set_override('embed_roles', False, group='token')
+        access = self._authenticate()
+        token_id = access['token']['id']
+        self.role_controller.token_api = None
+        self.role_controller.delete_role(self.context, 'useless')
+        self.assert_(self.token_api.get_token(token_id) is not None)
+
+
+class ValidateTokenTestCase(test.TestCase):
+    def setUp(self):
+        super(ValidateTokenTestCase, self).setUp()
+        self.load_backends()
+        self.load_fixtures(default_fixtures)
+        self.identity_api.update_metadata(
+                self.user_foo['id'], self.tenant_bar['id'],
+                dict(roles=['keystone_admin']))
+
+        self.token_controller = service.TokenController()
+        self.role_controller = identity.RoleController()
+        self.context = {'is_admin': True}
+        self.token_id = self.token_api.create_token(
+                'validate', {'id': 'validate',
+                             'expires': '',
+                             'user': self.user_foo,
+                             'tenant': self.tenant_bar,
+                             'metadata': {'roles': ['keystone_admin']},
+                             'roles': [{'id': 'keystone_admin',
+                                        'name': 'Keystone Admin'}]})['id']
+
+    def tearDown(self):
+        CONF.set_override('embed_roles', None, group='token')
+        super(ValidateTokenTestCase, self).tearDown()
+
+    def test_response_is_cached(self):
+        body = self.token_controller.validate_token(self.context,
+                                                    self.token_id)
+        o = json.loads(body)
+        self.assertEquals(o['access']['token']['id'], self.token_id)
+        self.assertEquals(o['access']['user']['roles'][0]['id'],
+                          'keystone_admin')
+
+        self.assert_(self.token_controller.validate_token(
+                self.context, self.token_id) is body)
+        self.assertEquals(self.token_controller.validate_cache.hits, 1)
+
+    def test_deleted_token_is_evicted(self):
+        self.token_controller.validate_token(self.context, self.token_id)
+        self.token_controller.delete_token(self.context, self.token_id)
+        self.assertEquals(len(self.token_controller.validate_cache), 0)
+        self.assertRaises(webob.exc.HTTPNotFound,
+                          self.token_controller.validate_token,
+                          self.context, self.token_id)
+
+    def test_token_deleted_elsewhere_is_evicted(self):
+        self.token_controller.validate_token(self.context, self.token_id)
+        self.token_api.delete_token(self.token_id)
+        self.assertRaises(webob.exc.HTTPNotFound,
+                          self.token_controller.validate_token,
+                          self.context, self.token_id)
+        self.assertEquals(len(self.token_controller.validate_cache), 0)
+
+    def test_cached_until_expiry(self):
+        expires = datetime.datetime.utcnow() + datetime.timedelta(minutes=1)
+        token_ref = self.token_api.get_token(self.token_id)
+        token_ref['expires'] = expires
+        self.token_api.create_token(self.token_id, token_ref)
+
+        self.token_controller.validate_token(self.context, self.token_id)
+        link = self.token_controller.validate_cache._map[self.token_id]
+        self.assertEquals(link[-1], utils.unixtime(expires))
+
+    def test_role_removal_is_seen(self):
+        CONF.set_override('embed_roles', True, group='token')
+        self.token_controller.validate_token(self.context, self.token_id)
+        self.role_controller.remove_role_from_user(
+                self.context, self.user_foo['id'], 'keystone_admin',
+                tenant_id=self.tenant_bar['id'])
+        self.assertRaises(webob.exc.HTTPNotFound,
+                          self.token_controller.validate_token,
+                          self.context, self.token_id)
+
+    def test_looked_up_roles_are_not_cached(self):
+        token_ref = self.token_api.get_token(self.token_id)
+        del token_ref['roles']
+        self.token_api.create_token(self.token_id, token_ref)
+
+        o = json.loads(self.token_controller.validate_token(
+                self.context, self.token_id))
+        self.assertEquals(o['access']['user']['roles'][0]['id'],
+                          'keystone_admin')
+        self.assertEquals(len(self.token_controller.validate_cache), 0)
+
+        self.role_controller.delete_role(self.context, 'keystone_admin')
+        o = json.loads(self.token_controller.validate_token(
+                self.context, self.token_id))
+        self.assertEquals(o['access']['user']['roles'], [])
+
+
+class AuthenticateTestCase(test.TestCase):
+    def setUp(self):
+        super(AuthenticateTestCase, self).setUp()
+        self.load_backends()
+        self.load_fixtures(default_fixtures)
+        self.token_controller = service.TokenController()
+        self.context = {}
+
+    def _fail_to_store(self):
+        def create_token(context, token_id, data):
+            raise token.StorageError('table is full')
+        self.token_controller.token_api.create_token = create_token
+
+    def test_storage_error_with_password(self):
+        self._fail_to_store()
+        auth = {'passwordCredentials': {'username': self.user_foo['name'],
+                                        'password': self.user_foo['password']},
+                'tenantId': self.tenant_bar['id']}
+        self.assertRaises(webob.exc.HTTPServiceUnavailable,
+                          self.token_controller.authenticate,
+                          self.context, auth=auth)
+
+    def test_storage_error_with_token(self):
+        auth = {'passwordCredentials': {'username': self.user_foo['name'],
+                                        'password': self.user_foo['password']}}
+        o = self.token_controller.authenticate(self.context, auth=auth)
+
+        self._fail_to_store()
+        auth = {'token': {'id': o['access']['token']['id']},
+                'tenantId': self.tenant_bar['id']}
+        self.assertRaises(webob.exc.HTTPServiceUnavailable,
+                          self.token_controller.authenticate,
+                          self.context, auth=auth)
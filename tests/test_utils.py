@@ -0,0 +1,115 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+import bcrypt
+import eventlet
+
+from keystone import config
+from keystone import test
+from keystone.common import utils
+
+
+CONF = config.CONF
+
+
+class PasswordTestCase(test.TestCase):
+    def setUp(self):
+        super(PasswordTestCase, self).setUp()
+        self.password_cache = utils._get_password_cache()
+        self.password_cache.clear()
+        self.hashed = utils.hash_password('secrete')
+
+    def test_check_password(self):
+        self.assert_(utils.check_password('secrete', self.hashed))
+        self.assert_(not utils.check_password('wrong', self.hashed))
+        self.assert_(not utils.check_password(None, self.hashed))
+        self.assert_(not utils.check_password('secrete', None))
+
+    def test_successful_check_is_cached(self):
+        self.assert_(utils.check_password('secrete', self.hashed))
+        hits = self.password_cache.hits
+        self.assert_(utils.check_password('secrete', self.hashed))
+        self.assertEquals(self.password_cache.hits, hits + 1)
+
+        # only a keyed digest of the password is kept
+        cached = self.password_cache.get(self.hashed)
+        self.assert_('secrete' not in cached)
+
+        # a cached hash doesn't let other passwords through
+        self.assert_(not utils.check_password('wrong', self.hashed))
+
+    def test_forget_password(self):
+        utils.check_password('secrete', self.hashed)
+        utils.forget_password(self.hashed)
+        self.assertEquals(len(self.password_cache), 0)
+
+    def test_password_needs_rehash(self):
+        self.assert_(not utils.password_needs_rehash(self.hashed))
+        CONF.set_override('bcrypt_strength', 5)
+        try:
+            self.assert_(utils.password_needs_rehash(self.hashed))
+        finally:
+            CONF.set_override('bcrypt_strength', None)
+
+    def test_auth_str_equal(self):
+        self.assert_(utils.auth_str_equal('abc', 'abc'))
+        self.assert_(not utils.auth_str_equal('abc', 'abd'))
+        self.assert_(not utils.auth_str_equal('abc', 'abcd'))
+
+
+class CryptPoolTestCase(test.TestCase):
+    def test_hashing_is_counted(self):
+        calls = utils.get_crypt_pool_stats()['calls']
+        utils.hash_password('secrete')
+        stats = utils.get_crypt_pool_stats()
+        self.assertEquals(stats['calls'], calls + 1)
+        self.assertEquals(stats['waiting'], 0)
+
+    def test_hashes_are_bounded(self):
+        pool = utils.CryptPool(1)
+        salt = bcrypt.gensalt(4)
+        running = []
+        most_running = []
+
+        def hashpw(password, salt):
+            running.append(password)
+            most_running.append(len(running))
+            try:
+                return bcrypt.hashpw(password, salt)
+            finally:
+                running.remove(password)
+
+        pile = eventlet.GreenPile()
+        for password in ['a', 'b', 'c']:
+            pile.spawn(pool.execute, hashpw, password, salt)
+        results = list(pile)
+        self.assertEquals(results, [bcrypt.hashpw(x, salt)
+                                    for x in ['a', 'b', 'c']])
+        self.assertEquals(max(most_running), 1)
+
+        stats = pool.stats()
+        self.assertEquals(stats['calls'], 3)
+        self.assertEquals(stats['peak_waiting'], 2)
+        self.assertEquals(stats['active'], 0)
+        self.assertEquals(stats['waiting'], 0)
+
+    def test_hub_keeps_running(self):
+        pool = utils.CryptPool(1)
+        ticks = []
+
+        def ticker():
+            while True:
+                ticks.append(1)
+                eventlet.sleep(0.001)
+
+        thread = eventlet.spawn(ticker)
+        try:
+            pool.execute(bcrypt.hashpw, 'secrete', bcrypt.gensalt(10))
+        finally:
+            thread.kill()
+        self.assert_(len(ticks) > 1)
+
+    def test_size_zero_runs_inline(self):
+        pool = utils.CryptPool(0)
+        salt = bcrypt.gensalt(4)
+        self.assertEquals(pool.execute(bcrypt.hashpw, 'a', salt),
+                          bcrypt.hashpw('a', salt))
+        self.assertEquals(pool.stats()['calls'], 1)
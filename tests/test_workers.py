@@ -0,0 +1,101 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+import errno
+import os
+import signal
+import socket
+import time
+
+from keystone import test
+from keystone.common import workers
+from keystone.common import wsgi
+
+
+def pid_app(environ, start_response):
+    start_response('200 OK', [('Content-Type', 'text/plain')])
+    return [str(os.getpid())]
+
+
+class SupervisorTestCase(test.TestCase):
+    def setUp(self):
+        super(SupervisorTestCase, self).setUp()
+        self.socket = wsgi.Server(None, 0).listen(host='127.0.0.1')
+        self.port = self.socket.getsockname()[1]
+        self.pid = os.fork()
+        if self.pid == 0:
+            self._run_supervisor()
+
+    def tearDown(self):
+        self._kill(signal.SIGTERM)
+        self.socket.close()
+        super(SupervisorTestCase, self).tearDown()
+
+    def _run_supervisor(self):
+        status = 0
+        try:
+            def start():
+                server = wsgi.Server(pid_app, self.port)
+                server.socket = self.socket
+                server.start()
+                return [server]
+
+            supervisor = workers.Supervisor(1, start, drain_timeout=5)
+            supervisor.respawn_delay = 0
+            supervisor.run()
+        except BaseException:
+            status = 1
+        finally:
+            os._exit(status)
+
+    def _kill(self, signo):
+        try:
+            os.kill(self.pid, signo)
+            os.waitpid(self.pid, 0)
+        except OSError as e:
+            if e.errno not in (errno.ESRCH, errno.ECHILD):
+                raise
+
+    def _get_worker_pid(self):
+        sock = socket.create_connection(('127.0.0.1', self.port))
+        try:
+            sock.sendall('GET / HTTP/1.0\r\n\r\n')
+            response = ''
+            while True:
+                data = sock.recv(4096)
+                if not data:
+                    break
+                response += data
+        finally:
+            sock.close()
+        return int(response.split('\r\n\r\n', 1)[1])
+
+    def _wait_for_new_worker(self, old_pid):
+        for x in range(50):
+            try:
+                pid = self._get_worker_pid()
+            except (socket.error, ValueError, IndexError):
+                pid = None
+            if pid not in (None, old_pid):
+                return pid
+            time.sleep(0.1)
+        self.fail('worker %s was not replaced' % old_pid)
+
+    def test_worker_serves_shared_socket(self):
+        pid = self._get_worker_pid()
+        self.assertNotEquals(pid, self.pid)
+        self.assertNotEquals(pid, os.getpid())
+
+    def test_dead_worker_is_respawned(self):
+        pid = self._get_worker_pid()
+        os.kill(pid, signal.SIGKILL)
+        self._wait_for_new_worker(pid)
+
+    def test_hup_restarts_workers(self):
+        pid = self._get_worker_pid()
+        os.kill(self.pid, signal.SIGHUP)
+        self._wait_for_new_worker(pid)
+
+    def test_term_stops_workers(self):
+        pid = self._get_worker_pid()
+        os.kill(self.pid, signal.SIGTERM)
+        self.assertEquals(os.waitpid(self.pid, 0), (self.pid, 0))
+        self.assertRaises(OSError, os.kill, pid, 0)
@@ -0,0 +1,181 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+import json
+
+import routes
+import webob
+import webob.exc
+
+from keystone import config
+from keystone import test
+from keystone.common import wsgi
+
+
+CONF = config.CONF
+
+
+class FakeApp(wsgi.Application):
+    def index(self, context):
+        limit, marker = self._get_page(context)
+        return wsgi.JsonStream(items=range(5)[:limit], marker=marker)
+
+
+def echo_app(environ, start_response):
+    start_response('200 OK', [('Content-Type', 'application/json')])
+    match = environ['wsgiorg.routing_args'][1].copy()
+    match.pop('controller')
+    return [json.dumps({'match': match,
+                        'path_info': environ['PATH_INFO'],
+                        'script_name': environ['SCRIPT_NAME']})]
+
+
+class Extension(wsgi.ExtensionRouter):
+    def add_routes(self, mapper):
+        mapper.connect('/users/{user_id}/credentials/OS-EC2',
+                       controller=echo_app, action='extension')
+
+
+class RouterTestCase(test.TestCase):
+    def setUp(self):
+        super(RouterTestCase, self).setUp()
+        mapper = routes.Mapper()
+        mapper.connect('/', controller=echo_app, action='root')
+        mapper.connect('/users/{user_id}', controller=echo_app,
+                       action='get_user', conditions=dict(method=['GET']))
+        mapper.connect('/users/{user_id}', controller=echo_app,
+                       action='update_user', conditions=dict(method=['PUT']))
+        mapper.connect('/users/admin', controller=echo_app,
+                       action='get_admin')
+        mapper.connect('/users/{user_id}/roles/{role_id}',
+                       controller=echo_app, action='get_role')
+        self.router = wsgi.Router(mapper)
+        self.app = Extension(self.router)
+
+    def tearDown(self):
+        wsgi.Router.fast_path = True
+        super(RouterTestCase, self).tearDown()
+
+    def _request(self, path, method='GET', **kwargs):
+        req = webob.Request.blank(path, method=method, **kwargs)
+        req.script_name = '/v2.0'
+        response = req.get_response(self.app)
+        if response.status_int == 404:
+            return None
+        return json.loads(response.body)
+
+    def assertMatchesLikeRoutes(self, path, method='GET', **kwargs):
+        wsgi.Router.fast_path = False
+        expected = self._request(path, method, **kwargs)
+        wsgi.Router.fast_path = True
+        self.assertEquals(self._request(path, method, **kwargs), expected)
+        return expected
+
+    def test_simple_routes_use_the_table(self):
+        table = self.router._table
+        self.assert_(table.first_complex is None)
+        self.assert_(table.catch_all is None)
+        self.assert_(self.app._table.catch_all is not None)
+        self.assertEquals(table.match({'REQUEST_METHOD': 'GET',
+                                       'PATH_INFO': '/users/foo'})[1],
+                          self.router.map.matchlist[1])
+
+    def test_matches_like_routes(self):
+        for path in ('/', '/users/foo', '/users/caf%C3%A9', '/users/admin',
+                     '/users/foo/roles/bar', '/users/foo/credentials/OS-EC2',
+                     '/users/', '/users//roles/bar', '/users/foo/',
+                     '/nothing'):
+            for method in ('GET', 'PUT', 'POST', 'DELETE'):
+                self.assertMatchesLikeRoutes(path, method)
+
+    def test_method_conditions(self):
+        self.assertEquals(self._request('/users/foo')['match'],
+                          {'action': 'get_user', 'user_id': 'foo'})
+        self.assertEquals(self._request('/users/foo', 'PUT')['match'],
+                          {'action': 'update_user', 'user_id': 'foo'})
+        self.assert_(self._request('/users/foo', 'POST') is None)
+
+    def test_first_route_wins(self):
+        self.assertEquals(self._request('/users/admin')['match'],
+                          {'action': 'get_user', 'user_id': 'admin'})
+        self.assertEquals(self._request('/users/admin', 'POST')['match'],
+                          {'action': 'get_admin'})
+
+    def test_extension_passes_path_on(self):
+        body = self.assertMatchesLikeRoutes('/users/foo')
+        self.assertEquals(body['path_info'], '/users/foo')
+        self.assertEquals(
+                self._request('/users/foo/credentials/OS-EC2')['match'],
+                {'action': 'extension', 'user_id': 'foo'})
+
+    def test_method_override_uses_routes(self):
+        self.assert_(self.router._table.match(
+                {'REQUEST_METHOD': 'POST', 'PATH_INFO': '/users/foo',
+                 'QUERY_STRING': '_method=PUT'}) is None)
+        self.assertEquals(
+                self._request('/users/foo?_method=PUT', 'POST')['match'],
+                {'action': 'update_user', 'user_id': 'foo'})
+        self.assertEquals(
+                self.assertMatchesLikeRoutes(
+                        '/users/foo', 'POST',
+                        POST={'_method': 'put'})['match'],
+                {'action': 'update_user', 'user_id': 'foo'})
+
+    def test_complex_routes_use_routes(self):
+        mapper = routes.Mapper()
+        mapper.connect(r'/users/{user_id:\d+}', controller=echo_app,
+                       action='by_number')
+        mapper.connect('/users/{user_id}', controller=echo_app,
+                       action='get_user')
+        self.app = wsgi.Router(mapper)
+        self.assertEquals(self.app._table.first_complex, 0)
+        self.assertEquals(self.assertMatchesLikeRoutes('/users/1')['match'],
+                          {'action': 'by_number', 'user_id': '1'})
+        self.assertEquals(self.assertMatchesLikeRoutes('/users/a')['match'],
+                          {'action': 'get_user', 'user_id': 'a'})
+
+
+class JsonStreamTestCase(test.TestCase):
+    def test_encodes_like_json(self):
+        result = wsgi.JsonStream(users=[{'id': x, 'name': 'user %s' % x}
+                                        for x in range(100)],
+                                 empty=[],
+                                 other={'a': [1, None]})
+        result.chunk_size = 100
+        chunks = list(result.iterencode())
+        self.assert_(len(chunks) > 10)
+        self.assert_(all(len(x) < 200 for x in chunks))
+        self.assertEquals(json.loads(''.join(chunks)), result)
+
+    def test_application_streams_result(self):
+        app = FakeApp()
+        req = webob.Request.blank('/?limit=2&marker=x')
+        req.environ['wsgiorg.routing_args'] = (
+                (), {'controller': None, 'action': 'index'})
+        response = req.get_response(app)
+        self.assertEquals(json.loads(response.body),
+                          {'items': [0, 1], 'marker': 'x'})
+
+    def test_encodes_generators(self):
+        result = wsgi.JsonStream(items=(x * 2 for x in range(3)))
+        self.assertEquals(json.loads(''.join(result.iterencode())),
+                          {'items': [0, 2, 4]})
+
+    def test_default_and_max_limit(self):
+        app = FakeApp()
+        self.assertEquals(app._get_page({}), (None, None))
+        CONF.set_override('list_limit', 2)
+        CONF.set_override('max_list_limit', 3)
+        try:
+            self.assertEquals(app._get_page({}), (2, None))
+            self.assertEquals(
+                    app._get_page({'query_string': {'limit': '10',
+                                                    'marker': 'x'}}),
+                    (3, 'x'))
+        finally:
+            CONF.set_override('list_limit', None)
+            CONF.set_override('max_list_limit', None)
+
+    def test_bad_limit(self):
+        app = FakeApp()
+        for limit in ('foo', '-1'):
+            self.assertRaises(webob.exc.HTTPBadRequest, app._get_page,
+                              {'query_string': {'limit': limit}})
@@ -0,0 +1,110 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+"""
+Micro-benchmark of the time spent routing requests through the admin and
+public pipelines, with and without the Router fast path.
+
+Controllers are replaced by an app that returns straight away, so only the
+work of the routers is measured.
+
+    python tools/bench_routing.py [iterations]
+"""
+
+import os
+import sys
+import timeit
+
+
+ROOT = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+sys.path.insert(0, ROOT)
+
+from keystone import config
+from keystone import service
+from keystone.common import wsgi
+from keystone.contrib import admin_crud
+from keystone.contrib import ec2
+from keystone.contrib import s3
+
+
+CONF = config.CONF
+
+REQUESTS = {
+    'admin': [('GET', '/'),
+              ('POST', '/tokens'),
+              ('GET', '/tokens/0123456789abcdef'),
+              ('GET', '/tenants/bar'),
+              ('GET', '/users/foo/roles'),
+              ('PUT', '/tenants/bar/users/foo/roles/OS-KSADM/admin'),
+              ('GET', '/OS-KSADM/roles'),
+              ('GET', '/users/foo/credentials/OS-EC2'),
+              ('GET', '/no/such/path')],
+    'public': [('GET', '/'),
+               ('POST', '/tokens'),
+               ('GET', '/tenants'),
+               ('POST', '/ec2tokens'),
+               ('GET', '/no/such/path')],
+}
+
+
+def ok_app(environ, start_response):
+    start_response('200 OK', [])
+    return []
+
+
+def start_response(status, headers, exc_info=None):
+    pass
+
+
+def stub_controllers(router, seen=None):
+    """Swap the controllers of `router` and the routers it leads to."""
+    if seen is None:
+        seen = set()
+    seen.add(router)
+    for route in router.map.matchlist:
+        controller = route.defaults.get('controller')
+        if isinstance(controller, wsgi.Router):
+            if controller not in seen:
+                stub_controllers(controller, seen)
+        elif controller is not None:
+            route.defaults['controller'] = ok_app
+
+
+def build_apps():
+    admin = ec2.Ec2Extension(admin_crud.CrudExtension(service.AdminRouter()))
+    public = s3.S3Extension(ec2.Ec2Extension(service.PublicRouter()))
+    stub_controllers(admin)
+    stub_controllers(public)
+    return {'admin': admin, 'public': public}
+
+
+def route_all(app, requests):
+    for method, path in requests:
+        environ = {'REQUEST_METHOD': method,
+                   'PATH_INFO': path,
+                   'SCRIPT_NAME': '',
+                   'QUERY_STRING': '',
+                   'SERVER_NAME': 'localhost',
+                   'SERVER_PORT': '35357',
+                   'wsgi.url_scheme': 'http'}
+        app(environ, start_response)
+
+
+def main(iterations):
+    os.chdir(ROOT)
+    CONF(config_files=[os.path.join(ROOT, 'etc', 'keystone.conf')])
+    apps = build_apps()
+
+    for name in sorted(apps):
+        requests = REQUESTS[name]
+        count = iterations * len(requests)
+        for fast_path in (False, True):
+            wsgi.Router.fast_path = fast_path
+            timer = timeit.Timer(lambda: route_all(apps[name], requests))
+            elapsed = min(timer.repeat(3, iterations))
+            print '%-7s fast_path=%-5s %8.1f us/request' % (
+                name, fast_path, elapsed / count * 1e6)
+    wsgi.Router.fast_path = True
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 2000)